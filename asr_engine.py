@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime ASR引擎
+将sencevoice_model_path下的SenseVoice ONNX模型加载为一组CPU会话，
+并发请求从会话池中取用空闲会话，短时间内到达的请求合并为一个批次推理
+
+运行 python asr_engine.py 会生成一个小型合成ONNX模型(需要onnx包)，
+对比不同会话池大小下的吞吐量和延迟，无需真实模型权重
+"""
+
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+except ImportError:  # 可选依赖，只有使用onnx后端时才需要
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE_CANDIDATES = ("model.int8.onnx", "model.onnx")
+SPECIAL_TOKEN_PATTERN = re.compile(r"^<\|.*\|>$")
+
+
+@dataclass
+class ASREngineConfig:
+    """ASR引擎配置"""
+    model_path: str
+    tokens_path: Optional[str] = None
+    # 所有会话共享的intra-op线程预算，按会话数平分
+    intra_op_threads: int = 4
+    pool_size: int = 2
+    max_batch_size: int = 4
+    batch_timeout_ms: float = 10.0
+    warmup: bool = True
+    lfr_m: int = 7
+    lfr_n: int = 6
+    language: int = 0  # 0为自动识别语言
+    text_norm: int = 15  # 不做逆文本正则化
+    blank_id: int = 0
+
+
+def resolve_model_files(model_path: str, tokens_path: Optional[str] = None) -> Tuple[str, str, Optional[str]]:
+    """
+    解析模型目录，返回 (onnx模型文件, 词表文件, CMVN文件)
+
+    model_path可以是.onnx文件，也可以是包含model.onnx和tokens.txt的目录
+    """
+    if os.path.isdir(model_path):
+        model_dir = model_path
+        model_file = next((os.path.join(model_dir, name) for name in MODEL_FILE_CANDIDATES
+                           if os.path.exists(os.path.join(model_dir, name))), None)
+        if model_file is None:
+            raise FileNotFoundError(f"模型目录中没有找到ONNX模型: {model_path}")
+    else:
+        model_dir = os.path.dirname(model_path)
+        model_file = model_path
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(f"ONNX模型不存在: {model_path}")
+
+    tokens_file = tokens_path or os.path.join(model_dir, "tokens.txt")
+    if not os.path.exists(tokens_file):
+        raise FileNotFoundError(f"词表文件不存在: {tokens_file}")
+
+    cmvn_file = os.path.join(model_dir, "am.mvn")
+    return model_file, tokens_file, cmvn_file if os.path.exists(cmvn_file) else None
+
+
+def load_tokens(tokens_file: str) -> List[str]:
+    """加载词表，每行为 "token id" 或仅token"""
+    tokens: Dict[int, str] = {}
+    with open(tokens_file, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            parts = line.rstrip("\n").rsplit(" ", 1)
+            if len(parts) == 2 and parts[1].isdigit():
+                tokens[int(parts[1])] = parts[0]
+            else:
+                tokens[line_no] = line.rstrip("\n")
+    return [tokens.get(i, "") for i in range(max(tokens) + 1)] if tokens else []
+
+
+def load_cmvn(cmvn_file: str) -> Tuple[np.ndarray, np.ndarray]:
+    """解析Kaldi nnet格式的am.mvn，返回 (AddShift, Rescale) 向量"""
+    with open(cmvn_file, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    vectors = []
+    for tag in ("<AddShift>", "<Rescale>"):
+        start = content.index(tag)
+        left = content.index("[", start)
+        right = content.index("]", left)
+        vectors.append(np.array(content[left + 1:right].split(), dtype=np.float32))
+    return vectors[0], vectors[1]
+
+
+class OnnxSessionPool:
+    """
+    ONNX Runtime CPU会话池
+
+    每个会话固定使用 intra_op_threads / pool_size 个线程，推理在独立线程池中执行，不阻塞事件循环
+    """
+
+    def __init__(self, model_file: str, pool_size: int = 2, intra_op_threads: int = 4):
+        if ort is None:
+            raise ImportError("使用ONNX ASR后端需要安装onnxruntime: pip install onnxruntime")
+
+        self.model_file = model_file
+        self.pool_size = max(1, pool_size)
+        self.threads_per_session = max(1, intra_op_threads // self.pool_size)
+
+        self.sessions = [self._create_session() for _ in range(self.pool_size)]
+        self._idle: asyncio.Queue = asyncio.Queue()
+        for session in self.sessions:
+            self._idle.put_nowait(session)
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="asr-onnx")
+
+        self.stats = {
+            "runs": 0,
+            "run_seconds": 0.0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0
+        }
+
+    def _create_session(self):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads_per_session
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return ort.InferenceSession(self.model_file, sess_options=options, providers=["CPUExecutionProvider"])
+
+    @property
+    def input_names(self) -> List[str]:
+        return [item.name for item in self.sessions[0].get_inputs()]
+
+    @property
+    def output_names(self) -> List[str]:
+        return [item.name for item in self.sessions[0].get_outputs()]
+
+    @property
+    def busy(self) -> int:
+        return self.pool_size - self._idle.qsize()
+
+    async def run(self, feeds: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        """取一个空闲会话执行推理"""
+        wait_start = time.perf_counter()
+        session = await self._idle.get()
+        wait = time.perf_counter() - wait_start
+        self.stats["wait_seconds"] += wait
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], wait)
+
+        try:
+            run_start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            outputs = await loop.run_in_executor(self._executor, session.run, None, feeds)
+            self.stats["runs"] += 1
+            self.stats["run_seconds"] += time.perf_counter() - run_start
+            return outputs
+        finally:
+            self._idle.put_nowait(session)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class OnnxASREngine:
+    """
+    基于ONNX Runtime的SenseVoice识别引擎
+
+    输入为共享fbank前端的LFR拼帧特征，输出经CTC贪心解码为文本
+    """
+
+    def __init__(self, config: ASREngineConfig):
+        self.config = config
+        self.pool: Optional[OnnxSessionPool] = None
+        self.tokens: List[str] = []
+        self.cmvn: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.loaded = False
+
+        self._pending: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._batch_task: Optional[asyncio.Task] = None
+        # 正在推理的批次，保留引用避免任务在完成前被回收
+        self._tasks = set()
+
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "batched_requests": 0,
+            "load_seconds": 0.0,
+            "warmup_seconds": 0.0
+        }
+
+    def load(self):
+        """加载模型和词表，创建会话池"""
+        start = time.perf_counter()
+        model_file, tokens_file, cmvn_file = resolve_model_files(self.config.model_path, self.config.tokens_path)
+        self.tokens = load_tokens(tokens_file)
+        self.cmvn = load_cmvn(cmvn_file) if cmvn_file else None
+        self.pool = OnnxSessionPool(model_file, self.config.pool_size, self.config.intra_op_threads)
+        self.loaded = True
+        self.stats["load_seconds"] = time.perf_counter() - start
+        logger.info(f"🧠 ASR模型已加载: {model_file} (会话数 {self.pool.pool_size}, "
+                    f"每会话线程 {self.pool.threads_per_session}, 耗时 {self.stats['load_seconds']:.2f}s)")
+
+    async def warmup(self, seconds: float = 1.0):
+        """用静音特征在每个会话上各跑一次推理，避免首个请求承担初始化开销"""
+        start = time.perf_counter()
+        frames = max(1, int(seconds * 100 / self.config.lfr_n))
+        dummy = np.zeros((frames, self._feature_dim()), dtype=np.float32)
+        await asyncio.gather(*(self._run_batch([dummy]) for _ in range(self.pool.pool_size)))
+        self.stats["warmup_seconds"] = time.perf_counter() - start
+        logger.info(f"🔥 ASR预热完成, 耗时 {self.stats['warmup_seconds']:.2f}s")
+
+    def _feature_dim(self) -> int:
+        shape = self.pool.sessions[0].get_inputs()[0].shape
+        return shape[-1] if isinstance(shape[-1], int) else 80 * self.config.lfr_m
+
+    async def transcribe(self, features: np.ndarray) -> str:
+        """
+        识别一条语音
+
+        Args:
+            features: LFR拼帧后的特征，形状为 (帧数, 维度)
+        """
+        if not self.loaded:
+            raise RuntimeError("ASR模型未加载")
+
+        self.stats["requests"] += 1
+        if self.config.max_batch_size <= 1:
+            return (await self._run_batch([features]))[0]
+
+        if self._batch_task is None or self._batch_task.done():
+            self._batch_ready = asyncio.Event()
+            self._batch_task = asyncio.create_task(self._batch_loop())
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((features, future))
+        self._batch_ready.set()
+        return await future
+
+    async def _batch_loop(self):
+        """收集batch_timeout_ms内到达的请求，合并为批次推理"""
+        while True:
+            await self._batch_ready.wait()
+            if len(self._pending) < self.config.max_batch_size:
+                await asyncio.sleep(self.config.batch_timeout_ms / 1000)
+
+            batch = self._pending[:self.config.max_batch_size]
+            del self._pending[:len(batch)]
+            if not self._pending:
+                self._batch_ready.clear()
+
+            # 已取消的请求(如被新语音打断)不再参与推理
+            batch = [(features, future) for features, future in batch if not future.done()]
+            if batch:
+                task = asyncio.create_task(self._dispatch(batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        try:
+            texts = await self._run_batch([features for features, _ in batch])
+            for (_, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _run_batch(self, batch: List[np.ndarray]) -> List[str]:
+        """补齐到同一长度后执行一次推理"""
+        lengths = np.array([len(features) for features in batch], dtype=np.int32)
+        max_len = max(int(lengths.max()), 1)
+        dim = batch[0].shape[1]
+
+        inputs = np.zeros((len(batch), max_len, dim), dtype=np.float32)
+        for i, features in enumerate(batch):
+            inputs[i, :len(features)] = features
+        if self.cmvn is not None:
+            shift, scale = self.cmvn
+            inputs = (inputs + shift) * scale
+
+        feeds = {}
+        for name in self.pool.input_names:
+            if name in ("x", "speech", "features"):
+                feeds[name] = inputs
+            elif name in ("x_length", "x_lens", "speech_lengths"):
+                feeds[name] = lengths
+            elif name == "language":
+                feeds[name] = np.full(len(batch), self.config.language, dtype=np.int32)
+            elif name == "text_norm":
+                feeds[name] = np.full(len(batch), self.config.text_norm, dtype=np.int32)
+            else:
+                raise ValueError(f"未知的模型输入: {name}")
+
+        outputs = await self.pool.run(feeds)
+        self.stats["batches"] += 1
+        self.stats["batched_requests"] += len(batch)
+
+        logits = outputs[0]
+        # 模型可能在特征前拼接查询向量(SenseVoice为4帧)，输出长度相应增加
+        offset = logits.shape[1] - max_len
+        return self.ctc_greedy_decode(logits, lengths + offset)
+
+    def ctc_greedy_decode(self, logits: np.ndarray, lengths: np.ndarray) -> List[str]:
+        """CTC贪心解码，合并重复并去掉blank和特殊标记"""
+        ids = logits.argmax(axis=-1)
+        keep = ids != self.config.blank_id
+        keep[:, 1:] &= ids[:, 1:] != ids[:, :-1]
+        keep &= np.arange(ids.shape[1])[None, :] < lengths[:, None]
+
+        texts = []
+        for row, mask in zip(ids, keep):
+            pieces = [self.tokens[i] for i in row[mask] if i < len(self.tokens)]
+            text = "".join(piece for piece in pieces if not SPECIAL_TOKEN_PATTERN.match(piece))
+            texts.append(text.replace("▁", " ").strip())
+        return texts
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        if self.stats["batches"]:
+            stats["avg_batch_size"] = round(self.stats["batched_requests"] / self.stats["batches"], 2)
+        if self.pool is not None:
+            stats["pool"] = {**self.pool.stats, "size": self.pool.pool_size, "busy": self.pool.busy,
+                             "threads_per_session": self.pool.threads_per_session}
+        return stats
+
+    def close(self):
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        if self.pool is not None:
+            self.pool.close()
+
+
+def build_synthetic_model(model_dir: str, feature_dim: int = 560, vocab_size: int = 32, hidden: int = 256) -> str:
+    """
+    生成一个结构与SenseVoice接口一致的小型ONNX模型和词表
+
+    输入 x[B, T, D] / x_length[B] / language[B] / text_norm[B]，输出 logits[B, T, V]
+    """
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    w1 = numpy_helper.from_array(rng.standard_normal((feature_dim, hidden)).astype(np.float32) * 0.05, "w1")
+    w2 = numpy_helper.from_array(rng.standard_normal((hidden, vocab_size)).astype(np.float32) * 0.05, "w2")
+    nodes = [
+        helper.make_node("MatMul", ["x", "w1"], ["h"]),
+        helper.make_node("Relu", ["h"], ["h_relu"]),
+        helper.make_node("MatMul", ["h_relu", "w2"], ["logits"]),
+    ]
+    graph = helper.make_graph(
+        nodes, "synthetic_sensevoice",
+        inputs=[
+            helper.make_tensor_value_info("x", TensorProto.FLOAT, ["B", "T", feature_dim]),
+            helper.make_tensor_value_info("x_length", TensorProto.INT32, ["B"]),
+            helper.make_tensor_value_info("language", TensorProto.INT32, ["B"]),
+            helper.make_tensor_value_info("text_norm", TensorProto.INT32, ["B"]),
+        ],
+        outputs=[helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["B", "T", vocab_size])],
+        initializer=[w1, w2],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8  # 兼容较旧的onnxruntime
+    os.makedirs(model_dir, exist_ok=True)
+    model_file = os.path.join(model_dir, "model.onnx")
+    onnx.save(model, model_file)
+
+    with open(os.path.join(model_dir, "tokens.txt"), "w", encoding="utf-8") as f:
+        f.write("<blk> 0\n")
+        for i in range(1, vocab_size):
+            f.write(f"{chr(0x4e00 + i)} {i}\n")
+    return model_file
+
+
+async def _benchmark_pool(model_dir: str, pool_size: int, threads: int, concurrency: int, requests: int) -> Dict[str, float]:
+    engine = OnnxASREngine(ASREngineConfig(model_path=model_dir, intra_op_threads=threads, pool_size=pool_size))
+    engine.load()
+    await engine.warmup()
+
+    rng = np.random.default_rng(1)
+    features = [rng.standard_normal((int(rng.integers(30, 90)), 560)).astype(np.float32) for _ in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(feats):
+        async with semaphore:
+            start = time.perf_counter()
+            await engine.transcribe(feats)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(f) for f in features))
+    elapsed = time.perf_counter() - start
+    stats = engine.get_stats()
+    engine.close()
+    return {
+        "throughput": requests / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+        "avg_batch": stats.get("avg_batch_size", 1.0)
+    }
+
+
+def benchmark(pool_sizes=(1, 2, 4), threads: int = 4, concurrency: int = 16, requests: int = 200):
+    """对比不同会话池大小(线程预算固定)的吞吐量和延迟"""
+    with tempfile.TemporaryDirectory() as model_dir:
+        build_synthetic_model(model_dir)
+        print(f"线程预算 {threads}, 并发 {concurrency}, 请求数 {requests}")
+        print(f"{'会话数':>6} {'吞吐(req/s)':>12} {'p50(ms)':>9} {'p95(ms)':>9} {'平均批大小':>10}")
+        for pool_size in pool_sizes:
+            result = asyncio.run(_benchmark_pool(model_dir, pool_size, threads, concurrency, requests))
+            print(f"{pool_size:>6} {result['throughput']:>12.1f} {result['p50_ms']:>9.2f} "
+                  f"{result['p95_ms']:>9.2f} {result['avg_batch']:>10.2f}")
+
+
+if __name__ == "__main__":
+    benchmark()
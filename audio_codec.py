@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+音频编解码
+为audio_response及上传音频提供紧凑编码，全部用NumPy向量化实现:
+- pcm16: 16bit PCM WAV (默认，兼容旧客户端)
+- mulaw: G.711 μ-law，8bit/样本，查表编解码
+- ima_adpcm: IMA ADPCM，4bit/样本，按块编码并在所有块上并行迭代
+
+运行 python audio_codec.py 可对比各格式的传输字节数和编解码耗时
+"""
+
+import base64
+import io
+import time
+import wave
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+CODEC_PCM16 = "pcm16"
+CODEC_MULAW = "mulaw"
+CODEC_IMA_ADPCM = "ima_adpcm"
+
+# 按压缩率从高到低排列，协商时用作服务器偏好顺序
+SUPPORTED_CODECS = (CODEC_IMA_ADPCM, CODEC_MULAW, CODEC_PCM16)
+
+# μ-law (14bit量纲)
+MULAW_BIAS = 0x21
+MULAW_CLIP = 8159
+MULAW_SEGMENT_END = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF], dtype=np.int32)
+
+# IMA ADPCM: 每块256字节 = 4字节块头 + 252字节(504个4bit码)，共505个样本
+ADPCM_BLOCK_BYTES = 256
+ADPCM_SAMPLES_PER_BLOCK = (ADPCM_BLOCK_BYTES - 4) * 2 + 1
+
+ADPCM_STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+], dtype=np.int32)
+
+ADPCM_INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+
+
+class AudioCodecError(ValueError):
+    """音频编解码错误"""
+
+
+def _build_mulaw_tables():
+    # 编码表: 覆盖全部65536个int16取值，编码时直接按uint16视图查表
+    # 与G.711参考实现一致: 先右移2位得到14bit样本再分段量化
+    pcm = np.arange(-32768, 32768, dtype=np.int32)
+    value = pcm >> 2
+    mask = np.where(value < 0, 0x7F, 0xFF)
+    value = np.minimum(np.abs(value), MULAW_CLIP) + MULAW_BIAS
+    segment = np.searchsorted(MULAW_SEGMENT_END, value)
+    encoded = np.where(segment < 8, (segment << 4) | ((value >> (segment + 1)) & 0x0F), 0x7F) ^ mask
+    encode_table = np.empty(65536, dtype=np.uint8)
+    encode_table[pcm.astype(np.int16).view(np.uint16)] = encoded
+
+    code = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (code >> 4) & 0x07
+    mantissa = code & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    decode_table = np.where(code & 0x80, -magnitude, magnitude).astype(np.int16)
+
+    encode_table.setflags(write=False)
+    decode_table.setflags(write=False)
+    return encode_table, decode_table
+
+
+MULAW_ENCODE_TABLE, MULAW_DECODE_TABLE = _build_mulaw_tables()
+
+
+def mulaw_encode(pcm: np.ndarray) -> bytes:
+    """int16 PCM → μ-law"""
+    return MULAW_ENCODE_TABLE[np.ascontiguousarray(pcm, dtype=np.int16).view(np.uint16)].tobytes()
+
+
+def mulaw_decode(data: bytes) -> np.ndarray:
+    """μ-law → int16 PCM"""
+    return MULAW_DECODE_TABLE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def ima_adpcm_encode(pcm: np.ndarray) -> bytes:
+    """
+    int16 PCM → IMA ADPCM (与WAV格式0x0011的单声道块布局一致)
+
+    各块独立编码(块头携带起始预测值和步长索引)，因此按样本位置迭代、在所有块上并行计算
+    """
+    pcm = np.asarray(pcm, dtype=np.int16)
+    if len(pcm) == 0:
+        return b""
+
+    spb = ADPCM_SAMPLES_PER_BLOCK
+    num_blocks = -(-len(pcm) // spb)
+    blocks = np.zeros(num_blocks * spb, dtype=np.int32)
+    blocks[:len(pcm)] = pcm
+    blocks = blocks.reshape(num_blocks, spb)
+
+    predictor = blocks[:, 0].copy()
+    # 根据块内第一个差值估计起始步长，避免每块都从最小步长爬升
+    first_diff = np.abs(blocks[:, 1] - blocks[:, 0])
+    index = np.clip(np.searchsorted(ADPCM_STEP_TABLE, first_diff // 2), 0, 88).astype(np.int32)
+    header_index = index.copy()
+
+    codes = np.empty((num_blocks, spb - 1), dtype=np.uint8)
+    for i in range(1, spb):
+        step = ADPCM_STEP_TABLE[index]
+        diff = blocks[:, i] - predictor
+        negative = diff < 0
+        diff = np.abs(diff)
+
+        code = np.zeros(num_blocks, dtype=np.int32)
+        delta = step >> 3
+        bit = diff >= step
+        code |= bit << 2
+        diff -= np.where(bit, step, 0)
+        delta += np.where(bit, step, 0)
+        half = step >> 1
+        bit = diff >= half
+        code |= bit << 1
+        diff -= np.where(bit, half, 0)
+        delta += np.where(bit, half, 0)
+        quarter = step >> 2
+        bit = diff >= quarter
+        code |= bit
+        delta += np.where(bit, quarter, 0)
+
+        predictor = np.clip(predictor + np.where(negative, -delta, delta), -32768, 32767)
+        index = np.clip(index + ADPCM_INDEX_TABLE[code], 0, 88)
+        codes[:, i - 1] = code | (negative << 3)
+
+    header = np.zeros((num_blocks, 4), dtype=np.uint8)
+    header[:, 0:2] = blocks[:, 0].astype("<i2").view(np.uint8).reshape(-1, 2)
+    header[:, 2] = header_index
+    packed = codes[:, 0::2] | (codes[:, 1::2] << 4)
+    return np.concatenate([header, packed], axis=1).tobytes()
+
+
+def ima_adpcm_decode(data: bytes) -> np.ndarray:
+    """IMA ADPCM → int16 PCM，最后一块的补零样本会一并返回"""
+    if len(data) % ADPCM_BLOCK_BYTES:
+        raise AudioCodecError(f"IMA ADPCM数据长度必须是{ADPCM_BLOCK_BYTES}的整数倍")
+    if not data:
+        return np.zeros(0, dtype=np.int16)
+
+    raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, ADPCM_BLOCK_BYTES)
+    num_blocks = len(raw)
+    predictor = raw[:, 0:2].copy().view("<i2").ravel().astype(np.int32)
+    index = raw[:, 2].astype(np.int32)
+    if (index > 88).any():
+        raise AudioCodecError("IMA ADPCM块头步长索引越界")
+
+    packed = raw[:, 4:]
+    codes = np.empty((num_blocks, ADPCM_SAMPLES_PER_BLOCK - 1), dtype=np.int32)
+    codes[:, 0::2] = packed & 0x0F
+    codes[:, 1::2] = packed >> 4
+
+    out = np.empty((num_blocks, ADPCM_SAMPLES_PER_BLOCK), dtype=np.int16)
+    out[:, 0] = predictor
+    for i in range(ADPCM_SAMPLES_PER_BLOCK - 1):
+        code = codes[:, i]
+        step = ADPCM_STEP_TABLE[index]
+        delta = step >> 3
+        delta += np.where(code & 4, step, 0)
+        delta += np.where(code & 2, step >> 1, 0)
+        delta += np.where(code & 1, step >> 2, 0)
+        predictor = np.clip(predictor + np.where(code & 8, -delta, delta), -32768, 32767)
+        index = np.clip(index + ADPCM_INDEX_TABLE[code], 0, 88)
+        out[:, i + 1] = predictor
+
+    return out.ravel()
+
+
+def _wav_bytes(pcm: np.ndarray, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.asarray(pcm, dtype="<i2").tobytes())
+    return buffer.getvalue()
+
+
+def encode_audio(pcm: np.ndarray, codec: str, sample_rate: int = 16000) -> bytes:
+    """按编码格式编码int16单声道PCM，pcm16输出完整WAV文件"""
+    if codec == CODEC_PCM16:
+        return _wav_bytes(pcm, sample_rate)
+    if codec == CODEC_MULAW:
+        return mulaw_encode(pcm)
+    if codec == CODEC_IMA_ADPCM:
+        return ima_adpcm_encode(pcm)
+    raise AudioCodecError(f"不支持的音频编码: {codec}")
+
+
+def decode_audio(data: bytes, codec: str) -> np.ndarray:
+    """解码mulaw/ima_adpcm为int16单声道PCM"""
+    if codec == CODEC_MULAW:
+        return mulaw_decode(data)
+    if codec == CODEC_IMA_ADPCM:
+        return ima_adpcm_decode(data)
+    raise AudioCodecError(f"不支持的音频编码: {codec}")
+
+
+def negotiate_codec(client_codecs: Optional[Sequence[str]]) -> str:
+    """按客户端偏好顺序选择第一个服务器支持的编码，默认pcm16"""
+    for codec in client_codecs or ():
+        if codec in SUPPORTED_CODECS:
+            return codec
+    return CODEC_PCM16
+
+
+class CodecStats:
+    """按编码格式统计传输字节数和编解码耗时"""
+
+    def __init__(self):
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def _entry(self, codec: str) -> Dict[str, float]:
+        if codec not in self.stats:
+            self.stats[codec] = {
+                "encoded": 0,
+                "decoded": 0,
+                "pcm_bytes": 0,
+                "wire_bytes": 0,
+                "encode_seconds": 0.0,
+                "decode_seconds": 0.0
+            }
+        return self.stats[codec]
+
+    def record_encode(self, codec: str, pcm_bytes: int, wire_bytes: int, seconds: float):
+        entry = self._entry(codec)
+        entry["encoded"] += 1
+        entry["pcm_bytes"] += pcm_bytes
+        entry["wire_bytes"] += wire_bytes
+        entry["encode_seconds"] += seconds
+
+    def record_decode(self, codec: str, seconds: float):
+        entry = self._entry(codec)
+        entry["decoded"] += 1
+        entry["decode_seconds"] += seconds
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for codec, entry in self.stats.items():
+            result[codec] = {
+                **entry,
+                "compression_ratio": round(entry["wire_bytes"] / entry["pcm_bytes"], 4) if entry["pcm_bytes"] else 0.0,
+                "avg_encode_ms": round(entry["encode_seconds"] * 1000 / entry["encoded"], 3) if entry["encoded"] else 0.0,
+                "avg_decode_ms": round(entry["decode_seconds"] * 1000 / entry["decoded"], 3) if entry["decoded"] else 0.0
+            }
+        return result
+
+
+def benchmark(seconds: float = 5.0, repeats: int = 5, codecs: List[str] = SUPPORTED_CODECS):
+    """各编码格式的传输字节数(base64后)、编解码耗时和信噪比"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(16000 * seconds)) / 16000
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    signal = envelope * (0.3 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 1760 * t))
+    pcm = (np.clip(signal + rng.normal(0, 0.01, len(t)), -1, 1) * 32767).astype(np.int16)
+
+    print(f"{'编码':<10} {'传输字节':>10} {'压缩比':>7} {'编码(ms)':>9} {'解码(ms)':>9} {'SNR(dB)':>8}")
+    for codec in codecs:
+        encode_time = min(_timed(lambda: encode_audio(pcm, codec)) for _ in range(repeats))
+        encoded = encode_audio(pcm, codec)
+        wire = len(base64.b64encode(encoded))
+
+        if codec == CODEC_PCM16:
+            decode_time, decoded = 0.0, pcm
+        else:
+            decode_time = min(_timed(lambda: decode_audio(encoded, codec)) for _ in range(repeats))
+            decoded = decode_audio(encoded, codec)[:len(pcm)]
+
+        noise = decoded.astype(np.float64) - pcm
+        snr = 10 * np.log10(np.sum(pcm.astype(np.float64) ** 2) / max(np.sum(noise ** 2), 1e-9))
+        print(f"{codec:<10} {wire:>10} {wire / len(base64.b64encode(pcm.tobytes())):>7.3f} "
+              f"{encode_time * 1000:>9.2f} {decode_time * 1000:>9.2f} {min(snr, 99.0):>8.1f}")
+
+
+def _timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+音频接入模块
+零拷贝解析上传的WAV(memoryview + np.frombuffer)，向量化完成声道下混和
+多相重采样，统一转换为模型需要的16kHz单声道16bit音频；格式错误的输入尽早拒绝
+
+m4a/AAC等压缩格式(移动端默认录音格式)通过ffmpeg解码，未安装ffmpeg时抛出CompressedAudioError，
+由调用方把原始文件直接交给模型
+
+运行 python audio_ingest.py 可测试各种输入格式的处理吞吐量(MB/s)
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from math import gcd
+from typing import Optional
+
+import numpy as np
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+SUPPORTED_PCM_BITS = (8, 16, 24, 32)
+SUPPORTED_FLOAT_BITS = (32, 64)
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 192000
+MAX_CHANNELS = 8
+
+# 重采样低通滤波器的单侧长度(以max(up, down)为单位)
+RESAMPLE_HALF_TAPS = 10
+# 每次重采样计算的输出样本数，限制中间矩阵的内存占用
+RESAMPLE_CHUNK = 8192
+
+# 压缩音频容器的文件头特征: (特征字节, 偏移, 格式名)
+CONTAINER_SIGNATURES = (
+    (b"ftyp", 4, "m4a"),
+    (b"OggS", 0, "ogg"),
+    (b"ID3", 0, "mp3"),
+    (b"fLaC", 0, "flac"),
+    (b"\x1a\x45\xdf\xa3", 0, "webm"),
+    (b"caff", 0, "caf"),
+    (b"#!AMR", 0, "amr"),
+)
+COMPRESSED_FORMATS = ("m4a", "mp4", "aac", "3gp", "ogg", "opus", "mp3", "flac", "webm", "caf", "amr")
+FFMPEG_TIMEOUT = 30.0
+
+
+class AudioFormatError(ValueError):
+    """音频格式错误"""
+
+
+class CompressedAudioError(AudioFormatError):
+    """压缩格式的音频无法在本进程中解码(未安装ffmpeg)"""
+
+    def __init__(self, container: str):
+        super().__init__(f"{container}格式的音频需要ffmpeg解码")
+        self.container = container
+
+
+@dataclass
+class WavInfo:
+    """WAV头信息"""
+    format_tag: int
+    channels: int
+    sample_rate: int
+    bits_per_sample: int
+    block_align: int
+    data_offset: int
+    data_size: int
+
+    @property
+    def num_frames(self) -> int:
+        return self.data_size // self.block_align
+
+    @property
+    def duration(self) -> float:
+        return self.num_frames / self.sample_rate
+
+
+@dataclass
+class IngestResult:
+    """音频接入结果"""
+    samples: np.ndarray  # 单声道int16
+    sample_rate: int
+    source: WavInfo
+    input_bytes: int
+    elapsed: float
+    resampled: bool
+    container: str = "wav"
+
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / self.sample_rate
+
+    @property
+    def throughput_mbps(self) -> float:
+        """处理吞吐量(MB/s)"""
+        return self.input_bytes / max(self.elapsed, 1e-9) / 1e6
+
+
+def _validate_format(format_tag: int, channels: int, sample_rate: int, bits: int):
+    if format_tag == WAVE_FORMAT_PCM:
+        if bits not in SUPPORTED_PCM_BITS:
+            raise AudioFormatError(f"不支持的PCM位深: {bits}")
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if bits not in SUPPORTED_FLOAT_BITS:
+            raise AudioFormatError(f"不支持的浮点位深: {bits}")
+    else:
+        raise AudioFormatError(f"不支持的WAV编码格式: 0x{format_tag:04x}")
+
+    if not 1 <= channels <= MAX_CHANNELS:
+        raise AudioFormatError(f"不支持的声道数: {channels}")
+    if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+        raise AudioFormatError(f"不支持的采样率: {sample_rate}")
+
+
+def parse_wav_header(buffer) -> WavInfo:
+    """
+    解析WAV头，只读取头部字段，不复制音频数据
+
+    Args:
+        buffer: bytes / bytearray / memoryview
+
+    Returns:
+        WAV头信息，data_offset/data_size指向原缓冲区中的PCM数据
+    """
+    view = memoryview(buffer)
+    total = len(view)
+    if total < 12 or view[0:4] != b"RIFF" or view[8:12] != b"WAVE":
+        raise AudioFormatError("不是有效的RIFF/WAVE音频")
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= total:
+        chunk_id = view[offset:offset + 4].tobytes()
+        chunk_size, = struct.unpack_from("<I", view, offset + 4)
+        body = offset + 8
+
+        if chunk_id == b"fmt ":
+            if chunk_size < 16 or body + 16 > total:
+                raise AudioFormatError("fmt块长度错误")
+            format_tag, channels, sample_rate, _, block_align, bits = struct.unpack_from("<HHIIHH", view, body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                if chunk_size < 40 or body + 26 > total:
+                    raise AudioFormatError("WAVE_FORMAT_EXTENSIBLE格式的fmt块长度错误")
+                format_tag, = struct.unpack_from("<H", view, body + 24)
+            _validate_format(format_tag, channels, sample_rate, bits)
+            if block_align != channels * bits // 8:
+                raise AudioFormatError(f"块对齐错误: {block_align}")
+            fmt = (format_tag, channels, sample_rate, bits, block_align)
+
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise AudioFormatError("data块出现在fmt块之前")
+            # 流式录音可能把长度写成0或0xFFFFFFFF，以实际数据为准
+            available = total - body
+            data_size = available if chunk_size in (0, 0xFFFFFFFF) else min(chunk_size, available)
+            data_size -= data_size % fmt[4]
+            if data_size <= 0:
+                raise AudioFormatError("音频数据为空")
+            return WavInfo(*fmt, data_offset=body, data_size=data_size)
+
+        offset = body + chunk_size + (chunk_size & 1)
+
+    raise AudioFormatError("缺少fmt块" if fmt is None else "缺少data块")
+
+
+def sniff_container(buffer) -> Optional[str]:
+    """根据文件头识别音频容器，无法识别时返回None"""
+    head = memoryview(buffer)[:16].tobytes()
+    if head[0:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    for signature, offset, name in CONTAINER_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return name
+    # 无容器的ADTS/MPEG音频帧以11位同步字开头
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        return "aac" if head[1] & 0x06 == 0 else "mp3"
+    return None
+
+
+def decode_compressed(buffer, container: str, target_rate: int) -> np.ndarray:
+    """
+    用ffmpeg把压缩音频解码为目标采样率的单声道int16
+
+    mp4/m4a的索引可能位于文件末尾，无法从管道读取，因此先写入临时文件
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise CompressedAudioError(container)
+
+    fd, path = tempfile.mkstemp(suffix=f".{container}")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buffer)
+        result = subprocess.run(
+            [ffmpeg, "-nostdin", "-loglevel", "error", "-i", path,
+             "-f", "s16le", "-ac", "1", "-ar", str(target_rate), "pipe:1"],
+            capture_output=True, timeout=FFMPEG_TIMEOUT
+        )
+    except subprocess.TimeoutExpired:
+        raise AudioFormatError(f"{container}音频解码超时")
+    finally:
+        os.remove(path)
+
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", "replace").strip().splitlines()
+        raise AudioFormatError(f"{container}音频解码失败: {message[-1] if message else result.returncode}")
+    if len(result.stdout) < 2:
+        raise AudioFormatError("音频数据为空")
+    return np.frombuffer(result.stdout, dtype="<i2", count=len(result.stdout) // 2)
+
+
+def raw_pcm_info(buffer, sample_rate: int, channels: int, bit_depth: int) -> WavInfo:
+    """为无文件头的PCM数据构造格式信息"""
+    _validate_format(WAVE_FORMAT_PCM, channels, sample_rate, bit_depth)
+    block_align = channels * bit_depth // 8
+    data_size = len(buffer) - len(buffer) % block_align
+    if data_size <= 0:
+        raise AudioFormatError("音频数据为空")
+    return WavInfo(WAVE_FORMAT_PCM, channels, sample_rate, bit_depth, block_align, 0, data_size)
+
+
+def decode_frames(buffer, info: WavInfo) -> np.ndarray:
+    """
+    将PCM数据解码为 (帧数, 声道数) 数组
+
+    16/32bit整数和浮点格式直接返回原缓冲区上的只读视图，其余格式才会分配新数组
+    """
+    count = info.num_frames * info.channels
+    offset = info.data_offset
+    bits = info.bits_per_sample
+
+    if info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        samples = np.frombuffer(buffer, dtype="<f4" if bits == 32 else "<f8", count=count, offset=offset)
+    elif bits == 16:
+        samples = np.frombuffer(buffer, dtype="<i2", count=count, offset=offset)
+    elif bits == 32:
+        samples = np.frombuffer(buffer, dtype="<i4", count=count, offset=offset)
+    elif bits == 8:
+        raw = np.frombuffer(buffer, dtype=np.uint8, count=count, offset=offset)
+        samples = (raw.astype(np.int16) - 128) << 8
+    else:
+        # 24bit: 三字节小端拼成int32高位，保留符号
+        raw = np.frombuffer(buffer, dtype=np.uint8, count=count * 3, offset=offset).reshape(-1, 3)
+        samples = (raw[:, 0].astype(np.int32) << 8) | (raw[:, 1].astype(np.int32) << 16) | (raw[:, 2].astype(np.int32) << 24)
+
+    return samples.reshape(-1, info.channels)
+
+
+def to_float32(frames: np.ndarray) -> np.ndarray:
+    """转换为 [-1, 1] 范围的float32"""
+    if frames.dtype == np.int16:
+        return frames.astype(np.float32) * (1.0 / 32768.0)
+    if frames.dtype == np.int32:
+        return frames.astype(np.float32) * (1.0 / 2147483648.0)
+    return frames.astype(np.float32, copy=False)
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    """float32 [-1, 1] 转换为int16，超出范围的样本截断"""
+    scaled = np.clip(samples * 32768.0, -32768.0, 32767.0)
+    return np.rint(scaled, out=scaled).astype(np.int16)
+
+
+@lru_cache(maxsize=16)
+def polyphase_filter(up: int, down: int) -> np.ndarray:
+    """
+    设计Kaiser窗低通滤波器并按相位拆分
+
+    Returns:
+        形状为 (up, 每相抽头数) 的系数矩阵，第p行对应上采样后第p个相位
+    """
+    max_rate = max(up, down)
+    half_len = RESAMPLE_HALF_TAPS * max_rate
+    cutoff = 1.0 / max_rate
+    n = np.arange(-half_len, half_len + 1, dtype=np.float64)
+    taps = cutoff * np.sinc(cutoff * n) * np.kaiser(len(n), 5.0) * up
+
+    per_phase = -(-len(taps) // up)
+    padded = np.zeros(per_phase * up)
+    padded[:len(taps)] = taps
+    phases = padded.reshape(per_phase, up).T.astype(np.float32)
+    phases.setflags(write=False)
+    return phases
+
+
+def resample_poly(samples: np.ndarray, orig_rate: int, target_rate: int) -> np.ndarray:
+    """
+    多相重采样(float32单声道)
+
+    等效于先插零上采样up倍、低通滤波、再抽取down倍，但只计算实际输出的样本
+    """
+    divisor = gcd(orig_rate, target_rate)
+    up, down = target_rate // divisor, orig_rate // divisor
+    if up == down:
+        return samples
+
+    phases = polyphase_filter(up, down)
+    per_phase = phases.shape[1]
+    # 滤波器中心对齐输出样本，补偿线性相位延迟
+    half_len = RESAMPLE_HALF_TAPS * max(up, down)
+
+    out_len = -(-len(samples) * up // down)
+    padded = np.concatenate([np.zeros(per_phase, dtype=np.float32), samples.astype(np.float32, copy=False),
+                             np.zeros(per_phase, dtype=np.float32)])
+    tap_offsets = np.arange(per_phase)
+    output = np.empty(out_len, dtype=np.float32)
+
+    for start in range(0, out_len, RESAMPLE_CHUNK):
+        positions = np.arange(start, min(start + RESAMPLE_CHUNK, out_len), dtype=np.int64) * down + half_len
+        phase = positions % up
+        index = (positions // up)[:, None] - tap_offsets[None, :] + per_phase
+        np.einsum("ij,ij->i", phases[phase], padded[index], out=output[start:start + len(positions)])
+
+    return output
+
+
+def ingest_audio(audio_bytes, target_rate: int = 16000, audio_format: str = "wav",
+                 sample_rate: Optional[int] = None, channels: Optional[int] = None,
+                 bit_depth: Optional[int] = None) -> IngestResult:
+    """
+    解析并标准化上传的音频
+
+    Args:
+        audio_bytes: 原始音频数据
+        target_rate: 目标采样率
+        audio_format: "wav"，无文件头的"pcm"/"raw"，或m4a/aac/ogg等压缩格式
+        sample_rate/channels/bit_depth: pcm格式时由客户端声明的参数
+
+    Returns:
+        单声道int16、目标采样率的音频
+
+    Raises:
+        AudioFormatError: 格式错误
+        CompressedAudioError: 压缩格式且未安装ffmpeg
+    """
+    start = time.perf_counter()
+    audio_format = (audio_format or "wav").lower()
+
+    # 以文件头为准：客户端可能把m4a录音标成wav，也可能把wav标成m4a
+    container = None if audio_format in ("pcm", "raw") else sniff_container(audio_bytes)
+    if container == "wav":
+        audio_format = "wav"
+    elif container is not None or audio_format in COMPRESSED_FORMATS:
+        container = container or audio_format
+        samples = decode_compressed(audio_bytes, container, target_rate)
+        info = WavInfo(WAVE_FORMAT_PCM, 1, target_rate, 16, 2, 0, len(samples) * 2)
+        return IngestResult(
+            samples=samples,
+            sample_rate=target_rate,
+            source=info,
+            input_bytes=len(audio_bytes),
+            elapsed=time.perf_counter() - start,
+            resampled=False,
+            container=container
+        )
+
+    if audio_format == "wav":
+        info = parse_wav_header(audio_bytes)
+    elif audio_format in ("pcm", "raw"):
+        info = raw_pcm_info(audio_bytes, sample_rate or target_rate, channels or 1, bit_depth or 16)
+    else:
+        raise AudioFormatError(f"不支持的音频格式: {audio_format}")
+
+    frames = decode_frames(audio_bytes, info)
+    resampled = info.sample_rate != target_rate
+
+    if frames.dtype == np.int16 and info.channels == 1 and not resampled:
+        # 快速路径: 已经是目标格式，直接使用原缓冲区上的视图
+        samples = frames[:, 0]
+    else:
+        mono = to_float32(frames).mean(axis=1) if info.channels > 1 else to_float32(frames[:, 0])
+        if resampled:
+            mono = resample_poly(mono, info.sample_rate, target_rate)
+        samples = to_int16(mono)
+
+    return IngestResult(
+        samples=samples,
+        sample_rate=target_rate,
+        source=info,
+        input_bytes=len(audio_bytes),
+        elapsed=time.perf_counter() - start,
+        resampled=resampled
+    )
+
+
+def _make_wav(sample_rate: int, channels: int, bits: int, seconds: float, format_tag: int = WAVE_FORMAT_PCM) -> bytes:
+    """生成测试用WAV数据"""
+    rng = np.random.default_rng(0)
+    count = int(sample_rate * seconds) * channels
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        data = rng.uniform(-0.5, 0.5, count).astype("<f4").tobytes()
+    elif bits == 24:
+        values = rng.integers(-2 ** 22, 2 ** 22, count).astype("<i4")
+        data = values.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    else:
+        data = rng.integers(-2 ** (bits - 2), 2 ** (bits - 2), count).astype(f"<i{bits // 8}").tobytes()
+    block_align = channels * bits // 8
+    header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(data), b"WAVE", b"fmt ", 16, format_tag,
+                         channels, sample_rate, sample_rate * block_align, block_align, bits, b"data", len(data))
+    return header + data
+
+
+def benchmark(seconds: float = 10.0, repeats: int = 5):
+    """各输入格式的处理吞吐量"""
+    cases = [
+        ("16kHz 单声道 16bit", 16000, 1, 16, WAVE_FORMAT_PCM),
+        ("8kHz 单声道 16bit", 8000, 1, 16, WAVE_FORMAT_PCM),
+        ("44.1kHz 立体声 16bit", 44100, 2, 16, WAVE_FORMAT_PCM),
+        ("48kHz 单声道 24bit", 48000, 1, 24, WAVE_FORMAT_PCM),
+        ("48kHz 立体声 float32", 48000, 2, 32, WAVE_FORMAT_IEEE_FLOAT),
+    ]
+    print(f"{'输入格式':<24} {'大小(MB)':>9} {'耗时(ms)':>9} {'吞吐量(MB/s)':>13}")
+    for name, rate, channels, bits, tag in cases:
+        data = _make_wav(rate, channels, bits, seconds, tag)
+        best = min(ingest_audio(data).elapsed for _ in range(repeats))
+        print(f"{name:<24} {len(data) / 1e6:>9.2f} {best * 1000:>9.2f} {len(data) / best / 1e6:>13.1f}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+语音活动检测(VAD)与静音裁剪
+基于短时能量的NumPy向量化实现，在ASR/声纹模型运行之前去除首尾静音，
+并拒绝空白或近乎静音的上传音频
+"""
+
+from dataclasses import dataclass, asdict
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+
+@dataclass
+class VADConfig:
+    """VAD配置"""
+    frame_ms: float = 20.0
+    # 相对于最强帧能量的门限(dB)，低于该值视为静音
+    energy_threshold_db: float = -40.0
+    # 绝对静音门限(dBFS)，整段音频最强帧都低于该值时判定为无语音
+    min_energy_dbfs: float = -55.0
+    # 短于该时长的能量突起视为噪声
+    min_speech_ms: float = 200.0
+    # 裁剪时在语音段前后保留的余量
+    padding_ms: float = 150.0
+
+
+@dataclass
+class VADResult:
+    """VAD结果，start/end为裁剪区间的样本索引"""
+    start: int
+    end: int
+    speech_samples: int
+    total_samples: int
+    sample_rate: int
+
+    @property
+    def has_speech(self) -> bool:
+        return self.speech_samples > 0
+
+    @property
+    def speech_duration(self) -> float:
+        """有效语音时长(秒)，只统计语音帧，不含静音和余量"""
+        return self.speech_samples / self.sample_rate
+
+    @property
+    def total_duration(self) -> float:
+        return self.total_samples / self.sample_rate
+
+    @property
+    def kept_duration(self) -> float:
+        return (self.end - self.start) / self.sample_rate
+
+    @property
+    def trimmed_ratio(self) -> float:
+        """被裁剪掉的音频占比"""
+        if self.total_samples == 0:
+            return 0.0
+        return 1.0 - (self.end - self.start) / self.total_samples
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.update({
+            "speech_duration": round(self.speech_duration, 3),
+            "total_duration": round(self.total_duration, 3),
+            "trimmed_ratio": round(self.trimmed_ratio, 4)
+        })
+        return data
+
+
+def frame_energy_dbfs(samples: np.ndarray, frame_len: int) -> np.ndarray:
+    """计算每帧的能量(dBFS)，末尾不足一帧的部分补零"""
+    if samples.dtype == np.int16:
+        scale = 1.0 / 32768.0
+    else:
+        scale = 1.0
+    n_frames = -(-len(samples) // frame_len)
+    padded = np.zeros(n_frames * frame_len, dtype=np.float32)
+    padded[:len(samples)] = samples
+    frames = padded.reshape(n_frames, frame_len)
+    power = np.einsum("ij,ij->i", frames, frames) / frame_len * (scale * scale)
+    return 10.0 * np.log10(power + 1e-12)
+
+
+def detect_speech(samples: np.ndarray, sample_rate: int, config: Optional[VADConfig] = None) -> VADResult:
+    """
+    检测语音区间
+
+    Args:
+        samples: 单声道音频样本(int16或[-1, 1]范围的浮点数)
+        sample_rate: 采样率
+        config: VAD配置
+
+    Returns:
+        VAD结果，无语音时speech_samples为0且start == end
+    """
+    config = config or VADConfig()
+    total = len(samples)
+    frame_len = max(1, int(sample_rate * config.frame_ms / 1000))
+
+    if total == 0:
+        return VADResult(0, 0, 0, 0, sample_rate)
+
+    energy = frame_energy_dbfs(samples, frame_len)
+    threshold = max(float(energy.max()) + config.energy_threshold_db, config.min_energy_dbfs)
+    active = energy > threshold
+
+    # 游程编码: 找出所有连续语音帧段的起止位置
+    edges = np.diff(np.concatenate(([0], active.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_frames = max(1, int(round(config.min_speech_ms / config.frame_ms)))
+    keep = (ends - starts) >= min_frames
+    starts, ends = starts[keep], ends[keep]
+
+    if len(starts) == 0:
+        return VADResult(0, 0, 0, total, sample_rate)
+
+    pad = int(sample_rate * config.padding_ms / 1000)
+    start = max(0, int(starts[0]) * frame_len - pad)
+    end = min(total, int(ends[-1]) * frame_len + pad)
+    speech_samples = min(total, int((ends - starts).sum()) * frame_len)
+
+    return VADResult(start, end, speech_samples, total, sample_rate)
+
+
+def trim_silence(samples: np.ndarray, result: VADResult) -> np.ndarray:
+    """按VAD结果裁剪首尾静音，返回原数组的视图"""
+    return samples[result.start:result.end]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+固定分桶的延迟直方图
+桶边界在创建时确定，记录一次延迟只做一次二分查找和计数加一，内存占用不随样本数增长，
+百分位数在桶内线性插值估计
+"""
+
+from bisect import bisect_left
+from typing import Dict, Any, Iterable, List, Optional
+
+# 默认桶上界(毫秒)，1-2-5序列覆盖0.1ms到60s
+DEFAULT_BOUNDS_MS = (
+    0.1, 0.2, 0.5,
+    1, 2, 5,
+    10, 20, 50,
+    100, 200, 500,
+    1000, 2000, 5000,
+    10000, 20000, 60000
+)
+
+
+class LatencyHistogram:
+    """单个指标的延迟直方图，在事件循环线程中更新，无需加锁"""
+
+    __slots__ = ("bounds", "counts", "count", "total_ms", "max_ms")
+
+    def __init__(self, bounds_ms: Iterable[float] = DEFAULT_BOUNDS_MS):
+        self.bounds: List[float] = sorted(bounds_ms)
+        # 最后一个桶收集超过最大边界的样本
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds: float):
+        """记录一次以秒为单位的延迟"""
+        ms = seconds * 1000
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p: float) -> Optional[float]:
+        """估计第p百分位的延迟(毫秒)，没有样本时返回None"""
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max_ms
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(estimate, self.max_ms)
+            seen += bucket_count
+        return self.max_ms
+
+    def summary(self) -> Dict[str, Any]:
+        """样本数、均值、最大值和常用百分位(毫秒)"""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2),
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms": round(self.percentile(50), 2),
+            "p90_ms": round(self.percentile(90), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2)
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """包含各桶计数的完整数据，用于导出"""
+        data = self.summary()
+        data["buckets"] = {
+            **{f"le_{bound:g}ms": count for bound, count in zip(self.bounds, self.counts)},
+            "overflow": self.counts[-1]
+        }
+        return data
+
+
+class HistogramSet:
+    """按(分组, 指标名)组织的一组直方图，如按服务器区分的请求延迟"""
+
+    def __init__(self, bounds_ms: Iterable[float] = DEFAULT_BOUNDS_MS):
+        self.bounds_ms = tuple(bounds_ms)
+        self.histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+
+    def get(self, group: str, name: str) -> LatencyHistogram:
+        metrics = self.histograms.setdefault(group, {})
+        histogram = metrics.get(name)
+        if histogram is None:
+            histogram = metrics[name] = LatencyHistogram(self.bounds_ms)
+        return histogram
+
+    def record(self, group: str, name: str, seconds: float):
+        self.get(group, name).record(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        return {group: {name: histogram.summary() for name, histogram in metrics.items()}
+                for group, metrics in self.histograms.items()}
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {group: {name: histogram.to_dict() for name, histogram in metrics.items()}
+                for group, metrics in self.histograms.items()}
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+LLM连接池
+多个语音会话共享一个LLMResponseInterface：连接池、按挂起请求数选择连接和断线重连都由接口内部完成，
+这里只限制同时在途的请求数(每条连接max_inflight_per_connection个)，并记录等待空闲名额的时间和池利用率
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+
+from llm_response import LLMResponseInterface, LLMResponseData
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LLMPoolConfig:
+    """LLM连接池配置"""
+    config_file: str = "llm_config.yaml"
+    # 每个服务器的连接数，覆盖llm_config.yaml中的websocket.pool_size
+    pool_size: int = 2
+    # 单个连接上同时等待响应的请求数上限
+    max_inflight_per_connection: int = 8
+    request_timeout: float = 30.0
+    # 所有连接都满载时等待空闲名额的最长时间
+    acquire_timeout: float = 5.0
+
+
+class LLMClientPool:
+    """
+    LLM后端连接池
+
+    所有连接都满载时等待名额释放，超过acquire_timeout仍无空闲名额则报错
+    """
+
+    def __init__(self, config: Optional[LLMPoolConfig] = None):
+        self.config = config or LLMPoolConfig()
+        self.interface = LLMResponseInterface(self.config.config_file, pool_size=self.config.pool_size)
+        self.inflight = 0
+        self._capacity = asyncio.Condition()
+
+        self.stats = {
+            "requests": 0,
+            "successful_requests": 0,
+            "failed_requests": 0,
+            "timeouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "peak_inflight": 0
+        }
+
+    @property
+    def connected(self) -> int:
+        return sum(1 for conn in self.interface.connections if conn.is_connected())
+
+    @property
+    def capacity(self) -> int:
+        return self.connected * self.config.max_inflight_per_connection
+
+    async def start(self) -> int:
+        """建立连接，返回连接成功的数量，全部失败时抛出ConnectionError"""
+        if not await self.interface.connect():
+            raise ConnectionError("LLM连接池中没有可用连接")
+        logger.info(f"🔗 LLM连接池已就绪: {self.connected}/{len(self.interface.connections)} 条连接")
+        return self.connected
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < self.capacity
+
+    async def _acquire(self):
+        if not self._has_capacity():
+            start = time.perf_counter()
+            self.stats["waits"] += 1
+            try:
+                async with self._capacity:
+                    await asyncio.wait_for(self._capacity.wait_for(self._has_capacity),
+                                           timeout=self.config.acquire_timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError(f"LLM连接池无空闲连接 (等待 {self.config.acquire_timeout}s)")
+            finally:
+                waited = time.perf_counter() - start
+                self.stats["wait_seconds"] += waited
+                self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+
+        self.inflight += 1
+        self.stats["peak_inflight"] = max(self.stats["peak_inflight"], self.inflight)
+
+    async def _release(self):
+        self.inflight -= 1
+        async with self._capacity:
+            self._capacity.notify_all()
+
+    async def request(self, prompt: str, system_prompt: Optional[str] = None,
+                      conversation_history: Optional[List[Dict[str, str]]] = None,
+                      timeout: Optional[float] = None, **kwargs) -> LLMResponseData:
+        """
+        通过连接池发送LLM请求
+
+        Args:
+            prompt: 用户输入
+            system_prompt: 系统提示词
+            conversation_history: 对话历史
+            timeout: 单个请求的超时时间，默认使用request_timeout
+        """
+        self.stats["requests"] += 1
+        await self._acquire()
+        try:
+            response = await self.interface.send_llm_request(
+                prompt,
+                system_prompt=system_prompt,
+                conversation_history=conversation_history,
+                timeout=timeout or self.config.request_timeout,
+                **kwargs
+            )
+        except (TimeoutError, ConnectionError) as e:
+            self.stats["failed_requests"] += 1
+            if isinstance(e, TimeoutError):
+                self.stats["timeouts"] += 1
+            raise
+        finally:
+            await self._release()
+
+        if response.success:
+            self.stats["successful_requests"] += 1
+        else:
+            self.stats["failed_requests"] += 1
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        connections = self.interface.connections
+        stats.update({
+            "pool_size": len(connections),
+            "available": self.connected,
+            "inflight": self.inflight,
+            "utilization": round(self.inflight / self.capacity, 3) if self.capacity else 0.0,
+            "avg_wait_ms": round(self.stats["wait_seconds"] / self.stats["waits"] * 1000, 2) if self.stats["waits"] else 0.0,
+            "reconnects": sum(conn.stats["reconnects"] for conn in connections),
+            "connections": [conn.to_dict() for conn in connections]
+        })
+        return stats
+
+    async def close(self):
+        await self.interface.disconnect()
@@ -10,13 +10,19 @@ import websockets
 import json
 import logging
 import time
-import uuid
-from typing import Dict, Any, Optional, Callable, List, Union
+from collections import deque
+from typing import Dict, Any, Optional, Callable, List, Set, Union
 from dataclasses import dataclass, asdict
 from enum import Enum
 import yaml
 import os
 
+from latency_histogram import HistogramSet
+from message_codec import JSON_CODEC, MessageDecodeError, StaticFrame, codec_for, supported_subprotocols
+
+# PING内容固定，预先编码
+PING_FRAME = StaticFrame({"type": "ping"})
+
 
 class ConnectionState(Enum):
     """连接状态枚举"""
@@ -35,6 +41,9 @@ class MessageType(Enum):
     PONG = "pong"
     ERROR = "error"
     STATUS = "status"
+    CANCEL = "cancel"
+    LLM_BATCH_REQUEST = "llm_batch_request"
+    LLM_BATCH_RESPONSE = "llm_batch_response"
 
 
 @dataclass
@@ -72,6 +81,8 @@ class LLMResponseData:
     error: Optional[str] = None
     model_info: Optional[Dict[str, Any]] = None
     usage: Optional[Dict[str, Any]] = None
+    # 请求携带追踪上下文时，服务器和客户端记录的各阶段耗时
+    trace: Optional[Dict[str, Any]] = None
 
 
 @dataclass
@@ -82,6 +93,8 @@ class WebSocketConfig:
     ping_timeout: int = 10
     max_message_size: int = 1048576
     compression: bool = False
+    # auto: 服务器支持时使用MessagePack | json
+    codec: str = "auto"
 
 
 @dataclass
@@ -94,21 +107,250 @@ class RetryConfig:
     jitter: bool = True
 
 
+class LLMConnection:
+    """
+    连接池中的单条WebSocket连接
+    
+    每条连接独立监听消息、健康检查和断线重连，请求按requestId在连接上多路复用
+    """
+    
+    def __init__(self, interface: "LLMResponseInterface", index: int):
+        self.interface = interface
+        self.index = index
+        self.websocket = None
+        self.server: Optional[ServerConfig] = None
+        # 与服务器协商出的消息编码
+        self.codec = JSON_CODEC
+        self.state = ConnectionState.DISCONNECTED
+        # 在本连接上等待响应的请求ID
+        self.pending: Set[Union[str, int]] = set()
+        
+        self.stats = {
+            "connects": 0,
+            "reconnects": 0,
+            "requests": 0,
+            "failed_requests": 0,
+            "health_check_failures": 0,
+            "connected_at": None,
+            "last_error": None
+        }
+        
+        self._listen_task = None
+        self._health_check_task = None
+        self._reconnect_task = None
+        self._ping_sent_at: Optional[float] = None
+        self._pong_waiter: Optional[asyncio.Future] = None
+    
+    @property
+    def logger(self) -> logging.Logger:
+        return self.interface.logger
+    
+    def is_connected(self) -> bool:
+        return (self.state == ConnectionState.CONNECTED and self.websocket is not None
+                and not self.websocket.closed)
+    
+    async def open(self, server: ServerConfig, websocket=None):
+        """连接到指定服务器，失败时抛出异常；websocket为已建立的连接时直接接管"""
+        self.state = ConnectionState.CONNECTING
+        try:
+            self.websocket = websocket or await self.interface._open_websocket(server)
+        except Exception as e:
+            self.state = ConnectionState.ERROR
+            self.stats["last_error"] = str(e)
+            raise
+        
+        self.server = server
+        self.codec = codec_for(self.websocket)
+        self.state = ConnectionState.CONNECTED
+        self.stats["connects"] += 1
+        self.stats["connected_at"] = time.time()
+        
+        self._listen_task = asyncio.create_task(self._listen_messages())
+        if self.interface.config.get("health_check", {}).get("enabled", True):
+            self._health_check_task = asyncio.create_task(self._health_check_loop())
+    
+    async def close(self):
+        """关闭连接，本连接上挂起的请求随之失败"""
+        self.state = ConnectionState.DISCONNECTED
+        current = asyncio.current_task()
+        for task in (self._health_check_task, self._reconnect_task, self._listen_task):
+            if task and task is not current:
+                task.cancel()
+        self._health_check_task = self._reconnect_task = self._listen_task = None
+        
+        if self.websocket and not self.websocket.closed:
+            await self.websocket.close()
+        self.websocket = None
+        self._fail_pending(ConnectionError(f"连接 #{self.index} 已关闭"))
+    
+    async def send(self, message: Dict[str, Any]):
+        await self.websocket.send(self.codec.encode(message))
+    
+    async def ping(self, timeout: Optional[float] = None) -> bool:
+        """发送PING并等待PONG，超时未收到(如半开的TCP连接)视为失败"""
+        if not self.is_connected():
+            return False
+        if timeout is None:
+            timeout = self.interface.config.get("health_check", {}).get("timeout", 5)
+        waiter = self._pong_waiter = asyncio.get_running_loop().create_future()
+        try:
+            self._ping_sent_at = time.perf_counter()
+            await self.websocket.send(PING_FRAME.frame(self.codec))
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.logger.warning(f"连接 #{self.index} {timeout}s内未收到PONG")
+            return False
+        except Exception as e:
+            self.logger.error(f"连接 #{self.index} PING发送失败: {e}")
+            return False
+        finally:
+            if self._pong_waiter is waiter:
+                self._pong_waiter = None
+    
+    def on_pong(self):
+        """收到PONG时按最近一次PING计算往返时间"""
+        if self._ping_sent_at is not None and self.server is not None:
+            rtt = time.perf_counter() - self._ping_sent_at
+            self.interface._update_server_latency(self.server, "rtt_ms", rtt)
+            self.interface.latency.record(self.server.url, "ping_rtt", rtt)
+            self._ping_sent_at = None
+        if self._pong_waiter is not None and not self._pong_waiter.done():
+            self._pong_waiter.set_result(None)
+    
+    def _fail_pending(self, error: Exception):
+        for request_id in list(self.pending):
+            future = self.interface.pending_requests.pop(request_id, None)
+            batch = self.interface.pending_batches.pop(request_id, None)
+            if batch:
+                future = batch["future"]
+            if future and not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+    
+    async def _listen_messages(self):
+        """监听本连接的消息"""
+        try:
+            async for message in self.websocket:
+                try:
+                    data = self.codec.decode(message)
+                    await self.interface._handle_message(data, self)
+                except MessageDecodeError as e:
+                    self.logger.error(f"消息解析错误: {e}")
+                    if self.interface.on_error:
+                        self.interface.on_error(e)
+                except Exception as e:
+                    self.logger.error(f"消息处理错误: {e}")
+                    if self.interface.on_error:
+                        self.interface.on_error(e)
+            # 服务器正常关闭连接
+            self._connection_lost("服务器关闭了连接")
+        except websockets.exceptions.ConnectionClosed:
+            self._connection_lost("WebSocket连接被关闭")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"连接 #{self.index} 消息监听错误: {e}")
+            if self.interface.on_error:
+                self.interface.on_error(e)
+            self._connection_lost(str(e))
+    
+    def _connection_lost(self, reason: str):
+        """连接断开：挂起请求立即失败，并只重连这一条连接"""
+        if self.state != ConnectionState.CONNECTED:
+            return
+        self.logger.warning(f"连接 #{self.index} 断开: {reason}")
+        self._schedule_reconnect(reason)
+    
+    def _schedule_reconnect(self, reason: str):
+        self.state = ConnectionState.RECONNECTING
+        self.stats["last_error"] = reason
+        self._fail_pending(ConnectionError(f"连接 #{self.index} 断开: {reason}"))
+        if not self._reconnect_task or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+    
+    async def _reconnect(self):
+        """重连到当前服务器，多次失败后交给接口做整体故障转移"""
+        if self._health_check_task and self._health_check_task is not asyncio.current_task():
+            self._health_check_task.cancel()
+        self._health_check_task = None
+        
+        retry_config = self.interface.config.get("retry", {})
+        attempts = self.interface.config.get("websocket", {}).get("reconnect_attempts", 3)
+        for attempt in range(attempts):
+            if self.state != ConnectionState.RECONNECTING:
+                return
+            try:
+                await self.open(self.server)
+                self.stats["reconnects"] += 1
+                self.logger.info(f"连接 #{self.index} 重连成功 ({self.server.name})")
+                return
+            except Exception as e:
+                self.logger.warning(f"连接 #{self.index} 第 {attempt + 1}/{attempts} 次重连失败: {e}")
+                self.state = ConnectionState.RECONNECTING
+                await asyncio.sleep(self.interface._retry_delay(retry_config, attempt + 1))
+        
+        self.state = ConnectionState.ERROR
+        self.interface._on_connection_failed(self)
+    
+    async def _health_check_loop(self):
+        health_config = self.interface.config.get("health_check", {})
+        interval = health_config.get("interval", 30)
+        max_failures = health_config.get("max_failures", 5)
+        failure_count = 0
+        
+        while self.state == ConnectionState.CONNECTED:
+            try:
+                await asyncio.sleep(interval)
+                if self.state != ConnectionState.CONNECTED:
+                    break
+                
+                if await self.ping():
+                    failure_count = 0
+                else:
+                    failure_count += 1
+                    self.stats["health_check_failures"] += 1
+                    self.logger.warning(f"连接 #{self.index} 健康检查失败 {failure_count}/{max_failures}")
+                    
+                    if failure_count >= max_failures:
+                        self.logger.error(f"连接 #{self.index} 健康检查连续失败，触发重连")
+                        self._connection_lost("健康检查连续失败")
+                        break
+            
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"连接 #{self.index} 健康检查错误: {e}")
+                failure_count += 1
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "server": self.server.url if self.server else None,
+            "state": self.state.value,
+            "codec": self.codec.name,
+            "pending_requests": len(self.pending),
+            **self.stats
+        }
+
+
 class LLMResponseInterface:
     """LLM WebSocket响应接口类"""
     
-    def __init__(self, config_file: str = "llm_config.yaml"):
+    def __init__(self, config_file: str = "llm_config.yaml", pool_size: Optional[int] = None):
         """
         初始化LLM响应接口
         
         Args:
             config_file: 配置文件路径
+            pool_size: 每个服务器的连接数，默认使用配置中的websocket.pool_size
         """
         self.config_file = config_file
         self.config = self._load_config()
         
-        # 连接状态
-        self.websocket = None
+        # 连接状态：到同一服务器的连接池，请求分配给挂起请求最少的连接
+        self.pool_size = max(1, pool_size or self.config.get("websocket", {}).get("pool_size", 1))
+        self.connections: List[LLMConnection] = []
         self.state = ConnectionState.DISCONNECTED
         self.current_server = None
         self.current_server_index = 0
@@ -116,6 +358,8 @@ class LLMResponseInterface:
         # 请求管理
         self.request_counter = 0
         self.pending_requests: Dict[Union[str, int], asyncio.Future] = {}
+        # 批量请求: requestId -> {"future", "results", "on_item", "last_frame"}
+        self.pending_batches: Dict[str, Dict[str, Any]] = {}
         
         # 统计信息
         self.connection_stats = {
@@ -126,6 +370,7 @@ class LLMResponseInterface:
             "successful_requests": 0,
             "failed_requests": 0,
             "connection_time": None,
+            "cancels_sent": 0,
             "last_error": None
         }
         
@@ -140,8 +385,39 @@ class LLMResponseInterface:
         # 设置日志
         self.logger = self._setup_logger()
         
-        # 健康检查任务
-        self._health_check_task = None
+        # 各服务器的建连和延迟统计(按URL)
+        self.server_stats: Dict[str, Dict[str, Any]] = {}
+        # 各服务器的延迟直方图: request_latency / first_chunk / ping_rtt / queue_time
+        self.latency = HistogramSet()
+        
+        # 负载均衡: failover只使用一个服务器，active_active同时连接多个服务器按延迟分配请求
+        lb_config = self.config.get("load_balancing", {})
+        self.lb_mode = lb_config.get("mode", "failover")
+        self.lb_max_servers = lb_config.get("max_servers", 3)
+        self.lb_ewma_alpha = lb_config.get("ewma_alpha", 0.2)
+        self._secondary_task = None
+        
+        # 请求对冲: 超过近期延迟的指定百分位仍未响应时向另一连接发送副本
+        hedge_config = self.config.get("hedging", {})
+        self.hedging_enabled = hedge_config.get("enabled", False)
+        self.hedge_percentile = hedge_config.get("percentile", 95)
+        self.hedge_min_delay = hedge_config.get("min_delay_ms", 50) / 1000
+        self.hedge_min_samples = hedge_config.get("min_samples", 20)
+        self.hedge_budget_ratio = hedge_config.get("budget_ratio", 0.1)
+        self.hedge_max_budget = hedge_config.get("max_budget", 10)
+        self._hedge_tokens = float(self.hedge_max_budget)
+        self.latency_samples = deque(maxlen=hedge_config.get("window", 200))
+        self.hedge_stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "budget_exhausted": 0,
+            "no_alternate_server": 0,
+            "timeouts": 0,
+            "cancels_sent": 0
+        }
+        
+        # 整体故障转移任务(所有连接都不可用时切换服务器)
         self._reconnect_task = None
     
     def _setup_logger(self) -> logging.Logger:
@@ -202,11 +478,15 @@ class LLMResponseInterface:
                 }
             ],
             "websocket": {
+                "pool_size": 1,
+                "reconnect_attempts": 3,
+                "race_delay": 0.25,
                 "timeout": 60,
                 "ping_interval": 20,
                 "ping_timeout": 10,
                 "max_message_size": 1048576,
-                "compression": False
+                "compression": False,
+                "codec": "auto"
             },
             "retry": {
                 "max_retries": 10,
@@ -215,6 +495,20 @@ class LLMResponseInterface:
                 "exponential_backoff": True,
                 "jitter": True
             },
+            "load_balancing": {
+                "mode": "failover",
+                "max_servers": 3,
+                "ewma_alpha": 0.2
+            },
+            "hedging": {
+                "enabled": False,
+                "percentile": 95,
+                "min_delay_ms": 50,
+                "min_samples": 20,
+                "window": 200,
+                "budget_ratio": 0.1,
+                "max_budget": 10
+            },
             "request": {
                 "max_tokens": 512,
                 "default_system_prompt": "你是一个友好的AI助手。",
@@ -245,8 +539,168 @@ class LLMResponseInterface:
         servers.sort(key=lambda x: x.priority)
         return servers
     
+    @property
+    def websocket(self):
+        """兼容旧接口：返回第一条可用连接的WebSocket"""
+        for conn in self.connections:
+            if conn.is_connected():
+                return conn.websocket
+        return None
+    
+    async def _open_websocket(self, server: ServerConfig):
+        """按配置建立一条到指定服务器的WebSocket连接"""
+        websocket_config = self.config.get("websocket", {})
+        return await websockets.connect(
+            server.url,
+            open_timeout=websocket_config.get("timeout", 60),
+            ping_interval=websocket_config.get("ping_interval", 20),
+            ping_timeout=websocket_config.get("ping_timeout", 10),
+            max_size=websocket_config.get("max_message_size", 1048576),
+            # 配置中为布尔值，websockets只接受"deflate"或None
+            compression="deflate" if websocket_config.get("compression") else None,
+            # 服务器不支持时不返回子协议，自动回退到JSON
+            subprotocols=supported_subprotocols(websocket_config.get("codec", "auto"))
+        )
+    
+    def _server_stats(self, server: ServerConfig) -> Dict[str, Any]:
+        return self.server_stats.setdefault(server.url, {
+            "name": server.name,
+            "attempts": 0,
+            "successes": 0,
+            "failures": 0,
+            "cancelled": 0,
+            "total_connect_ms": 0.0,
+            "last_connect_ms": None,
+            "last_error": None,
+            "rtt_ms": None,
+            "latency_ms": None,
+            "routed_requests": 0
+        })
+    
+    def _update_server_latency(self, server: ServerConfig, key: str, seconds: float):
+        """以指数加权移动平均更新服务器的rtt_ms或latency_ms"""
+        stats = self._server_stats(server)
+        sample = seconds * 1000
+        previous = stats[key]
+        stats[key] = round(sample if previous is None else
+                           previous + self.lb_ewma_alpha * (sample - previous), 2)
+    
+    def _record_connect(self, server: ServerConfig, outcome: str, elapsed: float, error: Optional[str] = None):
+        """记录一次建连尝试的结果: success / failure / cancelled"""
+        stats = self._server_stats(server)
+        stats["attempts"] += 1
+        if outcome == "success":
+            stats["successes"] += 1
+            stats["last_connect_ms"] = round(elapsed * 1000, 1)
+            stats["total_connect_ms"] += elapsed * 1000
+            stats["avg_connect_ms"] = round(stats["total_connect_ms"] / stats["successes"], 1)
+        elif outcome == "failure":
+            stats["failures"] += 1
+            stats["last_error"] = error
+        else:
+            stats["cancelled"] += 1
+    
+    async def _attempt_connect(self, server: ServerConfig):
+        """单个服务器的建连尝试，记录耗时和结果"""
+        start = time.perf_counter()
+        try:
+            websocket = await self._open_websocket(server)
+        except asyncio.CancelledError:
+            self._record_connect(server, "cancelled", time.perf_counter() - start)
+            raise
+        except Exception as e:
+            self._record_connect(server, "failure", time.perf_counter() - start, str(e))
+            raise
+        self._record_connect(server, "success", time.perf_counter() - start)
+        return websocket
+    
+    async def _race_connect(self, servers: List[ServerConfig]):
+        """
+        多服务器竞速建连(Happy Eyeballs)
+        
+        按优先级依次发起连接，前一个尝试失败或超过race_delay仍未成功时启动下一个，
+        取第一个成功的连接并取消其余尝试
+        
+        Returns:
+            (服务器索引, 服务器配置, WebSocket连接)，全部失败时抛出ConnectionError
+        """
+        race_delay = self.config.get("websocket", {}).get("race_delay", 0.25)
+        attempts: Dict[asyncio.Task, int] = {}
+        errors = []
+        winner = None
+        next_index = 0
+        
+        try:
+            while winner is None:
+                if next_index < len(servers):
+                    server = servers[next_index]
+                    self.logger.info(f"尝试连接到 {server.name} ({server.url})")
+                    attempts[asyncio.create_task(self._attempt_connect(server))] = next_index
+                    next_index += 1
+                
+                pending = [task for task in attempts if not task.done()]
+                if not pending:
+                    break
+                
+                timeout = race_delay if next_index < len(servers) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = attempts[task]
+                    if task.exception() is None:
+                        if winner is None or index < winner[0]:
+                            winner = (index, task.result())
+                    else:
+                        server = servers[index]
+                        self.logger.warning(f"连接 {server.name} ({server.url}) 失败: {task.exception()}")
+                        errors.append(f"{server.name}: {task.exception()}")
+        finally:
+            # 取消仍在进行的尝试；被取消的握手可能要等close_timeout才结束，放到后台清理
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+            asyncio.create_task(self._discard_attempts(attempts, winner[0] if winner else None))
+        
+        if winner is None:
+            raise ConnectionError("; ".join(errors) or "没有可用的服务器")
+        index, websocket = winner
+        return index, servers[index], websocket
+    
+    async def _discard_attempts(self, attempts: Dict[asyncio.Task, int], winner_index: Optional[int]):
+        """等待竞速中落选的尝试结束，关闭同时成功但未被选中的连接"""
+        await asyncio.gather(*attempts, return_exceptions=True)
+        for task, index in attempts.items():
+            if index != winner_index and not task.cancelled() and task.exception() is None:
+                await task.result().close()
+    
+    async def _open_pool(self, server: ServerConfig, websocket=None, start_index: int = 0) -> List[LLMConnection]:
+        """第一条连接成功后并发建立其余连接，其余连接失败时各自在后台重连"""
+        first = LLMConnection(self, start_index)
+        if websocket is None:
+            websocket = await self._attempt_connect(server)
+        await first.open(server, websocket)
+        connections = [first] + [LLMConnection(self, start_index + i) for i in range(1, self.pool_size)]
+        
+        results = await asyncio.gather(*(conn.open(server) for conn in connections[1:]),
+                                       return_exceptions=True)
+        for conn, result in zip(connections[1:], results):
+            if isinstance(result, Exception):
+                self.logger.warning(f"连接 #{conn.index} 建立失败，后台重连: {result}")
+                conn.server = server
+                conn._schedule_reconnect(str(result))
+        return connections
+    
+    async def _open_secondary_pools(self, servers: List[ServerConfig]):
+        """active_active模式下在后台连接其余服务器，连接失败的服务器跳过"""
+        for server in servers[:max(0, self.lb_max_servers - 1)]:
+            try:
+                connections = await self._open_pool(server, start_index=len(self.connections))
+                self.connections.extend(connections)
+                self.logger.info(f"负载均衡: 已连接 {server.name} ({server.url})")
+            except Exception as e:
+                self.logger.warning(f"负载均衡: 连接 {server.name} ({server.url}) 失败: {e}")
+    
     async def connect(self) -> bool:
-        """连接到WebSocket服务器"""
+        """连接到WebSocket服务器，按优先级选择服务器并建立连接池"""
         if self.state == ConnectionState.CONNECTED:
             return True
         
@@ -260,68 +714,53 @@ class LLMResponseInterface:
         
         self.connection_stats["total_connections"] += 1
         
-        for i, server in enumerate(servers):
+        try:
+            i, server, websocket = await self._race_connect(servers)
+            self.connections = await self._open_pool(server, websocket)
+        except Exception as e:
+            self.connection_stats["failed_connections"] += 1
+            self.connection_stats["last_error"] = str(e)
+            self.state = ConnectionState.DISCONNECTED
+            self.logger.error(f"所有服务器连接失败: {e}")
+            return False
+        
+        self.current_server = server
+        self.current_server_index = i
+        self.state = ConnectionState.CONNECTED
+        self.connection_stats["successful_connections"] += 1
+        self.connection_stats["connection_time"] = time.time()
+        
+        self.logger.info(f"成功连接到 {server.name} ({server.url})，连接池大小 {self.pool_size}")
+        
+        if self.lb_mode == "active_active":
+            others = [other for other in servers if other.url != server.url]
+            self._secondary_task = asyncio.create_task(self._open_secondary_pools(others))
+        
+        # 触发连接回调
+        if self.on_connected:
             try:
-                self.logger.info(f"尝试连接到 {server.name} ({server.url})")
-                
-                websocket_config = self.config.get("websocket", {})
-                self.websocket = await websockets.connect(
-                    server.url,
-                    timeout=websocket_config.get("timeout", 60),
-                    ping_interval=websocket_config.get("ping_interval", 20),
-                    ping_timeout=websocket_config.get("ping_timeout", 10),
-                    max_size=websocket_config.get("max_message_size", 1048576),
-                    compression=websocket_config.get("compression", None)
-                )
-                
-                self.current_server = server
-                self.current_server_index = i
-                self.state = ConnectionState.CONNECTED
-                self.connection_stats["successful_connections"] += 1
-                self.connection_stats["connection_time"] = time.time()
-                
-                self.logger.info(f"成功连接到 {server.name} ({server.url})")
-                
-                # 触发连接回调
-                if self.on_connected:
-                    try:
-                        self.on_connected()
-                    except Exception as e:
-                        self.logger.error(f"连接回调错误: {e}")
-                
-                # 启动消息监听和健康检查
-                asyncio.create_task(self._listen_messages())
-                
-                if self.config.get("health_check", {}).get("enabled", True):
-                    self._start_health_check()
-                
-                return True
-                
+                self.on_connected()
             except Exception as e:
-                self.logger.warning(f"连接 {server.name} ({server.url}) 失败: {e}")
-                self.connection_stats["failed_connections"] += 1
-                self.connection_stats["last_error"] = str(e)
-                continue
+                self.logger.error(f"连接回调错误: {e}")
         
-        self.state = ConnectionState.DISCONNECTED
-        self.logger.error("所有服务器连接失败")
-        return False
+        return True
+    
+    async def _close_connections(self):
+        if self._secondary_task and not self._secondary_task.done():
+            self._secondary_task.cancel()
+        self._secondary_task = None
+        connections, self.connections = self.connections, []
+        await asyncio.gather(*(conn.close() for conn in connections), return_exceptions=True)
     
     async def disconnect(self):
-        """断开WebSocket连接"""
-        if self._health_check_task:
-            self._health_check_task.cancel()
-            self._health_check_task = None
-        
-        if self._reconnect_task:
+        """断开所有WebSocket连接"""
+        if self._reconnect_task and self._reconnect_task is not asyncio.current_task():
             self._reconnect_task.cancel()
-            self._reconnect_task = None
+        self._reconnect_task = None
         
-        if self.websocket and not self.websocket.closed:
-            await self.websocket.close()
+        await self._close_connections()
         
         self.state = ConnectionState.DISCONNECTED
-        self.websocket = None
         self.current_server = None
         
         # 取消所有挂起的请求
@@ -339,70 +778,251 @@ class LLMResponseInterface:
         
         self.logger.info("WebSocket连接已断开")
     
+    def _retry_delay(self, retry_config: Dict[str, Any], retry_count: int) -> float:
+        """计算第retry_count次重试前的等待时间"""
+        retry_interval = retry_config.get("retry_interval", 3)
+        wait_time = retry_interval
+        if retry_config.get("exponential_backoff", True):
+            wait_time = min(retry_interval * (2 ** retry_count),
+                            retry_config.get("max_retry_interval", 60))
+        
+        if retry_config.get("jitter", True):
+            import random
+            wait_time *= (0.5 + random.random() * 0.5)
+        return wait_time
+    
+    def _on_connection_failed(self, conn: LLMConnection):
+        """单条连接重连失败；所有连接都不可用时整体故障转移到其他服务器"""
+        if any(c.is_connected() or c.state == ConnectionState.RECONNECTING for c in self.connections):
+            return
+        if self.state == ConnectionState.CONNECTED and not self._reconnect_task:
+            self.logger.error("连接池中所有连接均不可用，切换服务器")
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+    
     async def _reconnect(self):
-        """重连逻辑"""
-        if self.state == ConnectionState.RECONNECTING or self._reconnect_task:
+        """重连逻辑：关闭现有连接池，按优先级重新选择服务器"""
+        if self.state == ConnectionState.RECONNECTING:
             return
         
         self.state = ConnectionState.RECONNECTING
+        await self._close_connections()
         retry_config = self.config.get("retry", {})
         max_retries = retry_config.get("max_retries", 10)
-        retry_interval = retry_config.get("retry_interval", 3)
         
         retry_count = 0
         
-        while retry_count < max_retries and self.state == ConnectionState.RECONNECTING:
-            self.logger.info(f"第 {retry_count + 1}/{max_retries} 次重连尝试")
-            
-            if await self.connect():
-                self.logger.info("重连成功")
-                return
-            
-            retry_count += 1
-            if retry_count < max_retries:
-                # 计算重试间隔
-                wait_time = retry_interval
-                if retry_config.get("exponential_backoff", True):
-                    wait_time = min(retry_interval * (2 ** retry_count), 
-                                  retry_config.get("max_retry_interval", 60))
+        try:
+            while retry_count < max_retries and self.state == ConnectionState.RECONNECTING:
+                self.logger.info(f"第 {retry_count + 1}/{max_retries} 次重连尝试")
                 
-                if retry_config.get("jitter", True):
-                    import random
-                    wait_time *= (0.5 + random.random() * 0.5)
+                if await self.connect():
+                    self.logger.info("重连成功")
+                    return
+                self.state = ConnectionState.RECONNECTING
                 
-                await asyncio.sleep(wait_time)
+                retry_count += 1
+                if retry_count < max_retries:
+                    await asyncio.sleep(self._retry_delay(retry_config, retry_count))
+            
+            self.logger.error("重连失败，达到最大重试次数")
+            self.state = ConnectionState.ERROR
+        finally:
+            self._reconnect_task = None
+    
+    def _expected_latency(self, conn: LLMConnection) -> float:
+        """估计请求在该连接上的完成时间: 服务器延迟 × (挂起请求数 + 1)"""
+        stats = self.server_stats.get(conn.server.url, {})
+        latency = stats.get("latency_ms")
+        if latency is None:
+            # 尚无响应样本时用PING往返时间估计，都没有时视为0以便尽快获得样本
+            latency = stats.get("rtt_ms") or 0.0
+        return latency * (len(conn.pending) + 1)
+    
+    def _select_connection(self, exclude: Optional[LLMConnection] = None) -> Optional[LLMConnection]:
+        """
+        选择连接：failover模式取挂起请求最少的连接，active_active模式取预计完成最早的连接
         
-        self.logger.error("重连失败，达到最大重试次数")
-        self.state = ConnectionState.ERROR
+        exclude为对冲请求的主连接：只在其他服务器的连接中选择，同一服务器上的副本无法避开慢服务器
+        """
+        candidates = [conn for conn in self.connections if conn.is_connected()]
+        if exclude is not None:
+            candidates = [conn for conn in candidates if conn.server.url != exclude.server.url]
+        if not candidates:
+            return None
+        if self.lb_mode == "active_active":
+            return min(candidates, key=lambda conn: (self._expected_latency(conn), len(conn.pending)))
+        return min(candidates, key=lambda conn: len(conn.pending))
     
-    async def _listen_messages(self):
-        """监听WebSocket消息"""
+    def _track_request(self, conn: LLMConnection, request_id: str) -> asyncio.Future:
+        """登记等待响应的请求"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending_requests[request_id] = future
+        conn.pending.add(request_id)
+        conn.stats["requests"] += 1
+        self._server_stats(conn.server)["routed_requests"] += 1
+        return future
+    
+    def _hedge_delay(self) -> Optional[float]:
+        """按近期延迟的百分位计算对冲等待时间，样本不足时不对冲"""
+        if len(self.latency_samples) < self.hedge_min_samples:
+            return None
+        samples = sorted(self.latency_samples)
+        index = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return max(self.hedge_min_delay, samples[index])
+    
+    def _take_hedge_budget(self) -> bool:
+        """每个请求积累budget_ratio个令牌，每次对冲消耗一个，限制额外负载"""
+        if self._hedge_tokens < 1:
+            self.hedge_stats["budget_exhausted"] += 1
+            return False
+        self._hedge_tokens -= 1
+        return True
+    
+    async def _cancel_request(self, conn: LLMConnection, request_id: str) -> bool:
+        """放弃一个请求并通知服务器取消，返回取消消息是否已发送"""
+        future = self.pending_requests.pop(request_id, None)
+        if future is not None and not future.done():
+            future.cancel()
         try:
-            async for message in self.websocket:
+            await conn.send({
+                "type": MessageType.CANCEL.value,
+                "requestId": request_id,
+                "timestamp": int(time.time() * 1000)
+            })
+            self.connection_stats["cancels_sent"] += 1
+            return True
+        except Exception as e:
+            self.logger.debug(f"发送取消消息失败 ID: {request_id}: {e}")
+            return False
+    
+    def _cancel_in_background(self, conn: LLMConnection, request_id: str):
+        """调用方被取消(如语音请求被打断)时不再等待，在后台通知服务器停止生成"""
+        if request_id in self.pending_requests or request_id in self.pending_batches:
+            asyncio.create_task(self._cancel_request(conn, request_id))
+    
+    async def _await_hedged(self, conn: LLMConnection, message: Dict[str, Any],
+                            response_future: asyncio.Future, sent_at: float, timeout: float):
+        """
+        等待响应，超过对冲延迟仍未返回时向另一服务器的连接发送副本，
+        先成功返回的一方胜出，另一方收到取消消息；超时时两个副本都收到取消消息
+        
+        Returns:
+            (响应, 胜出的连接, 该连接的发送时间)，响应的requestId始终为原请求ID
+        """
+        self.hedge_stats["requests"] += 1
+        self._hedge_tokens = min(self.hedge_max_budget, self._hedge_tokens + self.hedge_budget_ratio)
+        deadline = sent_at + timeout
+        
+        def remaining() -> float:
+            return max(0.0, deadline - time.perf_counter())
+        
+        delay = self._hedge_delay()
+        if delay is not None:
+            await asyncio.wait([response_future], timeout=min(delay, remaining()))
+        if delay is None or response_future.done():
+            return await asyncio.wait_for(response_future, timeout=remaining()), conn, sent_at
+        
+        hedge_conn = self._select_connection(exclude=conn)
+        if hedge_conn is None:
+            self.hedge_stats["no_alternate_server"] += 1
+            return await asyncio.wait_for(response_future, timeout=remaining()), conn, sent_at
+        if not self._take_hedge_budget():
+            return await asyncio.wait_for(response_future, timeout=remaining()), conn, sent_at
+        
+        request_id = message["requestId"]
+        hedge_id = f"{request_id}_hedge"
+        hedge_future = self._track_request(hedge_conn, hedge_id)
+        hedge_sent_at = time.perf_counter()
+        hedge_sent = False
+        try:
+            try:
+                await hedge_conn.send({**message, "requestId": hedge_id})
+            except Exception as e:
+                self.logger.warning(f"对冲请求发送失败 ID: {hedge_id}: {e}")
+                return await asyncio.wait_for(response_future, timeout=remaining()), conn, sent_at
+            hedge_sent = True
+            self.hedge_stats["hedged"] += 1
+            self.logger.info(f"请求 {request_id} 超过 {delay * 1000:.0f}ms 未响应，对冲到 {hedge_conn.server.name}")
+            
+            racing = {
+                response_future: (conn, request_id, sent_at),
+                hedge_future: (hedge_conn, hedge_id, hedge_sent_at)
+            }
+            while True:
+                done, _ = await asyncio.wait(racing, timeout=remaining(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 整体超时：两个副本都通知服务器停止生成
+                    self.hedge_stats["timeouts"] += 1
+                    for loser, loser_id, _ in racing.values():
+                        if await self._cancel_request(loser, loser_id):
+                            self.hedge_stats["cancels_sent"] += 1
+                    raise asyncio.TimeoutError()
+                for future in done:
+                    winner, _, winner_sent_at = racing.pop(future)
+                    failed = future.exception() is not None or not future.result().success
+                    if failed and racing:
+                        continue
+                    for loser, loser_id, _ in racing.values():
+                        if await self._cancel_request(loser, loser_id):
+                            self.hedge_stats["cancels_sent"] += 1
+                    response = future.result()
+                    if winner is hedge_conn:
+                        self.hedge_stats["hedge_wins"] += 1
+                        response.requestId = request_id
+                    return response, winner, winner_sent_at
+        finally:
+            hedge_conn.pending.discard(hedge_id)
+            if hedge_sent:
+                # 调用方被取消时副本仍在生成，同样通知服务器停止
+                self._cancel_in_background(hedge_conn, hedge_id)
+            elif not hedge_future.done():
+                self.pending_requests.pop(hedge_id, None)
+                hedge_future.cancel()
+    
+    def _handle_batch_message(self, data: Dict[str, Any]):
+        """处理批量请求的响应帧，服务器对整个批次报错时所有条目失败"""
+        batch = self.pending_batches[data["requestId"]]
+        batch["last_frame"] = time.perf_counter()
+        if not batch["first_frame"]:
+            batch["first_frame"] = True
+            self.latency.record(batch["server"], "first_chunk", batch["last_frame"] - batch["start"])
+        
+        if data.get("type") != MessageType.LLM_BATCH_RESPONSE.value:
+            self.pending_batches.pop(data["requestId"])
+            if not batch["future"].done():
+                batch["future"].set_exception(Exception(data.get("error") or data.get("message") or "批量请求失败"))
+            return
+        
+        for item in data.get("results", []):
+            index = item.get("index")
+            if not isinstance(index, int) or not 0 <= index < len(batch["results"]):
+                continue
+            response_data = LLMResponseData(
+                success=item.get("success", False),
+                message=item.get("message", ""),
+                requestId=f"{data['requestId']}#{index}",
+                timestamp=data.get("timestamp", time.time()),
+                error=item.get("error"),
+                model_info=item.get("modelInfo"),
+                usage=item.get("usage")
+            )
+            batch["results"][index] = response_data
+            if response_data.success:
+                self.connection_stats["successful_requests"] += 1
+            else:
+                self.connection_stats["failed_requests"] += 1
+            if batch["on_item"]:
                 try:
-                    data = json.loads(message)
-                    await self._handle_message(data)
-                except json.JSONDecodeError as e:
-                    self.logger.error(f"JSON解析错误: {e}")
-                    if self.on_error:
-                        self.on_error(e)
+                    batch["on_item"](index, response_data)
                 except Exception as e:
-                    self.logger.error(f"消息处理错误: {e}")
-                    if self.on_error:
-                        self.on_error(e)
+                    self.logger.error(f"批量条目回调错误: {e}")
         
-        except websockets.exceptions.ConnectionClosed:
-            self.logger.warning("WebSocket连接被关闭")
-            if self.state == ConnectionState.CONNECTED:
-                self._reconnect_task = asyncio.create_task(self._reconnect())
-        except Exception as e:
-            self.logger.error(f"消息监听错误: {e}")
-            if self.on_error:
-                self.on_error(e)
-            if self.state == ConnectionState.CONNECTED:
-                self._reconnect_task = asyncio.create_task(self._reconnect())
+        if data.get("done"):
+            self.pending_batches.pop(data["requestId"])
+            if not batch["future"].done():
+                batch["future"].set_result(batch["results"])
     
-    async def _handle_message(self, data: Dict[str, Any]):
+    async def _handle_message(self, data: Dict[str, Any], conn: Optional[LLMConnection] = None):
         """处理收到的消息"""
         message_type = data.get("type")
         request_id = data.get("requestId")
@@ -414,7 +1034,10 @@ class LLMResponseInterface:
             except Exception as e:
                 self.logger.error(f"消息接收回调错误: {e}")
         
-        if message_type == MessageType.LLM_RESPONSE.value and request_id is not None:
+        if request_id is not None and request_id in self.pending_batches:
+            self._handle_batch_message(data)
+        
+        elif message_type == MessageType.LLM_RESPONSE.value and request_id is not None:
             # 处理LLM响应
             if request_id in self.pending_requests:
                 future = self.pending_requests.pop(request_id)
@@ -426,7 +1049,8 @@ class LLMResponseInterface:
                         timestamp=data.get("timestamp", time.time()),
                         error=data.get("error"),
                         model_info=data.get("modelInfo"),
-                        usage=data.get("usage")
+                        usage=data.get("usage"),
+                        trace=data.get("trace")
                     )
                     
                     if response_data.success:
@@ -446,6 +1070,8 @@ class LLMResponseInterface:
         elif message_type == MessageType.PONG.value:
             # 处理PONG消息
             self.logger.debug("收到PONG消息")
+            if conn is not None:
+                conn.on_pong()
         
         elif message_type == MessageType.ERROR.value:
             # 处理错误消息
@@ -464,7 +1090,8 @@ class LLMResponseInterface:
                              conversation_history: Optional[List[Dict[str, str]]] = None,
                              max_tokens: Optional[int] = None,
                              temperature: Optional[float] = None,
-                             timeout: Optional[float] = None) -> LLMResponseData:
+                             timeout: Optional[float] = None,
+                             trace: Optional[Dict[str, Any]] = None) -> LLMResponseData:
         """
         发送LLM请求
         
@@ -475,12 +1102,17 @@ class LLMResponseInterface:
             max_tokens: 最大token数
             temperature: 温度参数
             timeout: 请求超时时间
+            trace: 追踪上下文(trace_id/parent)，提供时响应的trace字段包含客户端和服务器的阶段耗时
             
         Returns:
             LLM响应数据
         """
+        start = time.perf_counter()
         if self.state != ConnectionState.CONNECTED:
             raise ConnectionError("WebSocket未连接")
+        conn = self._select_connection()
+        if conn is None:
+            raise ConnectionError("连接池中没有可用连接")
         
         # 使用配置中的默认值
         request_config = self.config.get("request", {})
@@ -514,14 +1146,17 @@ class LLMResponseInterface:
             "data": asdict(request_data),
             "timestamp": int(time.time() * 1000)
         }
+        if trace is not None:
+            message["trace"] = trace
         
         # 创建响应Future
-        response_future = asyncio.Future()
-        self.pending_requests[request_id] = response_future
+        response_future = self._track_request(conn, request_id)
         
         try:
             # 发送消息
-            await self.websocket.send(json.dumps(message, ensure_ascii=False))
+            await conn.send(message)
+            sent_at = time.perf_counter()
+            self.latency.record(conn.server.url, "queue_time", sent_at - start)
             self.connection_stats["total_requests"] += 1
             self.logger.info(f"发送LLM请求 ID: {request_id}")
             
@@ -533,82 +1168,176 @@ class LLMResponseInterface:
                     self.logger.error(f"请求发送回调错误: {e}")
             
             # 等待响应
-            response = await asyncio.wait_for(response_future, timeout=timeout)
+            if self.hedging_enabled:
+                response, winner, sent_at = await self._await_hedged(conn, message, response_future, sent_at, timeout)
+            else:
+                response = await asyncio.wait_for(response_future, timeout=timeout)
+                winner = conn
+            now = time.perf_counter()
+            self._update_server_latency(winner.server, "latency_ms", now - sent_at)
+            self.latency_samples.append(now - start)
+            # 单次请求的响应只有一帧，首帧时间即服务器响应时间
+            self.latency.record(winner.server.url, "first_chunk", now - sent_at)
+            self.latency.record(winner.server.url, "request_latency", now - start)
+            if trace is not None:
+                response.trace = self._client_trace(trace, response.trace, winner, start, sent_at, now)
             return response
             
         except asyncio.TimeoutError:
-            # 清理超时的请求
-            self.pending_requests.pop(request_id, None)
+            # 清理超时的请求并通知服务器停止生成(对冲的两个副本已在_await_hedged中取消)
+            if request_id in self.pending_requests:
+                await self._cancel_request(conn, request_id)
             self.connection_stats["failed_requests"] += 1
+            conn.stats["failed_requests"] += 1
             raise TimeoutError(f"请求 {request_id} 超时")
+        except asyncio.CancelledError:
+            # 调用方放弃请求(如语音请求被新语音打断)，通知服务器停止生成
+            self._cancel_in_background(conn, request_id)
+            raise
         except Exception as e:
             # 清理失败的请求
             self.pending_requests.pop(request_id, None)
             self.connection_stats["failed_requests"] += 1
+            conn.stats["failed_requests"] += 1
             raise e
+        finally:
+            conn.pending.discard(request_id)
+    
+    def _client_trace(self, trace: Dict[str, Any], server_trace: Optional[Dict[str, Any]],
+                      conn: LLMConnection, start: float, sent_at: float, end: float) -> Dict[str, Any]:
+        """以send_llm_request开始为起点，合并客户端排队/等待和服务器返回的span"""
+        sent_ms = round((sent_at - start) * 1000, 2)
+        spans = [
+            {"name": "llm_client.queue", "start_ms": 0.0, "duration_ms": sent_ms},
+            {"name": "llm_client.wait", "start_ms": sent_ms, "duration_ms": round((end - sent_at) * 1000, 2),
+             "attributes": {"server": conn.server.name}}
+        ]
+        for span in (server_trace or {}).get("spans", []):
+            spans.append({**span, "start_ms": round(span.get("start_ms", 0.0) + sent_ms, 2),
+                          "parent": span.get("parent") or "llm_client.wait"})
+        return {"trace_id": trace.get("trace_id"), "spans": spans}
+    
+    async def send_llm_batch(self,
+                             prompts: List[Union[str, Dict[str, Any]]],
+                             system_prompt: Optional[str] = None,
+                             conversation_history: Optional[List[Dict[str, str]]] = None,
+                             max_tokens: Optional[int] = None,
+                             temperature: Optional[float] = None,
+                             timeout: Optional[float] = None,
+                             on_item: Optional[Callable[[int, LLMResponseData], None]] = None) -> List[LLMResponseData]:
+        """
+        在一个llm_batch_request中发送多个提示，服务器批量生成并分帧返回结果
+        
+        Args:
+            prompts: 提示列表，元素为字符串，或包含prompt/system_prompt/conversation_history的字典
+            system_prompt: 所有条目共用的系统提示词
+            conversation_history: 所有条目共用的对话历史
+            max_tokens: 最大token数
+            temperature: 温度参数
+            timeout: 两个响应帧之间的最长等待时间
+            on_item: 每条结果到达时的回调 (序号, 响应)
+            
+        Returns:
+            与prompts顺序一致的响应列表，单条失败时对应响应的success为False
+        """
+        if not prompts:
+            return []
+        start = time.perf_counter()
+        if self.state != ConnectionState.CONNECTED:
+            raise ConnectionError("WebSocket未连接")
+        conn = self._select_connection()
+        if conn is None:
+            raise ConnectionError("连接池中没有可用连接")
+        
+        request_config = self.config.get("request", {})
+        if system_prompt is None:
+            system_prompt = request_config.get("default_system_prompt", "你是一个友好的AI助手。")
+        if timeout is None:
+            timeout = request_config.get("request_timeout", 30.0)
+        
+        items = []
+        for prompt in prompts:
+            item = dict(prompt) if isinstance(prompt, dict) else {"prompt": prompt}
+            item.setdefault("system_prompt", system_prompt)
+            item.setdefault("conversation_history", conversation_history or [])
+            items.append(item)
+        
+        self.request_counter += 1
+        request_id = f"batch_{self.request_counter}_{int(time.time() * 1000)}"
+        message = {
+            "type": MessageType.LLM_BATCH_REQUEST.value,
+            "requestId": request_id,
+            "data": {
+                "items": items,
+                "max_tokens": max_tokens if max_tokens is not None else request_config.get("max_tokens", 512),
+                "temperature": temperature if temperature is not None else request_config.get("temperature", 0.7)
+            },
+            "timestamp": int(time.time() * 1000)
+        }
+        
+        future = asyncio.get_running_loop().create_future()
+        batch = {
+            "future": future,
+            "results": [None] * len(items),
+            "on_item": on_item,
+            "server": conn.server.url,
+            "start": start,
+            "first_frame": False,
+            "last_frame": time.perf_counter()
+        }
+        self.pending_batches[request_id] = batch
+        conn.pending.add(request_id)
+        conn.stats["requests"] += 1
+        
+        try:
+            await conn.send(message)
+            self.latency.record(conn.server.url, "queue_time", time.perf_counter() - start)
+            self.connection_stats["total_requests"] += len(items)
+            self.logger.info(f"发送批量LLM请求 ID: {request_id}, 共 {len(items)} 条")
+            
+            # 超时按帧间隔计算，长批次只要持续有结果返回就不会超时
+            while not future.done():
+                idle = time.perf_counter() - batch["last_frame"]
+                if idle >= timeout:
+                    raise TimeoutError(f"批量请求 {request_id} 超时")
+                await asyncio.wait([future], timeout=timeout - idle)
+            return future.result()
+        except TimeoutError:
+            # 通知服务器停止生成剩余的条目
+            conn.stats["failed_requests"] += 1
+            await self._cancel_request(conn, request_id)
+            raise
+        except asyncio.CancelledError:
+            self._cancel_in_background(conn, request_id)
+            raise
+        except Exception:
+            conn.stats["failed_requests"] += 1
+            raise
+        finally:
+            self.pending_batches.pop(request_id, None)
+            conn.pending.discard(request_id)
     
     async def send_raw_message(self, message: Dict[str, Any]):
         """发送原始消息"""
         if self.state != ConnectionState.CONNECTED:
             raise ConnectionError("WebSocket未连接")
+        conn = self._select_connection()
+        if conn is None:
+            raise ConnectionError("连接池中没有可用连接")
         
-        await self.websocket.send(json.dumps(message, ensure_ascii=False))
+        await conn.send(message)
     
     async def ping(self) -> bool:
-        """发送PING消息"""
+        """在所有连接上发送PING消息，任一连接成功即返回True"""
         if self.state != ConnectionState.CONNECTED:
             return False
         
-        try:
-            ping_message = {
-                "type": MessageType.PING.value,
-                "timestamp": int(time.time() * 1000)
-            }
-            await self.websocket.send(json.dumps(ping_message))
-            return True
-        except Exception as e:
-            self.logger.error(f"PING发送失败: {e}")
-            return False
-    
-    def _start_health_check(self):
-        """启动健康检查"""
-        if self._health_check_task:
-            return
-        
-        async def health_check_loop():
-            health_config = self.config.get("health_check", {})
-            interval = health_config.get("interval", 30)
-            max_failures = health_config.get("max_failures", 5)
-            failure_count = 0
-            
-            while self.state == ConnectionState.CONNECTED:
-                try:
-                    await asyncio.sleep(interval)
-                    if self.state != ConnectionState.CONNECTED:
-                        break
-                    
-                    if await self.ping():
-                        failure_count = 0
-                    else:
-                        failure_count += 1
-                        self.logger.warning(f"健康检查失败 {failure_count}/{max_failures}")
-                        
-                        if failure_count >= max_failures:
-                            self.logger.error("健康检查连续失败，触发重连")
-                            self._reconnect_task = asyncio.create_task(self._reconnect())
-                            break
-                
-                except asyncio.CancelledError:
-                    break
-                except Exception as e:
-                    self.logger.error(f"健康检查错误: {e}")
-                    failure_count += 1
-        
-        self._health_check_task = asyncio.create_task(health_check_loop())
+        results = await asyncio.gather(*(conn.ping() for conn in self.connections))
+        return any(results)
     
     def is_connected(self) -> bool:
         """检查连接状态"""
-        return self.state == ConnectionState.CONNECTED
+        return self.state == ConnectionState.CONNECTED and any(conn.is_connected() for conn in self.connections)
     
     def get_current_server(self) -> Optional[ServerConfig]:
         """获取当前连接的服务器"""
@@ -626,9 +1355,29 @@ class LLMResponseInterface:
             "current_server_name": self.current_server.name if self.current_server else None,
             "state": self.state.value,
             "stats": self.connection_stats.copy(),
-            "pending_requests": len(self.pending_requests)
+            "pending_requests": len(self.pending_requests),
+            "pending_batches": len(self.pending_batches),
+            "pool_size": self.pool_size,
+            "load_balancing": self.lb_mode,
+            "active_connections": sum(1 for conn in self.connections if conn.is_connected()),
+            "connections": [conn.to_dict() for conn in self.connections],
+            "server_stats": {url: dict(stats) for url, stats in self.server_stats.items()},
+            "hedging": self._hedging_status(),
+            "latency": self.latency.summary()
         }
     
+    def _hedging_status(self) -> Dict[str, Any]:
+        stats = dict(self.hedge_stats)
+        delay = self._hedge_delay()
+        stats.update({
+            "enabled": self.hedging_enabled,
+            "hedge_delay_ms": round(delay * 1000, 2) if delay is not None else None,
+            "hedge_rate": round(stats["hedged"] / stats["requests"], 4) if stats["requests"] else 0.0,
+            "win_rate": round(stats["hedge_wins"] / stats["hedged"], 4) if stats["hedged"] else 0.0,
+            "budget_tokens": round(self._hedge_tokens, 2)
+        })
+        return stats
+    
     def export_logs(self, filename: str = "llm_response_logs.json") -> bool:
         """导出日志和统计信息"""
         try:
@@ -636,7 +1385,8 @@ class LLMResponseInterface:
                 "timestamp": time.time(),
                 "connection_status": self.get_connection_status(),
                 "config": self.config,
-                "pending_requests": list(self.pending_requests.keys())
+                "pending_requests": list(self.pending_requests.keys()),
+                "latency_histograms": self.latency.to_dict()
             }
             
             with open(filename, 'w', encoding='utf-8') as f:
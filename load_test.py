@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+WebSocket服务器压测工具
+模拟N个客户端按消息配比向SenceVoice服务器或LLM服务器发送请求：
+- 闭环(closed)：每个客户端收到响应后按思考时间再发下一条
+- 开环(open)：按固定到达率(泊松分布)发送，不等待响应，延迟从计划发送时刻算起
+
+可用 --spawn 直接拉起使用模拟引擎的本地服务器；结果以JSON输出吞吐、p50/p95/p99延迟、
+错误率和服务器每请求CPU时间(从服务器 /metrics 的 process_cpu_seconds 计算)，用 --baseline 与上次结果对比
+
+示例:
+    python load_test.py --target sencevoice --spawn --clients 20 --duration 30 --mix voice_request=1,ping=4
+    python load_test.py --target llm --spawn --mode open --rate 50 --output result.json
+    python load_test.py --target llm --url ws://127.0.0.1:8000 --metrics-url http://127.0.0.1:9100/metrics
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import wave
+from collections import Counter, deque
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import websockets
+import yaml
+
+from message_codec import JSON_CODEC, SUBPROTOCOL_MSGPACK, codec_for
+
+# 各服务器支持的消息类型，及发送时使用的实际消息名
+TARGET_MESSAGES = {
+    "sencevoice": {"voice_request": "voice_request", "status_request": "status_request", "ping": "ping"},
+    "llm": {"llm_request": "llm_request", "ping": "ping"}
+}
+
+DEFAULT_MIX = {
+    "sencevoice": "voice_request=1,ping=2,status_request=1",
+    "llm": "llm_request=4,ping=1"
+}
+
+PROMPTS = ["你好", "今天天气怎么样？", "给我讲一个简短的笑话", "帮我总结一下今天的日程安排，并提醒我下午三点开会"]
+
+
+@dataclass
+class LoadConfig:
+    """压测配置"""
+    target: str = "sencevoice"
+    url: str = "ws://127.0.0.1:8000"
+    metrics_url: Optional[str] = None
+    clients: int = 10
+    duration: float = 30.0
+    mode: str = "closed"  # closed | open
+    rate: float = 20.0  # 开环模式下所有客户端合计每秒请求数
+    think_ms: float = 500.0  # 闭环模式下两次请求之间的平均思考时间
+    mix: Dict[str, float] = field(default_factory=dict)
+    audio_seconds: List[float] = field(default_factory=lambda: [1.0, 3.0])
+    timeout: float = 30.0
+    codec: str = "json"  # json | msgpack
+    seed: int = 0
+
+
+def parse_mix(text: str, target: str) -> Dict[str, float]:
+    """解析 "voice_request=1,ping=4" 形式的消息配比"""
+    mix = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in TARGET_MESSAGES[target]:
+            raise ValueError(f"{target}服务器不支持消息类型 {name}，可选: {', '.join(TARGET_MESSAGES[target])}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("消息配比为空")
+    return mix
+
+
+_audio_cache: Dict[float, str] = {}
+
+
+def make_audio(seconds: float, sample_rate: int = 16000) -> str:
+    """生成指定时长的16bit单声道WAV(带噪声的正弦音，能通过VAD)，返回base64"""
+    if seconds not in _audio_cache:
+        t = np.arange(int(seconds * sample_rate)) / sample_rate
+        rng = np.random.default_rng(int(seconds * 1000))
+        signal = np.sin(2 * np.pi * 220 * t) * 6000 + rng.normal(0, 800, t.size)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(signal.astype(np.int16).tobytes())
+        _audio_cache[seconds] = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return _audio_cache[seconds]
+
+
+def build_message(kind: str, config: LoadConfig, rng: random.Random, request_id: str) -> Dict[str, Any]:
+    """按消息类型构造一条请求"""
+    message = {"type": TARGET_MESSAGES[config.target][kind], "requestId": request_id,
+               "timestamp": int(time.time() * 1000)}
+    if kind == "voice_request":
+        # 每条语音使用独立会话，避免同一连接上的请求互相打断
+        message["data"] = {"audio_data": make_audio(rng.choice(config.audio_seconds)), "audio_format": "wav",
+                           "sample_rate": 16000, "session_id": request_id}
+    elif kind == "llm_request":
+        message["data"] = {"prompt": rng.choice(PROMPTS), "max_tokens": 128, "temperature": 0.7}
+    elif kind == "status_request":
+        message["data"] = {}
+    return message
+
+
+class Recorder:
+    """记录每类消息的延迟和错误"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.sent = Counter()
+        self.errors = Counter()
+        self.error_reasons = Counter()
+
+    def record(self, kind: str, seconds: float, error: Optional[str]):
+        if error is None:
+            self.latencies.setdefault(kind, []).append(seconds * 1000)
+        else:
+            self.errors[kind] += 1
+            self.error_reasons[f"{kind}: {error}"[:120]] += 1
+
+    @staticmethod
+    def _percentiles(values: List[float]) -> Dict[str, Any]:
+        if not values:
+            return {"count": 0}
+        ordered = sorted(values)
+
+        def pick(p: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 2)
+
+        return {"count": len(ordered), "mean_ms": round(sum(ordered) / len(ordered), 2),
+                "p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99), "max_ms": round(ordered[-1], 2)}
+
+    def summary(self) -> Dict[str, Any]:
+        everything = [value for values in self.latencies.values() for value in values]
+        per_type = {}
+        for kind in sorted(set(self.sent) | set(self.latencies)):
+            stats = self._percentiles(self.latencies.get(kind, []))
+            stats["sent"] = self.sent[kind]
+            stats["errors"] = self.errors[kind]
+            per_type[kind] = stats
+        return {"overall": self._percentiles(everything), "by_type": per_type}
+
+
+class LoadClient:
+    """一个模拟客户端：一条连接，按requestId匹配响应，pong按发送顺序匹配"""
+
+    def __init__(self, config: LoadConfig, index: int):
+        self.config = config
+        self.index = index
+        self.websocket = None
+        self.codec = JSON_CODEC
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.pings: deque = deque()
+        self._reader = None
+
+    async def connect(self):
+        subprotocols = [SUBPROTOCOL_MSGPACK] if self.config.codec == "msgpack" else None
+        self.websocket = await websockets.connect(self.config.url, max_size=None, open_timeout=10,
+                                                  subprotocols=subprotocols)
+        self.codec = codec_for(self.websocket)
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for frame in self.websocket:
+                data = self.codec.decode(frame)
+                if data.get("type") == "pong":
+                    future = self.pings.popleft() if self.pings else None
+                else:
+                    future = self.pending.pop(data.get("requestId"), None)
+                if future is not None and not future.done():
+                    future.set_result(data)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            for future in list(self.pending.values()) + list(self.pings):
+                if not future.done():
+                    future.set_exception(ConnectionError("连接已关闭"))
+
+    async def request(self, message: Dict[str, Any]) -> Optional[str]:
+        """发送一条请求并等待响应，成功返回None，失败返回错误原因"""
+        future = asyncio.get_running_loop().create_future()
+        if message["type"] == "ping":
+            self.pings.append(future)
+        else:
+            self.pending[message["requestId"]] = future
+        try:
+            await self.websocket.send(self.codec.encode(message))
+            response = await asyncio.wait_for(future, self.config.timeout)
+        except asyncio.TimeoutError:
+            self.pending.pop(message.get("requestId"), None)
+            if future in self.pings:
+                self.pings.remove(future)
+            return "timeout"
+        except Exception as e:
+            return type(e).__name__
+        if response.get("type") == "error" or response.get("success") is False:
+            data = response.get("data") or {}
+            return str(response.get("error_code") or data.get("error_code") or response.get("error")
+                       or data.get("error") or "error")
+        return None
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self._reader is not None:
+            await self._reader
+
+
+def scrape_cpu_seconds(metrics_url: Optional[str]) -> Optional[float]:
+    """从服务器 /metrics 读取累计CPU时间，不可用时返回None"""
+    if not metrics_url:
+        return None
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=5) as response:
+            body = response.read().decode("utf-8")
+    except OSError:
+        return None
+    for line in body.splitlines():
+        name, _, value = line.partition(" ")
+        if name.endswith("process_cpu_seconds"):
+            return float(value)
+    return None
+
+
+async def run_load(config: LoadConfig) -> Dict[str, Any]:
+    """按配置运行一次压测，返回结果"""
+    rng = random.Random(config.seed)
+    kinds, weights = list(config.mix), list(config.mix.values())
+    recorder = Recorder()
+    sequence = 0
+
+    clients = [LoadClient(config, i) for i in range(config.clients)]
+    await asyncio.gather(*(client.connect() for client in clients))
+    for kind in kinds:
+        if kind == "voice_request":
+            for seconds in config.audio_seconds:
+                make_audio(seconds)
+
+    async def issue(client: LoadClient, scheduled: float):
+        nonlocal sequence
+        sequence += 1
+        kind = rng.choices(kinds, weights)[0]
+        message = build_message(kind, config, rng, f"load_{client.index}_{sequence}")
+        recorder.sent[kind] += 1
+        error = await client.request(message)
+        recorder.record(kind, time.perf_counter() - scheduled, error)
+
+    cpu_before = await asyncio.to_thread(scrape_cpu_seconds, config.metrics_url)
+    client_cpu_before = time.process_time()
+    start = time.perf_counter()
+    deadline = start + config.duration
+
+    if config.mode == "closed":
+        async def closed_loop(client: LoadClient):
+            while time.perf_counter() < deadline:
+                await issue(client, time.perf_counter())
+                if config.think_ms > 0:
+                    await asyncio.sleep(rng.expovariate(1000 / config.think_ms))
+
+        await asyncio.gather(*(closed_loop(client) for client in clients))
+    else:
+        tasks = set()
+        scheduled = start
+        i = 0
+        while True:
+            scheduled += rng.expovariate(config.rate)
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(issue(clients[i % len(clients)], scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            i += 1
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - start
+    client_cpu = time.process_time() - client_cpu_before
+    cpu_after = await asyncio.to_thread(scrape_cpu_seconds, config.metrics_url)
+    codecs = sorted({client.codec.name for client in clients})
+    await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    latency = recorder.summary()
+    sent = sum(recorder.sent.values())
+    errors = sum(recorder.errors.values())
+    completed = sent - errors
+    server_cpu = None
+    if cpu_before is not None and cpu_after is not None:
+        server_cpu = {
+            "cpu_seconds": round(cpu_after - cpu_before, 4),
+            "cpu_ms_per_request": round((cpu_after - cpu_before) * 1000 / sent, 3) if sent else None
+        }
+    return {
+        "config": asdict(config),
+        "negotiated_codec": codecs,
+        "elapsed_s": round(elapsed, 3),
+        "sent": sent,
+        "completed": completed,
+        "errors": errors,
+        "error_rate": round(errors / sent, 4) if sent else 0.0,
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency": latency,
+        "error_reasons": dict(recorder.error_reasons.most_common(20)),
+        "server": server_cpu,
+        "client_cpu_ms_per_request": round(client_cpu * 1000 / sent, 3) if sent else None
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(target: str, workdir: str, codec: str = "auto",
+                 workers: int = 1) -> Tuple[subprocess.Popen, str, str]:
+    """拉起使用模拟引擎的本地服务器，返回(进程, WebSocket地址, 指标地址)；workers大于1时为多进程模式"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    port, metrics_port = _free_port(), _free_port()
+    if target == "llm":
+        command = [sys.executable, os.path.join(here, "websocket_llm_server.py"), "--host", "127.0.0.1",
+                   "--port", str(port), "--metrics-port", str(metrics_port),
+                   "--log-file", os.path.join(workdir, "llm_server.log"), "--codec", codec,
+                   "--workers", str(workers)]
+    else:
+        config_file = os.path.join(workdir, "server_config.yaml")
+        subprocess.run([sys.executable, os.path.join(here, "sencevoice_websocket_server.py"),
+                        "--create-config", "--config", config_file], check=True, cwd=workdir,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(config_file, "r", encoding="utf-8") as f:
+            server_config = yaml.safe_load(f)
+        server_config["server"].update({"host": "127.0.0.1", "port": port, "codec": codec, "workers": workers})
+        # 压测只走语音主流程，不需要唤醒词和声纹
+        server_config["features"].update({"enable_kws": False, "enable_sv": False})
+        server_config["paths"].update({"output_dir": os.path.join(workdir, "output"),
+                                       "sv_enroll_dir": os.path.join(workdir, "enroll")})
+        server_config["metrics"].update({"enabled": True, "host": "127.0.0.1", "port": metrics_port})
+        server_config["tracing"]["file"] = os.path.join(workdir, "traces.jsonl")
+        server_config["logging"]["file"] = os.path.join(workdir, "sencevoice_server.log")
+        with open(config_file, "w", encoding="utf-8") as f:
+            yaml.dump(server_config, f, allow_unicode=True)
+        command = [sys.executable, os.path.join(here, "sencevoice_websocket_server.py"), "--config", config_file]
+
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # 等待端口可连接
+    for _ in range(200):
+        if process.poll() is not None:
+            raise RuntimeError(f"服务器启动失败，退出码 {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                break
+        except OSError:
+            time.sleep(0.05)
+    else:
+        process.kill()
+        raise RuntimeError("等待服务器启动超时")
+    # 多进程时等所有工作进程就绪，避免先启动的进程承担全部连接
+    metrics_url = f"http://127.0.0.1:{metrics_port}/metrics"
+    for _ in range(600 if workers > 1 else 0):
+        try:
+            with urllib.request.urlopen(metrics_url, timeout=2) as response:
+                if f"_supervisor_workers_ready {workers}\n" in response.read().decode("utf-8"):
+                    break
+        except OSError:
+            pass
+        time.sleep(0.1)
+    return process, f"ws://127.0.0.1:{port}", metrics_url
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """与基线结果对比吞吐、延迟、错误率和CPU"""
+    def get(data, *path):
+        for key in path:
+            data = (data or {}).get(key)
+        return data
+
+    lines = []
+    for label, path, higher_is_better in (
+        ("吞吐(rps)", ("throughput_rps",), True),
+        ("p50(ms)", ("latency", "overall", "p50_ms"), False),
+        ("p95(ms)", ("latency", "overall", "p95_ms"), False),
+        ("p99(ms)", ("latency", "overall", "p99_ms"), False),
+        ("错误率", ("error_rate",), False),
+        ("服务器CPU(ms/请求)", ("server", "cpu_ms_per_request"), False)
+    ):
+        new, old = get(result, *path), get(baseline, *path)
+        if new is None or old is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = (change > 0) == higher_is_better or change == 0
+        lines.append(f"{label:<20} {old:>10} → {new:<10} {change:+.1f}% {'✅' if better else '⚠️'}")
+    return lines
+
+
+def print_summary(result: Dict[str, Any]):
+    overall = result["latency"]["overall"]
+    print(f"📊 {result['config']['target']} / {result['config']['mode']} / {result['config']['clients']}客户端 "
+          f"/ 编码 {','.join(result['negotiated_codec'])}", file=sys.stderr)
+    print(f"   发送 {result['sent']}, 完成 {result['completed']}, 错误率 {result['error_rate']:.2%}, "
+          f"吞吐 {result['throughput_rps']} rps", file=sys.stderr)
+    if overall.get("count"):
+        print(f"   延迟 p50 {overall['p50_ms']}ms, p95 {overall['p95_ms']}ms, p99 {overall['p99_ms']}ms", file=sys.stderr)
+    for kind, stats in result["latency"]["by_type"].items():
+        if stats.get("count"):
+            print(f"   - {kind:<16} {stats['count']:>6} 条  p50 {stats['p50_ms']}ms  p99 {stats['p99_ms']}ms  "
+                  f"错误 {stats['errors']}", file=sys.stderr)
+    if result["server"]:
+        print(f"   服务器CPU {result['server']['cpu_ms_per_request']} ms/请求", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SenceVoice / LLM WebSocket服务器压测")
+    parser.add_argument("--target", choices=list(TARGET_MESSAGES), default="sencevoice", help="被测服务器类型")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000", help="服务器地址 (使用--spawn时忽略)")
+    parser.add_argument("--metrics-url", default=None, help="服务器 /metrics 地址，用于计算每请求CPU")
+    parser.add_argument("--spawn", action="store_true", help="拉起使用模拟引擎的本地服务器")
+    parser.add_argument("--workers", type=int, default=1, help="使用--spawn时服务器的工作进程数")
+    parser.add_argument("--clients", type=int, default=10, help="模拟客户端(连接)数")
+    parser.add_argument("--duration", type=float, default=30.0, help="发送请求的时长(秒)")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed", help="闭环或开环")
+    parser.add_argument("--rate", type=float, default=20.0, help="开环模式每秒请求数")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="闭环模式平均思考时间(毫秒)")
+    parser.add_argument("--mix", default=None, help="消息配比，如 voice_request=1,ping=4,status_request=1")
+    parser.add_argument("--audio-seconds", default="1,3", help="语音请求的音频时长(秒)，随机选取")
+    parser.add_argument("--timeout", type=float, default=30.0, help="单个请求超时(秒)")
+    parser.add_argument("--codec", choices=["json", "msgpack"], default="json", help="客户端请求的消息编码")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", default=None, help="结果JSON文件，不指定则输出到标准输出")
+    parser.add_argument("--baseline", default=None, help="与之对比的上次结果JSON")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix or DEFAULT_MIX[args.target], args.target)
+    except ValueError as e:
+        parser.error(str(e))
+
+    config = LoadConfig(
+        target=args.target, url=args.url, metrics_url=args.metrics_url, clients=args.clients,
+        duration=args.duration, mode=args.mode, rate=args.rate, think_ms=args.think_ms,
+        mix=mix,
+        audio_seconds=[float(s) for s in args.audio_seconds.split(",")],
+        timeout=args.timeout, codec=args.codec, seed=args.seed
+    )
+
+    process = None
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if args.spawn:
+                process, config.url, config.metrics_url = spawn_server(config.target, workdir, workers=args.workers)
+            result = asyncio.run(run_load(config))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=60)
+
+    print_summary(result)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            for line in compare(result, json.load(f)):
+                print("   " + line, file=sys.stderr)
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+非阻塞日志
+事件循环线程只把日志记录放入队列，格式化和写文件在后台线程中完成；
+文件日志为每行一个JSON并按大小轮转，ping、消息接收等高频日志按类别采样
+
+运行 python log_pipeline.py 对比同步FileHandler与队列日志在调用线程上的单条耗时
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from typing import Dict, Optional
+
+# 高频日志的类别，通过 extra={"category": ...} 标记
+CATEGORY_PING = "ping"
+CATEGORY_MESSAGE = "message"
+
+# 标准LogRecord属性，其余属性视为extra字段写入JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "category"}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        category = getattr(record, "category", None)
+        if category:
+            data["category"] = category
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text or record.exc_info:
+            data["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class CategorySampler(logging.Filter):
+    """按类别每N条保留1条，WARNING及以上总是保留"""
+
+    def __init__(self, rates: Optional[Dict[str, int]] = None):
+        super().__init__()
+        self.configure(rates or {})
+
+    def configure(self, rates: Dict[str, int]):
+        self.rates = {category: max(1, rate) for category, rate in rates.items()}
+        self.counters = {category: 0 for category in self.rates}
+        self.dropped = {category: 0 for category in self.rates}
+
+    def allow(self, category: str, levelno: int = logging.INFO) -> bool:
+        rate = self.rates.get(category)
+        if rate is None or rate == 1 or levelno >= logging.WARNING:
+            return True
+        self.counters[category] += 1
+        if self.counters[category] % rate == 1:
+            return True
+        self.dropped[category] += 1
+        return False
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "category", None)
+        return category is None or self.allow(category, record.levelno)
+
+
+# 进程内共用的采样器，由setup_logging配置
+sampler = CategorySampler()
+
+
+def sampled(category: str) -> bool:
+    """
+    在创建日志记录之前判断该类别的这一条是否保留，用于热路径:
+        if sampled(CATEGORY_MESSAGE): logger.info("...", ...)
+    """
+    return sampler.allow(category)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    入队时不格式化消息(标准QueueHandler会在调用线程上合并msg和args)，
+    只提前把异常转成文本，避免跨线程持有栈帧
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.stack_info:
+            record.stack_info = str(record.stack_info)
+        return record
+
+
+def setup_logging(log_file: str, level: int = logging.INFO, json_format: bool = True,
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                  sample_rates: Optional[Dict[str, int]] = None,
+                  console: bool = True) -> logging.handlers.QueueListener:
+    """
+    配置根日志记录器：调用线程只入队，后台线程写控制台和按大小轮转的日志文件
+
+    Args:
+        log_file: 日志文件路径
+        json_format: 文件日志是否为JSON行格式
+        max_bytes: 单个日志文件的最大字节数，超过后轮转
+        backup_count: 保留的轮转文件数
+        sample_rates: 类别 -> 每N条保留1条，如 {"ping": 100, "message": 10}
+        console: 是否同时输出到控制台
+
+    Returns:
+        后台监听器，进程退出前调用stop()把队列中的日志写完
+    """
+    file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                                        backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter() if json_format
+                              else logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    handlers = [file_handler]
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        handlers.append(stream_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    sampler.configure(sample_rates or {})
+    queue_handler.addFilter(sampler)
+    # JSON日志不使用线程名和进程名，省去每条记录的查询
+    logging.logThreads = False
+    logging.logMultiprocessing = False
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def benchmark(messages: int = 20000):
+    """对比调用线程上每条日志的耗时：同步FileHandler + f-string vs 队列 + 延迟格式化 + 采样"""
+    import os
+    import tempfile
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_logger = logging.getLogger("log_pipeline.bench")
+        root = logging.getLogger()
+        saved_handlers, saved_level = list(root.handlers), root.level
+
+        def run(label: str, log_call):
+            timings = []
+            for i in range(messages):
+                start = time.perf_counter()
+                log_call(i)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            results[label] = {
+                "mean_us": sum(timings) / len(timings) * 1e6,
+                "p99_us": timings[int(len(timings) * 0.99)] * 1e6,
+                "max_us": timings[-1] * 1e6
+            }
+
+        # 同步：与原先basicConfig(FileHandler)相同
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        sync_handler = logging.FileHandler(os.path.join(tmp, "sync.log"), encoding='utf-8')
+        sync_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        root.addHandler(sync_handler)
+        root.setLevel(logging.INFO)
+        run("sync_file_fstring", lambda i: bench_logger.info(f"📨 收到消息类型: voice_request, ID: req_{i}, 客户端: 127.0.0.1:5000"))
+        run("sync_file_ping", lambda i: bench_logger.info(f"🏓 PONG响应已发送 {i}"))
+        root.removeHandler(sync_handler)
+        sync_handler.close()
+
+        listener = setup_logging(os.path.join(tmp, "queued.log"), console=False,
+                                 sample_rates={CATEGORY_PING: 100, CATEGORY_MESSAGE: 10})
+        run("queued_lazy", lambda i: bench_logger.info("📨 收到消息类型: %s, ID: %s, 客户端: %s", "voice_request",
+                                                      f"req_{i}", "127.0.0.1:5000"))
+        run("queued_lazy_sampled_message", lambda i: bench_logger.info(
+            "📨 收到消息类型: %s, ID: %s, 客户端: %s", "voice_request", f"req_{i}", "127.0.0.1:5000",
+            extra={"category": CATEGORY_MESSAGE}))
+        run("queued_guarded_message", lambda i: sampled(CATEGORY_MESSAGE) and bench_logger.info(
+            "📨 收到消息类型: %s, ID: %s, 客户端: %s", "voice_request", f"req_{i}", "127.0.0.1:5000"))
+        run("queued_guarded_ping", lambda i: sampled(CATEGORY_PING) and bench_logger.info("🏓 PONG响应已发送 %s", i))
+        listener.stop()
+        sampler.configure({})
+        logging.logThreads = True
+        logging.logMultiprocessing = True
+
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in saved_handlers:
+            root.addHandler(handler)
+        root.setLevel(saved_level)
+
+    print("调用线程上每条日志的耗时(us)")
+    print(f"{'场景':<30} {'平均':>10} {'p99':>10} {'最大':>10}")
+    for label, stats in results.items():
+        print(f"{label:<30} {stats['mean_us']:>10.2f} {stats['p99_us']:>10.2f} {stats['max_us']:>10.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+消息编解码
+通过WebSocket子协议协商编码：双方都支持时使用MessagePack二进制帧，否则使用JSON文本帧；
+未声明子协议的客户端(包括前端App)保持原来的JSON，不受影响
+
+运行 python message_codec.py 对比JSON与MessagePack的编解码吞吐
+"""
+
+import base64
+import json
+import time
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖，未安装时只使用JSON
+    msgpack = None
+
+SUBPROTOCOL_MSGPACK = "lingjing.msgpack.v1"
+SUBPROTOCOL_JSON = "lingjing.json.v1"
+
+Frame = Union[str, bytes]
+
+
+class MessageDecodeError(ValueError):
+    """帧无法解码为消息"""
+
+
+class JsonCodec:
+    """JSON文本帧，与原协议相同"""
+
+    name = "json"
+    subprotocol = SUBPROTOCOL_JSON
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        return json.dumps(message, ensure_ascii=False)
+
+    def decode(self, frame: Frame) -> Any:
+        try:
+            return json.loads(frame)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise MessageDecodeError(f"Invalid JSON format: {e}") from e
+
+    def timestamp_prefix(self, message: Dict[str, Any]) -> str:
+        # json.dumps默认分隔符下以 `"timestamp": 0}` 结尾
+        return self.encode(message)[:-2]
+
+    def with_timestamp(self, prefix: str, timestamp_ms: int) -> str:
+        return f"{prefix}{timestamp_ms}}}"
+
+
+class MsgpackCodec:
+    """MessagePack二进制帧；对端仍发送文本帧时按JSON解析"""
+
+    name = "msgpack"
+    subprotocol = SUBPROTOCOL_MSGPACK
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, frame: Frame) -> Any:
+        if isinstance(frame, str):
+            return JSON_CODEC.decode(frame)
+        try:
+            return msgpack.unpackb(frame, raw=False)
+        except ValueError as e:
+            raise MessageDecodeError(f"Invalid MessagePack format: {e}") from e
+
+    def timestamp_prefix(self, message: Dict[str, Any]) -> bytes:
+        # 末尾的0编码为单字节
+        return self.encode(message)[:-1]
+
+    def with_timestamp(self, prefix: bytes, timestamp_ms: int) -> bytes:
+        return prefix + msgpack.packb(timestamp_ms)
+
+
+JSON_CODEC = JsonCodec()
+CODECS = {SUBPROTOCOL_JSON: JSON_CODEC}
+if msgpack is not None:
+    CODECS[SUBPROTOCOL_MSGPACK] = MsgpackCodec()
+
+
+def supported_subprotocols(preference: str = "auto") -> List[str]:
+    """
+    本端支持的子协议，按优先顺序，用于websockets.serve/connect的subprotocols参数
+
+    Args:
+        preference: auto(有msgpack时优先使用) | msgpack | json
+    """
+    if preference == "json" or msgpack is None:
+        return [SUBPROTOCOL_JSON]
+    return [SUBPROTOCOL_MSGPACK, SUBPROTOCOL_JSON]
+
+
+def codec_for(websocket) -> Union[JsonCodec, MsgpackCodec]:
+    """按连接协商出的子协议选择编码，未协商时为JSON"""
+    return CODECS.get(getattr(websocket, "subprotocol", None), JSON_CODEC)
+
+
+class StaticFrame:
+    """
+    按编码缓存的预编码帧，用于pong、欢迎消息等内容固定的消息；
+    只有末尾的毫秒时间戳每次变化，发送时拼接到预编码的前缀后面
+    """
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = {key: value for key, value in message.items() if key != "timestamp"}
+        self.message["timestamp"] = 0
+        self._prefixes: Dict[str, Frame] = {}
+
+    def frame(self, codec, timestamp_ms: Optional[int] = None) -> Frame:
+        prefix = self._prefixes.get(codec.name)
+        if prefix is None:
+            prefix = self._prefixes[codec.name] = codec.timestamp_prefix(self.message)
+        if timestamp_ms is None:
+            timestamp_ms = int(time.time() * 1000)
+        return codec.with_timestamp(prefix, timestamp_ms)
+
+
+def benchmark(seconds: float = 0.5):
+    """各编码对典型消息的编解码吞吐"""
+    audio = base64.b64encode(bytes(range(256)) * 125).decode("ascii")  # 约1秒16kHz PCM
+    samples = {
+        "ping": {"type": "ping", "timestamp": 1700000000000},
+        "llm_request": {
+            "type": "llm_request", "requestId": "req_1700000000000_1", "timestamp": 1700000000000,
+            "data": {"prompt": "今天天气怎么样？适合出门散步吗？", "system_prompt": "你叫小千，是一个友好的语音助手，回答简短一些。",
+                     "conversation_history": [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好！有什么可以帮你？"}],
+                     "max_tokens": 512, "temperature": 0.7}
+        },
+        "llm_response": {
+            "type": "llm_response", "requestId": "req_1700000000000_1", "success": True, "timestamp": 1700000000000,
+            "data": {"message": "今天天气晴朗，气温二十度左右，很适合出门散步。" * 4, "model": "mock", "processing_time": 0.5}
+        },
+        "voice_request": {
+            "type": "voice_request", "requestId": "req_1700000000000_2", "timestamp": 1700000000000,
+            "data": {"audio_data": audio, "audio_format": "wav", "sample_rate": 16000}
+        }
+    }
+
+    def rate(func) -> float:
+        count, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            for _ in range(100):
+                func()
+            count += 100
+        return count / (time.perf_counter() - start)
+
+    results = {}
+    for codec in CODECS.values():
+        for label, message in samples.items():
+            frame = codec.encode(message)
+            size = len(frame.encode("utf-8")) if isinstance(frame, str) else len(frame)
+            encode_rate = rate(lambda: codec.encode(message))
+            decode_rate = rate(lambda: codec.decode(frame))
+            results[f"{codec.name}/{label}"] = {
+                "bytes": size,
+                "encode_per_s": encode_rate,
+                "decode_per_s": decode_rate,
+                "encode_mb_s": encode_rate * size / 1e6,
+                "decode_mb_s": decode_rate * size / 1e6
+            }
+    pong = StaticFrame({"type": "pong"})
+    for codec in CODECS.values():
+        results[f"{codec.name}/pong_static"] = {
+            "bytes": len(pong.frame(codec, 1700000000000)),
+            "encode_per_s": rate(lambda: pong.frame(codec)),
+            "encode_per_s_dumps": rate(lambda: codec.encode({"type": "pong", "timestamp": int(time.time() * 1000)}))
+        }
+
+    if msgpack is None:
+        print("未安装msgpack，只测试JSON (pip install msgpack)")
+    print(f"{'编码/消息':<24} {'字节':>8} {'编码/s':>12} {'解码/s':>12} {'编码MB/s':>10} {'解码MB/s':>10}")
+    for label, stats in results.items():
+        if "decode_per_s" in stats:
+            print(f"{label:<24} {stats['bytes']:>8} {stats['encode_per_s']:>12.0f} {stats['decode_per_s']:>12.0f} "
+                  f"{stats['encode_mb_s']:>10.1f} {stats['decode_mb_s']:>10.1f}")
+        else:
+            print(f"{label:<24} {stats['bytes']:>8} 预编码 {stats['encode_per_s']:.0f}/s, "
+                  f"每次编码 {stats['encode_per_s_dumps']:.0f}/s")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
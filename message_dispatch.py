@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+连接内消息并发分发
+同一连接上的耗时请求(语音识别、LLM生成等)以任务方式并发执行，
+ping/状态查询等控制消息不再被前面的长请求阻塞，响应仍通过requestId对应
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 错误回调: (错误信息, requestId)
+ErrorCallback = Callable[[str, Optional[str]], Awaitable[None]]
+
+
+class ConnectionDispatcher:
+    """
+    单个连接的消息分发器
+
+    - inline_types中的消息在读循环中直接处理，保证控制消息即时响应
+    - 其余消息作为任务执行，同时执行的数量不超过max_inflight，
+      排队数量超过max_pending时直接返回繁忙错误
+    - ordered_types中的消息按到达顺序依次执行(如会修改唤醒/声纹状态的请求)
+    - 未完成的任务可按requestId取消(客户端放弃请求或对冲请求落败时)
+    """
+
+    def __init__(self, on_error: ErrorCallback, max_inflight: int = 4, max_pending: Optional[int] = None,
+                 inline_types: Iterable[str] = ("ping",), ordered_types: Iterable[str] = ()):
+        self.on_error = on_error
+        self.max_inflight = max(1, max_inflight)
+        self.max_pending = max_pending if max_pending is not None else self.max_inflight * 4
+        self.inline_types = set(inline_types)
+        self.ordered_types = set(ordered_types)
+
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self._tasks: Set[asyncio.Task] = set()
+        self._by_request: Dict[str, asyncio.Task] = {}
+        self._last_ordered: Optional[asyncio.Task] = None
+        self._running = 0
+
+        self.stats = {
+            "inline": 0,
+            "dispatched": 0,
+            "rejected": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "max_concurrent": 0
+        }
+
+    @property
+    def pending(self) -> int:
+        """尚未完成的任务数(含等待执行的)"""
+        return len(self._tasks)
+
+    @property
+    def running(self) -> int:
+        """正在执行的任务数"""
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        """等待执行名额的任务数"""
+        return len(self._tasks) - self._running
+
+    async def dispatch(self, message_type: Optional[str], request_id: Optional[str],
+                       handler: Callable[[], Awaitable[None]]) -> Optional[asyncio.Task]:
+        """
+        分发一条已解析的消息，handler为实际处理该消息的协程函数
+
+        Returns:
+            以任务方式执行时返回该任务(可用于取消)，直接处理或被拒绝时返回None
+        """
+        if message_type in self.inline_types:
+            self.stats["inline"] += 1
+            await self._run(handler, request_id)
+            return None
+
+        if len(self._tasks) >= self.max_pending:
+            self.stats["rejected"] += 1
+            await self.on_error(f"Too many in-flight requests (limit {self.max_pending})", request_id)
+            return None
+
+        previous = self._last_ordered if message_type in self.ordered_types else None
+        task = asyncio.create_task(self._run_task(handler, request_id, previous))
+        if message_type in self.ordered_types:
+            self._last_ordered = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if request_id is not None:
+            self._by_request[request_id] = task
+            task.add_done_callback(lambda _, request_id=request_id: self._by_request.pop(request_id, None))
+        self.stats["dispatched"] += 1
+        return task
+
+    def cancel(self, request_id: Optional[str]) -> bool:
+        """取消指定requestId的未完成任务，返回是否找到该任务"""
+        task = self._by_request.get(request_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        self.stats["cancelled"] += 1
+        return True
+
+    async def _run_task(self, handler: Callable[[], Awaitable[None]], request_id: Optional[str],
+                        previous: Optional[asyncio.Task]):
+        if previous is not None and not previous.done():
+            try:
+                await asyncio.wait([previous])
+            except asyncio.CancelledError:
+                # 排队中被取消(如被新语音打断)时仍等前一个有序任务结束再完成：
+                # 后续有序任务以本任务为前驱，提前结束会让它们越过仍在执行的前驱
+                while not previous.done():
+                    try:
+                        await asyncio.wait([previous])
+                    except asyncio.CancelledError:
+                        pass
+                raise
+        async with self._slots:
+            self._running += 1
+            self.stats["max_concurrent"] = max(self.stats["max_concurrent"], self._running)
+            try:
+                await self._run(handler, request_id)
+            finally:
+                self._running -= 1
+
+    async def _run(self, handler: Callable[[], Awaitable[None]], request_id: Optional[str]):
+        try:
+            await handler()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"处理消息错误: {e}")
+            await self.on_error(str(e), request_id)
+
+    async def close(self):
+        """连接断开时取消所有未完成的任务"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._last_ordered = None
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+消息热路径微基准
+覆盖每条消息的固定开销：voice_request的JSON/MessagePack编解码、1-10MB音频的base64解码、
+SenceVoiceServer.process_message分发、LLMResponseInterface._handle_message的Future完成、
+check_keyword_activation以及响应构造
+
+每项在独立子进程中准备数据并测量，结果不受运行顺序和其他项内存分配的影响；
+先校准循环次数使单次测量约为 --min-time 秒，关闭GC后重复 --repeat 次，取最小值作为结果
+(中位数和离散度一并输出用于判断噪声)；日志在测量期间关闭，数字只反映代码本身
+
+示例:
+    python microbench.py --output baseline.json
+    python microbench.py --baseline baseline.json           # 与基线对比，超出阈值的变化会被标出
+    python microbench.py --filter base64 --repeat 11
+"""
+
+import argparse
+import asyncio
+import base64
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class BenchCase:
+    """一个基准项：run(n)执行n次被测操作；nbytes为每次处理的字节数，用于计算MB/s"""
+
+    def __init__(self, name: str, run: Callable[[int], None], nbytes: Optional[int] = None):
+        self.name = name
+        self.run = run
+        self.nbytes = nbytes
+
+
+def sync_case(name: str, func: Callable[[], Any], nbytes: Optional[int] = None) -> BenchCase:
+    def run(n: int):
+        for _ in range(n):
+            func()
+    return BenchCase(name, run, nbytes)
+
+
+def async_case(name: str, loop: asyncio.AbstractEventLoop, func: Callable[[], Any],
+               nbytes: Optional[int] = None) -> BenchCase:
+    """在同一个事件循环里连续await n次，不把循环启动的开销算进每次操作"""
+    async def many(n: int):
+        for _ in range(n):
+            await func()
+    return BenchCase(name, lambda n: loop.run_until_complete(many(n)), nbytes)
+
+
+def measure(case: BenchCase, min_time: float, repeat: int) -> Dict[str, Any]:
+    """校准循环次数后重复测量，返回每次操作的耗时统计"""
+    case.run(1)  # 预热
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        case.run(loops)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1 << 24:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed * 1.2)))
+
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            case.run(loops)
+            samples.append((time.perf_counter() - start) / loops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    best = min(samples)
+    median = statistics.median(samples)
+    result = {
+        "best_us": round(best * 1e6, 3),
+        "median_us": round(median * 1e6, 3),
+        "rel_stdev": round(statistics.pstdev(samples) / median, 4) if median else 0.0,
+        "ops_per_s": round(1 / best, 1) if best else None,
+        "loops": loops,
+        "repeat": repeat
+    }
+    if case.nbytes:
+        result["mb_per_s"] = round(case.nbytes / best / 1e6, 1)
+    return result
+
+
+class FakeWebSocket:
+    """只计数的连接对象，process_message发出的帧直接丢弃"""
+
+    remote_address = ("127.0.0.1", 50000)
+    subprotocol = None
+    closed = False
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, frame):
+        self.sent += 1
+
+
+def make_audio_base64(seconds: float, sample_rate: int = 16000) -> str:
+    rng = np.random.default_rng(0)
+    samples = (rng.normal(0, 3000, int(seconds * sample_rate))).astype(np.int16)
+    return base64.b64encode(samples.tobytes()).decode("ascii")
+
+
+def voice_request(audio_seconds: float) -> Dict[str, Any]:
+    return {
+        "type": "voice_request",
+        "requestId": "req_1700000000000_1",
+        "timestamp": 1700000000000,
+        "data": {"audio_data": make_audio_base64(audio_seconds), "audio_format": "pcm", "sample_rate": 16000,
+                 "session_id": "bench", "progressive": False}
+    }
+
+
+def case_factories(loop: asyncio.AbstractEventLoop, workdir: str) -> Dict[str, Callable[[], BenchCase]]:
+    """各基准项的构造函数，只在运行该项时才准备数据，避免其他项的大块内存影响分配器状态"""
+    import message_codec
+    from sencevoice_websocket_server import SenceVoiceServer, ServerConfig, StageTimer
+    from llm_response import LLMResponseInterface
+
+    factories: Dict[str, Callable[[], BenchCase]] = {}
+    shared: Dict[str, Any] = {}
+
+    def sencevoice_server():
+        """模拟后端的SenceVoiceServer，不启动网络"""
+        if "server" not in shared:
+            server = SenceVoiceServer(ServerConfig(output_dir=os.path.join(workdir, "output"),
+                                                   sv_enroll_dir=os.path.join(workdir, "enroll"),
+                                                   enable_tracing=False, kws_keyword="ni hao xiao qian"))
+            websocket = FakeWebSocket()
+            server.client_states[server._get_client_id(websocket)] = {
+                "connected_at": time.time(), "request_count": 0, "last_activity": time.time(), "audio_codec": "pcm16"
+            }
+            shared["server"] = (server, websocket)
+        return shared["server"]
+
+    # voice_request编解码
+    for seconds in (1, 5):
+        def json_dumps(seconds=seconds):
+            message = voice_request(seconds)
+            size = len(json.dumps(message, ensure_ascii=False))
+            return sync_case(f"json.dumps voice_request {seconds}s", lambda: json.dumps(message, ensure_ascii=False), size)
+
+        def json_loads(seconds=seconds):
+            text = json.dumps(voice_request(seconds), ensure_ascii=False)
+            return sync_case(f"json.loads voice_request {seconds}s", lambda: json.loads(text), len(text))
+
+        factories[f"json.dumps voice_request {seconds}s"] = json_dumps
+        factories[f"json.loads voice_request {seconds}s"] = json_loads
+        if message_codec.msgpack is not None:
+            codec = message_codec.CODECS[message_codec.SUBPROTOCOL_MSGPACK]
+
+            def msgpack_encode(seconds=seconds):
+                message = voice_request(seconds)
+                return sync_case(f"msgpack encode voice_request {seconds}s", lambda: codec.encode(message),
+                                 len(codec.encode(message)))
+
+            def msgpack_decode(seconds=seconds):
+                packed = codec.encode(voice_request(seconds))
+                return sync_case(f"msgpack decode voice_request {seconds}s", lambda: codec.decode(packed), len(packed))
+
+            factories[f"msgpack encode voice_request {seconds}s"] = msgpack_encode
+            factories[f"msgpack decode voice_request {seconds}s"] = msgpack_decode
+
+    # 音频base64解码(audio_data为str)
+    for megabytes in (1, 2, 5, 10):
+        def b64decode(megabytes=megabytes):
+            encoded = base64.b64encode(os.urandom(megabytes * 1024 * 1024)).decode("ascii")
+            return sync_case(f"base64.b64decode {megabytes}MB", lambda: base64.b64decode(encoded),
+                             megabytes * 1024 * 1024)
+
+        factories[f"base64.b64decode {megabytes}MB"] = b64decode
+
+    # SenceVoiceServer消息分发
+    for message_type in ("ping", "status_request", "reset_kws"):
+        def dispatch(message_type=message_type):
+            server, websocket = sencevoice_server()
+            message = {"type": message_type, "requestId": "req_bench", "timestamp": 1700000000000, "data": {}}
+            return async_case(f"process_message {message_type}", loop,
+                              lambda: server.process_message(websocket, message))
+
+        factories[f"process_message {message_type}"] = dispatch
+
+    # LLM响应到达时完成等待中的Future
+    def resolve_future():
+        interface = LLMResponseInterface(os.path.join(HERE, "llm_config.yaml"))
+        response = {"type": "llm_response", "requestId": "req_bench", "success": True,
+                    "message": "你好！今天天气晴朗，适合出门散步。", "timestamp": 1700000000000,
+                    "usage": {"prompt_tokens": 6, "completion_tokens": 18, "total_tokens": 24}}
+
+        async def once():
+            future = loop.create_future()
+            interface.pending_requests["req_bench"] = future
+            await interface._handle_message(response)
+            future.result()
+
+        return async_case("LLMResponseInterface._handle_message llm_response", loop, once)
+
+    factories["LLMResponseInterface._handle_message llm_response"] = resolve_future
+
+    # 关键词检查
+    for label, text in (("hit", "Ni Hao Xiao Qian 今天天气怎么样"), ("miss", "今天天气怎么样，帮我查一下明天的日程安排")):
+        def keyword(label=label, text=text):
+            server, _ = sencevoice_server()
+            return sync_case(f"check_keyword_activation {label}", lambda: server.check_keyword_activation(text))
+
+        factories[f"check_keyword_activation {label}"] = keyword
+
+    # 响应构造：与handle_voice_request成功分支相同的结构，音频为1秒的TTS输出
+    def voice_response_builder():
+        audio_response = make_audio_base64(1)
+        timer = StageTimer()
+        for stage in ("decode", "vad", "asr", "llm", "tts"):
+            timer.mark(stage)
+
+        def build():
+            return {
+                "type": "voice_response",
+                "requestId": "req_bench",
+                "success": True,
+                "timestamp": int(time.time() * 1000),
+                "data": {
+                    "success": True,
+                    "asr_result": "你好小千，今天天气怎么样",
+                    "llm_response": "今天天气晴朗，适合出门散步。",
+                    "audio_response": audio_response,
+                    "audio_codec": "pcm16",
+                    "timings": timer.to_dict()
+                }
+            }
+        return build
+
+    factories["voice_response build"] = lambda: sync_case("voice_response build", voice_response_builder())
+
+    def build_and_encode():
+        build = voice_response_builder()
+        return sync_case("voice_response build+json", lambda: json.dumps(build(), ensure_ascii=False))
+
+    factories["voice_response build+json"] = build_and_encode
+
+    def send_error():
+        server, websocket = sencevoice_server()
+        return async_case("send_error", loop, lambda: server.send_error(websocket, "bench", "req_bench"))
+
+    factories["send_error"] = send_error
+    return factories
+
+
+def run_case(name: str, min_time: float, repeat: int) -> Dict[str, Any]:
+    """在当前进程中准备并测量一项"""
+    logging.disable(logging.CRITICAL)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            case = case_factories(loop, workdir)[name]()
+            return measure(case, min_time, repeat)
+    finally:
+        loop.close()
+
+
+def case_names() -> List[str]:
+    loop = asyncio.new_event_loop()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            return list(case_factories(loop, workdir))
+    finally:
+        loop.close()
+
+
+def environment() -> Dict[str, Any]:
+    import websockets
+    info = {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "websockets": websockets.__version__
+    }
+    try:
+        import msgpack
+        info["msgpack"] = ".".join(map(str, msgpack.version))
+    except ImportError:
+        info["msgpack"] = None
+    return info
+
+
+def merge_rounds(rounds: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """合并同一项在多个进程中的测量：取最好的一次，并记录各进程之间的离散度"""
+    best = min(rounds, key=lambda r: r["best_us"])
+    merged = dict(best)
+    bests = [r["best_us"] for r in rounds]
+    merged["median_us"] = round(statistics.median(r["median_us"] for r in rounds), 3)
+    merged["rel_stdev"] = round(max(max(r["rel_stdev"] for r in rounds),
+                                    statistics.pstdev(bests) / statistics.median(bests) if len(bests) > 1 else 0.0), 4)
+    merged["processes"] = len(rounds)
+    return merged
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """按best_us对比，变化超过阈值且超过两次测量各自的离散度时标出"""
+    lines = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old:
+            lines.append(f"{name:<52} {'':>10}   {result['best_us']:>10.2f}us  (新增)")
+            continue
+        change = (result["best_us"] - old["best_us"]) / old["best_us"]
+        noise = max(threshold, 2 * max(result["rel_stdev"], old.get("rel_stdev", 0)))
+        flag = "⚠️ 变慢" if change > noise else "✅ 变快" if change < -noise else ""
+        lines.append(f"{name:<52} {old['best_us']:>10.2f} → {result['best_us']:>10.2f}us {change:+7.1%} {flag}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="消息热路径微基准")
+    parser.add_argument("--filter", default=None, help="只运行名称包含该字符串的项")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每次测量的最短时间(秒)")
+    parser.add_argument("--repeat", type=int, default=7, help="每项重复测量次数")
+    parser.add_argument("--processes", type=int, default=3, help="每项在几个独立进程中测量，取其中最好的结果 (默认: 3)")
+    parser.add_argument("--in-process", action="store_true",
+                        help="所有项在同一进程中运行(更快，但前面的项会影响后面项的内存分配状态)")
+    parser.add_argument("--output", default=None, help="结果JSON文件")
+    parser.add_argument("--baseline", default=None, help="与之对比的基线结果JSON")
+    parser.add_argument("--threshold", type=float, default=0.1, help="对比时视为显著的相对变化 (默认: 0.1)")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    if args.worker:
+        # 子进程：只运行一项，结果以JSON写到标准输出
+        print(json.dumps(run_case(args.worker, args.min_time, args.repeat)))
+        return
+
+    names = [name for name in case_names() if not args.filter or args.filter in name]
+    rounds: Dict[str, List[Dict[str, Any]]] = {name: [] for name in names}
+    # 多轮交替运行各项，机器负载的短时波动分散到所有项上，而不是集中在某几项
+    for _ in range(1 if args.in_process else args.processes):
+        for name in names:
+            if args.in_process:
+                rounds[name].append(run_case(name, args.min_time, args.repeat))
+                continue
+            # 默认每项在新进程中运行，结果不受运行顺序影响；固定哈希种子使字典布局在各次运行间一致
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", name,
+                                     "--min-time", str(args.min_time), "--repeat", str(args.repeat)],
+                                    check=True, capture_output=True, text=True,
+                                    env={**os.environ, "PYTHONHASHSEED": "0"}).stdout
+            rounds[name].append(json.loads(output.strip().splitlines()[-1]))
+
+    results = {}
+    for name in names:
+        result = merge_rounds(rounds[name])
+        results[name] = result
+        rate = f"{result['mb_per_s']:>9.1f} MB/s" if "mb_per_s" in result else ""
+        print(f"{name:<52} {result['best_us']:>12.2f}us  ±{result['rel_stdev']:.1%}  {rate}", file=sys.stderr)
+
+    report = {"environment": environment(),
+              "settings": {"min_time": args.min_time, "repeat": args.repeat, "processes": args.processes,
+                           "in_process": args.in_process},
+              "results": results}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("environment") != report["environment"]:
+            print("⚠️ 基线的运行环境不同，对比仅供参考", file=sys.stderr)
+        print("\n与基线对比 (best):", file=sys.stderr)
+        for line in compare(results, baseline.get("results", {}), args.threshold):
+            print("  " + line, file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
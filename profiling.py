@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+按需性能剖析
+通过带令牌的 profile_request 管理消息在运行中的服务器上采集：
+- cpu: 后台线程按固定间隔对事件循环线程(可选所有线程)的调用栈采样N秒，返回出现最多的调用栈和函数
+- memory: 用tracemalloc对比N秒前后的快照，返回新增内存最多的分配位置
+
+未收到请求时不安装任何钩子，对请求处理没有额外开销；同一时间只运行一个剖析
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Frame = Tuple[str, str, int]
+
+
+class ProfileError(Exception):
+    """剖析请求被拒绝或失败，code为返回给客户端的错误代码"""
+
+    def __init__(self, message: str, code: str):
+        super().__init__(message)
+        self.code = code
+
+
+def _frame_label(frame: Frame) -> str:
+    filename, name, lineno = frame
+    return f"{name} ({filename}:{lineno})"
+
+
+class StackSampler:
+    """在独立线程中周期性读取sys._current_frames()，按调用栈计数"""
+
+    def __init__(self, thread_ids: Optional[List[int]] = None, interval: float = 0.005, max_depth: int = 64):
+        # None表示除采样线程外的所有线程
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    def _stack(self, frame) -> Tuple[Frame, ...]:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append((os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def run(self, seconds: float):
+        """采样seconds秒(阻塞，应在线程中调用)"""
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = self._stack(frame)
+                if self.thread_ids is None or len(self.thread_ids) > 1:
+                    stack = ((names.get(thread_id, str(thread_id)), "<thread>", 0),) + stack
+                self.stacks[stack] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def summary(self, top_n: int) -> Dict[str, Any]:
+        total = sum(self.stacks.values()) or 1
+        self_counts: Counter = Counter()
+        inclusive: Counter = Counter()
+        idle = 0
+        for stack, count in self.stacks.items():
+            if not stack:
+                continue
+            self_counts[stack[-1]] += count
+            for frame in set(stack):
+                inclusive[frame] += count
+            # 事件循环在select中等待即为空闲
+            if stack[-1][1] == "select" and stack[-1][0] == "selectors.py":
+                idle += count
+        return {
+            "samples": self.samples,
+            "stack_samples": total,
+            "idle_ratio": round(idle / total, 4),
+            "top_stacks": [
+                {"count": count, "ratio": round(count / total, 4), "stack": [_frame_label(f) for f in stack]}
+                for stack, count in self.stacks.most_common(top_n)
+            ],
+            "top_self": [
+                {"function": _frame_label(frame), "count": count, "ratio": round(count / total, 4)}
+                for frame, count in self_counts.most_common(top_n)
+            ],
+            "top_inclusive": [
+                {"function": _frame_label(frame), "count": count, "ratio": round(count / total, 4)}
+                for frame, count in inclusive.most_common(top_n)
+            ]
+        }
+
+    def folded(self) -> str:
+        """折叠栈格式(每行 "a;b;c 次数")，可直接用flamegraph.pl或speedscope查看"""
+        return "\n".join(
+            ";".join(f"{name} ({filename}:{lineno})" for filename, name, lineno in stack) + f" {count}"
+            for stack, count in self.stacks.most_common()
+        ) + "\n"
+
+
+class Profiler:
+    """
+    处理profile_request
+
+    data字段:
+        token: 管理令牌
+        mode: cpu | memory，默认cpu
+        seconds: 采集时长，默认5秒，不超过max_seconds
+        top_n: 返回的条目数，默认20
+        interval_ms: cpu模式的采样间隔，默认5ms
+        all_threads: cpu模式是否采样所有线程，默认只采样事件循环线程
+        frames: memory模式记录的调用栈深度，默认10
+        output: response | file | both，默认response；file时写入output_dir并只返回文件路径
+    """
+
+    def __init__(self, token: str, output_dir: str, max_seconds: float = 60.0):
+        self.token = token or ""
+        self.output_dir = output_dir
+        self.max_seconds = max_seconds
+        self.active: Optional[str] = None
+        self.stats = {"completed": 0, "rejected": 0}
+
+    def authorize(self, provided: Any):
+        if not self.token:
+            raise ProfileError("Profiling is disabled (no admin token configured)", "PROFILING_DISABLED")
+        if not isinstance(provided, str) or not hmac.compare_digest(provided.encode(), self.token.encode()):
+            raise ProfileError("Invalid admin token", "UNAUTHORIZED")
+
+    async def handle(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """校验令牌后运行一次剖析，返回响应的data字段"""
+        try:
+            self.authorize(request_data.get("token"))
+            if self.active is not None:
+                raise ProfileError(f"A {self.active} profile is already running", "PROFILE_BUSY")
+            mode = request_data.get("mode", "cpu")
+            if mode not in ("cpu", "memory"):
+                raise ProfileError(f"Unknown profile mode: {mode}", "INVALID_PROFILE_REQUEST")
+            output = request_data.get("output", "response")
+            if output not in ("response", "file", "both"):
+                raise ProfileError(f"Unknown output: {output}", "INVALID_PROFILE_REQUEST")
+            seconds = float(request_data.get("seconds", 5.0))
+            if not 0 < seconds <= self.max_seconds:
+                raise ProfileError(f"seconds must be in (0, {self.max_seconds:g}]", "INVALID_PROFILE_REQUEST")
+            top_n = max(1, int(request_data.get("top_n", 20)))
+        except ProfileError as e:
+            self.stats["rejected"] += 1
+            logger.warning(f"🔒 剖析请求被拒绝: {e} ({e.code})")
+            raise
+
+        self.active = mode
+        logger.info(f"🔬 开始{mode}剖析, 时长 {seconds:g}s")
+        try:
+            if mode == "cpu":
+                result, folded = await self._profile_cpu(seconds, top_n, request_data)
+            else:
+                result, folded = await self._profile_memory(seconds, top_n, request_data)
+        finally:
+            self.active = None
+        self.stats["completed"] += 1
+        logger.info(f"🔬 {mode}剖析完成")
+
+        data = {"mode": mode, "seconds": seconds, "pid": os.getpid()}
+        if output in ("file", "both"):
+            data["files"] = await asyncio.to_thread(self._write, mode, result, folded)
+        if output in ("response", "both"):
+            data.update(result)
+        return data
+
+    async def _profile_cpu(self, seconds: float, top_n: int, request_data: Dict[str, Any]):
+        # 在事件循环线程中调用，记录其线程ID作为采样目标
+        thread_ids = None if request_data.get("all_threads") else [threading.get_ident()]
+        interval = max(1.0, float(request_data.get("interval_ms", 5.0))) / 1000
+        sampler = StackSampler(thread_ids, interval)
+        await asyncio.to_thread(sampler.run, seconds)
+        return sampler.summary(top_n), sampler.folded()
+
+    async def _profile_memory(self, seconds: float, top_n: int, request_data: Dict[str, Any]):
+        frames = max(1, int(request_data.get("frames", 10)))
+        # 已被其他代码开启时保留其状态，结束后不关闭
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(frames)
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            traced_current, traced_peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+        differences = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "traceback")
+        differences.sort(key=lambda stat: stat.size_diff, reverse=True)
+        top = [
+            {
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "count_diff": stat.count_diff,
+                "size_kb": round(stat.size / 1024, 1),
+                "traceback": [f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in stat.traceback]
+            }
+            for stat in differences[:top_n]
+        ]
+        result = {
+            "traced_current_kb": round(traced_current / 1024, 1),
+            "traced_peak_kb": round(traced_peak / 1024, 1),
+            "total_diff_kb": round(sum(stat.size_diff for stat in differences) / 1024, 1),
+            "top_allocations": top
+        }
+        return result, None
+
+    def _write(self, mode: str, result: Dict[str, Any], folded: Optional[str]) -> Dict[str, str]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        now = time.time()
+        stamp = f"{time.strftime('%Y%m%d_%H%M%S', time.localtime(now))}_{int(now * 1000) % 1000:03d}"
+        base = os.path.join(self.output_dir, f"profile_{mode}_{stamp}_{os.getpid()}")
+        files = {"json": base + ".json"}
+        with open(files["json"], "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        if folded is not None:
+            files["folded"] = base + ".folded"
+            with open(files["folded"], "w", encoding="utf-8") as f:
+                f.write(folded)
+        return files
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+请求追踪
+语音请求在SenceVoice服务器上创建Trace，调用LLM时把追踪上下文放进llm_request消息，
+LLM服务器返回自身的阶段耗时，合并后随响应返回，并按采样写入本地JSONL文件供离线分析
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+class Trace:
+    """一次请求的追踪，span的start_ms/duration_ms相对于追踪开始时刻"""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, start: Optional[float] = None):
+        self.name = name
+        self.trace_id = trace_id or new_trace_id()
+        self.started_at = time.time()
+        # 可与已有计时器共用起点(perf_counter时刻)
+        self.start = start if start is not None else time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.attributes: Dict[str, Any] = {}
+
+    def offset_ms(self, when: Optional[float] = None) -> float:
+        return round(((when if when is not None else time.perf_counter()) - self.start) * 1000, 2)
+
+    def add_span(self, name: str, start: float, end: float, parent: Optional[str] = None, **attributes):
+        """按perf_counter时刻添加一个span"""
+        span = {"name": name, "start_ms": self.offset_ms(start), "duration_ms": round((end - start) * 1000, 2)}
+        if parent:
+            span["parent"] = parent
+        if attributes:
+            span["attributes"] = attributes
+        self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[str] = None, **attributes):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.perf_counter(), parent, **attributes)
+
+    def add_remote_spans(self, spans: List[Dict[str, Any]], parent: str, offset_ms: float):
+        """合并下游返回的span，下游的时间以其收到请求为起点，需加上offset_ms"""
+        for span in spans or []:
+            merged = dict(span)
+            merged["start_ms"] = round(span.get("start_ms", 0.0) + offset_ms, 2)
+            merged.setdefault("parent", parent)
+            self.spans.append(merged)
+
+    def context(self, parent: Optional[str] = None) -> Dict[str, Any]:
+        """传给下游的追踪上下文"""
+        return {"trace_id": self.trace_id, "parent": parent}
+
+    def duration_ms(self) -> float:
+        return self.offset_ms()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms(),
+            "spans": self.spans
+        }
+        if self.attributes:
+            data["attributes"] = self.attributes
+        return data
+
+
+class TraceSink:
+    """
+    按采样把完成的追踪追加写入JSONL文件
+
+    出错或耗时超过slow_ms的请求总是保留，其余按sample_rate随机保留；
+    写文件在后台线程中批量进行，缓冲区满时丢弃新的追踪
+    """
+
+    def __init__(self, path: str, sample_rate: float = 0.1, slow_ms: float = 2000.0, max_buffer: int = 1000):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.max_buffer = max_buffer
+        self._buffer: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats = {"completed": 0, "written": 0, "dropped": 0}
+
+    def should_keep(self, trace: Trace, error: bool = False) -> bool:
+        return error or trace.duration_ms() >= self.slow_ms or random.random() < self.sample_rate
+
+    def submit(self, trace: Trace, error: bool = False) -> bool:
+        """提交一个已完成的追踪，返回是否被采样"""
+        self.stats["completed"] += 1
+        if not self.should_keep(trace, error):
+            return False
+        if len(self._buffer) >= self.max_buffer:
+            self.stats["dropped"] += 1
+            return False
+
+        record = trace.to_dict()
+        record["error"] = error
+        self._buffer.append(json.dumps(record, ensure_ascii=False))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        return True
+
+    async def _flush(self):
+        while self._buffer:
+            lines, self._buffer = self._buffer, []
+            try:
+                await asyncio.to_thread(self._write, lines)
+                self.stats["written"] += len(lines)
+            except OSError as e:
+                self.stats["dropped"] += len(lines)
+                logger.error(f"写入追踪文件失败: {e}")
+
+    def _write(self, lines: List[str]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def close(self):
+        """等待缓冲中的追踪写完"""
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._buffer:
+            await self._flush()
@@ -3,18 +3,15 @@
 启动LLM WebSocket服务器的便捷脚本
 """
 
+import subprocess
 import sys
 import os
 from pathlib import Path
 
-# 添加当前目录到路径
-current_dir = Path(__file__).parent
-sys.path.insert(0, str(current_dir))
-
-from websocket_llm_adapter import WebSocketLLMServer
-import asyncio
 import logging
 
+current_dir = Path(__file__).parent
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -28,31 +25,41 @@ def main():
     host = "0.0.0.0"  # 改为0.0.0.0以允许远程连接
     port = 8000
     model_path = "Qwen/Qwen2.5-1.5B-Instruct"  # 使用较小的模型以提高响应速度
+    workers = 1  # 大于1时由监督进程启动多个工作进程共用端口，CPU推理时共享fork前加载的权重
     
-    # 如果有命令行参数，使用它们
-    if len(sys.argv) > 1:
-        host = sys.argv[1]
-    if len(sys.argv) > 2:
-        port = int(sys.argv[2])
-    if len(sys.argv) > 3:
-        model_path = sys.argv[3]
+    # 开头的位置参数依次为主机、端口、模型和工作进程数，其余参数(如 --metrics-port 9200)原样传给服务器
+    args = sys.argv[1:]
+    split = next((i for i, arg in enumerate(args) if arg.startswith("-")), len(args))
+    positional, extra = args[:split], args[split:]
+    if len(positional) > 0:
+        host = positional[0]
+    if len(positional) > 1:
+        port = int(positional[1])
+    if len(positional) > 2:
+        model_path = positional[2]
+    if len(positional) > 3:
+        workers = int(positional[3])
     
     logger.info(f"Starting LLM WebSocket server...")
     logger.info(f"Host: {host}")
     logger.info(f"Port: {port}")
     logger.info(f"Model: {model_path}")
+    logger.info(f"Workers: {workers}")
     
-    # 创建服务器
-    server = WebSocketLLMServer(host, port)
-    server.llm_processor.model_path = model_path
-    
+    # 启动服务器；多工作进程的监督、SIGHUP滚动重启和优雅退出都由服务器处理
+    command = [sys.executable, str(current_dir / "websocket_llm_adapter.py"), "--host", host, "--port", str(port),
+               "--model", model_path, "--workers", str(workers), *extra]
+    process = subprocess.Popen(command)
     try:
-        asyncio.run(server.start_server())
+        returncode = process.wait()
     except KeyboardInterrupt:
+        # 服务器同样收到了Ctrl+C，等它处理完在途请求后退出
+        process.wait()
         logger.info("Server stopped by user")
-    except Exception as e:
-        logger.error(f"Server error: {e}")
+        return
+    if returncode != 0:
+        logger.error(f"Server exited with code {returncode}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
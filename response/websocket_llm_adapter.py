@@ -5,30 +5,106 @@ WebSocket LLM Adapter
 """
 
 import asyncio
-import json
+import gc
 import os
+import sys
 import time
 import torch
 import websockets
 import logging
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import threading
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
 from pathlib import Path
 
+# 消息编码、指标和多工作进程监督与仓库根目录下的服务器共用
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from message_codec import MessageDecodeError, StaticFrame, codec_for, supported_subprotocols
+from server_metrics import ServerMetrics, start_metrics_server
+from worker_supervisor import (ForkingWorkerSupervisor, WorkerSupervisor, fetch_metrics, run_supervisor,
+                               serve_until_stopped)
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class CancelCriteria(StoppingCriteria):
+    """请求被取消时在下一个token处停止生成"""
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.cancel_event.is_set()
+
+class SpanRecorder:
+    """记录本服务器上的阶段耗时，时间相对于收到请求的时刻，随响应返回给调用方合并到其追踪中"""
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id
+        self.origin = time.perf_counter()
+        self.spans = []
+    
+    def add_span(self, name, start, end, parent=None):
+        span = {"name": name, "start_ms": round((start - self.origin) * 1000, 2),
+                "duration_ms": round((end - start) * 1000, 2)}
+        if parent:
+            span["parent"] = parent
+        self.spans.append(span)
+
+def memory_usage():
+    """
+    当前进程的内存占用(MB)。rss为驻留内存(含与其他进程共享的页)，pss为按共享进程数分摊后的占用，
+    各工作进程的pss之和才是实际占用的物理内存；非Linux系统只能给出峰值RSS
+    """
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Shared_Clean": "shared_mb", "Shared_Dirty": "shared_mb",
+              "Private_Clean": "private_mb", "Private_Dirty": "private_mb"}
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup", encoding="ascii") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    key = fields[name]
+                    usage[key] = usage.get(key, 0.0) + int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        try:
+            import resource
+        except ImportError:
+            return {}
+        # Linux以KB为单位，macOS以字节为单位
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"max_rss_mb": round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)}
+    return {key: round(value, 1) for key, value in usage.items()}
+
+def format_memory(usage):
+    if "pss_mb" not in usage:
+        return f"peak RSS {usage.get('max_rss_mb', '?')}MB"
+    return (f"RSS {usage['rss_mb']:.0f}MB (shared {usage.get('shared_mb', 0):.0f}MB, "
+            f"private {usage.get('private_mb', 0):.0f}MB), PSS {usage['pss_mb']:.0f}MB")
+
 class LLMProcessor:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, max_concurrent_generations=1, max_batch_size=8):
         self.model = None
         self.tokenizer = None
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model_path = model_path or "Qwen/Qwen2.5-1.5B-Instruct"
         self.max_tokens = 512
+        # 同时在后台线程中生成的请求数，避免显存被并发请求撑爆
+        self.generation_slots = asyncio.Semaphore(max_concurrent_generations)
+        # 批量请求中一次generate处理的最大提示数
+        self.max_batch_size = max_batch_size
+        # 模型加载耗时；preloaded表示在fork前由父进程加载，与其他工作进程共享权重
+        self.load_seconds = None
+        self.preloaded = False
         
     async def initialize(self):
-        """初始化模型"""
+        """初始化模型，已在fork前加载时直接使用"""
+        if self.model is not None:
+            return True
+        return self.load()
+    
+    def load(self):
+        """同步加载模型和分词器"""
         try:
+            start = time.perf_counter()
             logger.info(f"Loading model from {self.model_path}")
             self.model = AutoModelForCausalLM.from_pretrained(
                 self.model_path,
@@ -40,65 +116,114 @@ class LLMProcessor:
                 self.model_path,
                 trust_remote_code=True
             )
-            logger.info("Model loaded successfully")
+            # 批量生成时左侧填充，使各提示的生成部分对齐
+            self.tokenizer.padding_side = "left"
+            self.load_seconds = time.perf_counter() - start
+            logger.info(f"Model loaded successfully in {self.load_seconds:.1f}s")
             return True
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
             return False
     
-    async def generate_response(self, prompt, system_prompt=None, conversation_history=None):
-        """生成响应"""
-        try:
-            # 构建消息
-            messages = []
-            
-            # 添加系统提示
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            else:
-                messages.append({"role": "system", "content": "你叫千问，是一个18岁的女大学生，性格活泼开朗，说话俏皮"})
-            
-            # 添加历史对话
-            if conversation_history:
-                messages.extend(conversation_history)
-            
-            # 添加当前提示，并要求简短回答
-            user_prompt = prompt + "，回答简短一些，保持50字以内！"
-            messages.append({"role": "user", "content": user_prompt})
-            
-            # 应用聊天模板
-            text = self.tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
+    def prepare_for_fork(self):
+        """
+        fork前调用：权重只读且之后不再修改，子进程与父进程共享这些物理页(写时复制)。
+        冻结GC，避免子进程中的垃圾回收改写父进程对象的头部，导致共享页被逐页复制
+        """
+        self.model.eval()
+        self.preloaded = True
+        gc.collect()
+        gc.freeze()
+    
+    async def generate_response(self, prompt, system_prompt=None, conversation_history=None, trace=None):
+        """生成响应，模型推理在后台线程中执行，不阻塞事件循环；传入trace时记录等待名额和生成各阶段耗时"""
+        return await self._run_generation(self._generate, prompt, system_prompt, conversation_history, trace=trace)
+    
+    async def generate_batch(self, items):
+        """批量生成，items为包含prompt/system_prompt/conversation_history的字典列表，返回对应的结果列表"""
+        return await self._run_generation(self._generate_batch, items)
+    
+    async def _run_generation(self, func, *args, trace=None):
+        queued = time.perf_counter()
+        async with self.generation_slots:
+            started = time.perf_counter()
+            cancel_event = threading.Event()
+            future = asyncio.ensure_future(asyncio.to_thread(func, *args, cancel_event=cancel_event))
+            try:
+                result = await asyncio.shield(future)
+                if trace is not None:
+                    trace.add_span("llm_server.slot_wait", queued, started)
+                    trace.add_span("llm_server.generate", started, time.perf_counter())
+                    if isinstance(result, dict):
+                        for name, (start, end) in result.pop("timings", {}).items():
+                            trace.add_span(f"llm_server.{name}", start, end, parent="llm_server.generate")
+                return result
+            except asyncio.CancelledError:
+                # 请求被取消: 通知生成线程停止，等线程退出后再释放名额
+                cancel_event.set()
+                await asyncio.wait([future])
+                raise
+    
+    def _build_text(self, prompt, system_prompt=None, conversation_history=None):
+        """按聊天模板构建模型输入文本"""
+        # 构建消息
+        messages = []
+        
+        # 添加系统提示
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        else:
+            messages.append({"role": "system", "content": "你叫千问，是一个18岁的女大学生，性格活泼开朗，说话俏皮"})
+        
+        # 添加历史对话
+        if conversation_history:
+            messages.extend(conversation_history)
+        
+        # 添加当前提示，并要求简短回答
+        user_prompt = prompt + "，回答简短一些，保持50字以内！"
+        messages.append({"role": "user", "content": user_prompt})
+        
+        # 应用聊天模板
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+    
+    def _generate_texts(self, texts, cancel_event=None):
+        """对一组输入文本执行一次generate，返回各自的生成结果"""
+        # 编码输入
+        model_inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.model.device)
+        
+        # 生成响应
+        with torch.no_grad():
+            generated_ids = self.model.generate(
+                **model_inputs,
+                max_new_tokens=self.max_tokens,
+                do_sample=True,
+                temperature=0.7,
+                top_p=0.9,
+                pad_token_id=self.tokenizer.eos_token_id,
+                stopping_criteria=StoppingCriteriaList([CancelCriteria(cancel_event or threading.Event())])
             )
-            
-            # 编码输入
-            model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
-            
-            # 生成响应
-            with torch.no_grad():
-                generated_ids = self.model.generate(
-                    **model_inputs,
-                    max_new_tokens=self.max_tokens,
-                    do_sample=True,
-                    temperature=0.7,
-                    top_p=0.9,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
-            
-            # 解码响应
-            generated_ids = [
-                output_ids[len(input_ids):] 
-                for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-            ]
-            
-            response = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        
+        # 解码响应(左侧填充后所有输入长度相同)
+        generated_ids = generated_ids[:, model_inputs.input_ids.shape[1]:]
+        return [text.strip() for text in self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)]
+    
+    def _generate(self, prompt, system_prompt=None, conversation_history=None, cancel_event=None):
+        """同步执行一次生成"""
+        try:
+            start = time.perf_counter()
+            text = self._build_text(prompt, system_prompt, conversation_history)
+            templated = time.perf_counter()
+            response = self._generate_texts([text], cancel_event)[0]
             
             return {
                 "success": True,
-                "message": response.strip(),
-                "model": self.model_path
+                "message": response,
+                "model": self.model_path,
+                "timings": {"template": (start, templated), "model": (templated, time.perf_counter())}
             }
             
         except Exception as e:
@@ -107,13 +232,62 @@ class LLMProcessor:
                 "success": False,
                 "error": str(e)
             }
+    
+    def _generate_batch(self, items, cancel_event=None):
+        """同步执行一次批量生成，单个提示的错误只影响该条结果"""
+        results = [None] * len(items)
+        texts, indices = [], []
+        for i, item in enumerate(items):
+            if not item.get("prompt"):
+                results[i] = {"success": False, "error": "Empty prompt"}
+                continue
+            try:
+                texts.append(self._build_text(item["prompt"], item.get("system_prompt"),
+                                              item.get("conversation_history")))
+                indices.append(i)
+            except Exception as e:
+                results[i] = {"success": False, "error": str(e)}
+        
+        if texts:
+            try:
+                for i, response in zip(indices, self._generate_texts(texts, cancel_event)):
+                    results[i] = {"success": True, "message": response, "model": self.model_path}
+            except Exception as e:
+                logger.error(f"Batch generation failed: {e}")
+                for i in indices:
+                    results[i] = {"success": False, "error": str(e)}
+        return results
 
 class WebSocketLLMServer:
-    def __init__(self, host="localhost", port=8000):
+    # 内容固定的pong预先编码，每次只拼接时间戳
+    PONG_FRAME = StaticFrame({"type": "pong"})
+    
+    def __init__(self, host="localhost", port=8000, max_inflight=4, reuse_port=False,
+                 metrics_port=None, metrics_host=None, drain_timeout=30.0):
         self.host = host
         self.port = port
         self.llm_processor = LLMProcessor()
         self.clients = set()
+        # 单个连接同时处理的llm_request数，ping在读循环中直接响应
+        self.max_inflight = max_inflight
+        # 多工作进程时通过SO_REUSEPORT共用端口
+        self.reuse_port = reuse_port
+        # 停止时等待在途请求完成的最长时间(秒)
+        self.drain_timeout = drain_timeout
+        # 所有连接上正在处理和排队的请求
+        self.active_tasks = set()
+        
+        # 运行指标，指定metrics_port时在该端口提供 /metrics；工作进程的指标由监督进程汇总
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host or host
+        self.metrics = ServerMetrics("llm_server")
+        self.metrics.gauge("connections", "当前连接数", lambda: len(self.clients))
+        self.metrics.gauge("inflight_requests", "正在处理和排队的请求数", lambda: len(self.active_tasks))
+        # 共享权重时各工作进程的PSS之和为实际占用的物理内存
+        self.metrics.gauge("memory_rss_megabytes", "驻留内存(MB)，含与其他进程共享的页",
+                           lambda: memory_usage().get("rss_mb", 0.0))
+        self.metrics.gauge("memory_pss_megabytes", "按共享进程数分摊后的内存(MB)",
+                           lambda: memory_usage().get("pss_mb", 0.0))
         
     async def register_client(self, websocket):
         """注册客户端"""
@@ -131,39 +305,74 @@ class WebSocketLLMServer:
         if path:
             logger.info(f"Client connected to path: {path}")
         await self.register_client(websocket)
+        tasks = {}
+        slots = asyncio.Semaphore(self.max_inflight)
+        codec = codec_for(websocket)
         try:
             async for message in websocket:
-                await self.process_message(websocket, message)
+                try:
+                    data = codec.decode(message)
+                except MessageDecodeError as e:
+                    await self.send_error(websocket, str(e))
+                    continue
+                
+                request_id = data.get("requestId")
+                self.metrics.inc("messages_total", 1, "收到的消息数", type=str(data.get("type")))
+                if data.get("type") == "ping":
+                    await self.process_message(websocket, data)
+                elif data.get("type") == "cancel":
+                    # 客户端放弃的请求: 排队中的直接取消，生成中的在下一个token处停止
+                    task = tasks.get(request_id)
+                    if task is not None:
+                        task.cancel()
+                        logger.info(f"Cancelled request {request_id}")
+                elif request_id is not None and request_id in tasks:
+                    # 同一requestId的请求仍未完成：新请求会覆盖旧任务的登记，旧任务就无法再被取消
+                    await self.send_error(websocket, f"Duplicate requestId {request_id} is still in flight", request_id)
+                elif len(tasks) >= self.max_inflight * 4:
+                    await self.send_error(websocket, "Too many in-flight requests", request_id)
+                else:
+                    task = asyncio.create_task(self._process_in_slot(websocket, data, slots))
+                    key = request_id if request_id is not None else id(task)
+                    tasks[key] = task
+                    self.active_tasks.add(task)
+                    task.add_done_callback(self.active_tasks.discard)
+                    task.add_done_callback(lambda _, key=key: tasks.pop(key, None))
         except websockets.exceptions.ConnectionClosed:
             logger.info("Client disconnected")
         except Exception as e:
             logger.error(f"Error in handle_client: {e}")
         finally:
+            for task in list(tasks.values()):
+                task.cancel()
             await self.unregister_client(websocket)
     
+    async def _process_in_slot(self, websocket, data, slots):
+        """占用一个并发名额处理消息"""
+        async with slots:
+            await self.process_message(websocket, data)
+    
     def create_handler(self):
         """创建兼容的处理器函数"""
         async def handler(websocket, path=None):
             return await self.handle_client(websocket, path)
         return handler
     
-    async def process_message(self, websocket, message):
-        """处理接收到的消息"""
+    async def process_message(self, websocket, data):
+        """处理已解析的消息"""
         try:
-            data = json.loads(message)
-            
             if data.get("type") == "llm_request":
                 await self.handle_llm_request(websocket, data)
+            elif data.get("type") == "llm_batch_request":
+                await self.handle_llm_batch_request(websocket, data)
             elif data.get("type") == "ping":
                 await self.handle_ping(websocket, data)
             else:
                 await self.send_error(websocket, "Unknown message type", data.get("requestId"))
                 
-        except json.JSONDecodeError:
-            await self.send_error(websocket, "Invalid JSON format")
         except Exception as e:
             logger.error(f"Error processing message: {e}")
-            await self.send_error(websocket, str(e))
+            await self.send_error(websocket, str(e), data.get("requestId"))
     
     async def handle_llm_request(self, websocket, data):
         """处理LLM请求"""
@@ -179,10 +388,16 @@ class WebSocketLLMServer:
                 await self.send_error(websocket, "Empty prompt", request_id)
                 return
             
+            # 请求携带追踪上下文时记录本服务器上的阶段耗时
+            trace_context = data.get("trace")
+            trace = SpanRecorder(trace_context.get("trace_id")) if trace_context else None
+            
             # 生成响应
+            start = time.perf_counter()
             result = await self.llm_processor.generate_response(
-                prompt, system_prompt, conversation_history
+                prompt, system_prompt, conversation_history, trace=trace
             )
+            self.metrics.observe("stage_duration_seconds", time.perf_counter() - start, "请求各阶段耗时", stage="llm")
             
             # 发送响应
             response = {
@@ -196,27 +411,65 @@ class WebSocketLLMServer:
                 response["message"] = result["message"]
             else:
                 response["error"] = result["error"]
+            if trace is not None:
+                response["trace"] = {"trace_id": trace.trace_id, "spans": trace.spans}
             
-            await websocket.send(json.dumps(response, ensure_ascii=False))
+            await websocket.send(codec_for(websocket).encode(response))
             
         except Exception as e:
             logger.error(f"Error handling LLM request: {e}")
             await self.send_error(websocket, str(e), data.get("requestId"))
     
+    async def handle_llm_batch_request(self, websocket, data):
+        """处理批量LLM请求，每生成完一组就发送一帧llm_batch_response"""
+        request_id = data.get("requestId")
+        items = data.get("data", {}).get("items", [])
+        if not items:
+            await self.send_error(websocket, "Empty batch", request_id)
+            return
+        
+        batch_size = max(1, self.llm_processor.max_batch_size)
+        completed = 0
+        for start in range(0, len(items), batch_size):
+            chunk = items[start:start + batch_size]
+            results = await self.llm_processor.generate_batch(chunk)
+            completed += len(chunk)
+            
+            frame_results = []
+            for offset, result in enumerate(results):
+                item = {"index": start + offset, "success": result["success"]}
+                if result["success"]:
+                    item["message"] = result["message"]
+                else:
+                    item["error"] = result["error"]
+                frame_results.append(item)
+            
+            await websocket.send(codec_for(websocket).encode({
+                "type": "llm_batch_response",
+                "requestId": request_id,
+                "results": frame_results,
+                "completed": completed,
+                "total": len(items),
+                "done": completed >= len(items),
+                "timestamp": int(time.time() * 1000)
+            }))
+    
     async def handle_ping(self, websocket, data):
         """处理ping消息"""
         try:
-            pong_response = {
-                "type": "pong",
-                "timestamp": int(time.time() * 1000)  # 统一使用JavaScript格式的时间戳(毫秒)
-            }
-            await websocket.send(json.dumps(pong_response, ensure_ascii=False))
+            # 时间戳统一使用JavaScript格式(毫秒)
+            await websocket.send(self.PONG_FRAME.frame(codec_for(websocket)))
             logger.debug("Sent pong response")
         except Exception as e:
             logger.error(f"Error handling ping: {e}")
     
+    def pending_requests(self):
+        """正在处理和排队的请求数，优雅退出时等待其归零"""
+        return len(self.active_tasks)
+    
     async def send_error(self, websocket, error_message, request_id=None):
         """发送错误响应"""
+        self.metrics.inc("errors_total", 1, "发送的错误响应数")
         if request_id:
             # 如果有请求ID，发送LLM响应格式的错误
             response = {
@@ -234,15 +487,18 @@ class WebSocketLLMServer:
                 "timestamp": int(time.time() * 1000)
             }
             
-        await websocket.send(json.dumps(response, ensure_ascii=False))
+        await websocket.send(codec_for(websocket).encode(response))
     
     async def start_server(self):
         """启动WebSocket服务器"""
+        started = time.perf_counter()
         # 首先初始化LLM处理器
         logger.info("Initializing LLM processor...")
         if not await self.llm_processor.initialize():
             logger.error("Failed to initialize LLM processor")
             return
+        self.metrics.gauge("model_loaded", "模型是否就绪", lambda: 1 if self.llm_processor.model is not None else 0,
+                           model=self.llm_processor.model_path)
         
         # 启动WebSocket服务器
         logger.info(f"Starting WebSocket LLM server on {self.host}:{self.port}")
@@ -254,15 +510,76 @@ class WebSocketLLMServer:
                 host=self.host,
                 port=self.port,
                 ping_interval=20,
-                ping_timeout=10
+                ping_timeout=10,
+                subprotocols=supported_subprotocols(),
+                reuse_port=self.reuse_port
             )
+            if self.metrics_port:
+                await start_metrics_server(self.metrics, self.metrics_host, self.metrics_port)
             logger.info("Server started successfully")
         except Exception as e:
             logger.error(f"Failed to start server: {e}")
             raise
         
-        # 保持服务器运行
-        await server.wait_closed()
+        # 启动耗时与内存占用，多工作进程时监督进程在全部就绪后汇总PSS
+        logger.info(f"Ready in {time.perf_counter() - started:.2f}s "
+                    f"(model load {self.llm_processor.load_seconds or 0.0:.2f}s"
+                    f"{', shared from supervisor' if self.llm_processor.preloaded else ''}), "
+                    f"{format_memory(memory_usage())}")
+        
+        # 运行到收到停止信号，停止监听后等正在生成的请求完成再关闭连接
+        await serve_until_stopped(server, self.pending_requests, self.drain_timeout)
+
+def _serve_forked(server, threads):
+    """返回fork出的工作进程的入口：限制推理线程数，在内部端口提供指标，运行到收到停止信号"""
+    def target(index, metrics_port):
+        torch.set_num_threads(threads)
+        server.metrics_port = metrics_port
+        server.metrics_host = "127.0.0.1"
+        server.metrics.started_at = time.time()
+        asyncio.run(server.start_server())
+    return target
+
+async def log_memory_summary(supervisor):
+    """全部工作进程就绪后汇总内存：各进程PSS之和为实际占用，RSS之和会重复计算共享的权重"""
+    texts = await asyncio.gather(*(fetch_metrics(w.metrics_port) for w in list(supervisor.workers.values())))
+    totals = {"llm_server_memory_pss_megabytes": 0.0, "llm_server_memory_rss_megabytes": 0.0}
+    for text in filter(None, texts):
+        for line in text.splitlines():
+            name, _, value = line.partition(" ")
+            if name in totals:
+                totals[name] += float(value)
+    parent_pss = memory_usage().get("pss_mb", 0.0)
+    logger.info(f"{supervisor.worker_count} workers ready, total PSS "
+                f"{totals['llm_server_memory_pss_megabytes'] + parent_pss:.0f}MB including supervisor "
+                f"(summed worker RSS {totals['llm_server_memory_rss_megabytes']:.0f}MB)")
+
+def run_workers(server, workers, share_weights=True, threads_per_worker=None, metrics_port=None, command=None):
+    """
+    以多个工作进程运行服务器，通过SO_REUSEPORT共用端口，由WorkerSupervisor负责退避重启、SIGHUP滚动重启和指标汇总。
+    share_weights且模型在CPU上时，监督进程在fork前加载一次模型，各工作进程共享只读的权重页，
+    每个副本只增加激活值和KV缓存的内存；否则按command重新执行，每个工作进程各自加载
+    """
+    # 各工作进程平分CPU核，避免推理线程互相争抢
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    options = dict(namespace="llm_server", metrics_host=server.host, metrics_port=metrics_port,
+                   drain_timeout=server.drain_timeout, on_all_ready=log_memory_summary)
+    processor = server.llm_processor
+    if share_weights and processor.device.type == "cuda":
+        logger.warning("Model runs on CUDA: weights live in GPU memory, each worker loads its own copy")
+        share_weights = False
+    if not share_weights:
+        supervisor = WorkerSupervisor("WebSocket LLM Adapter", command, workers, **options)
+    else:
+        if not processor.load():
+            logger.error("Failed to initialize LLM processor")
+            return
+        processor.prepare_for_fork()
+        logger.info(f"Weights loaded once before fork, supervisor {format_memory(memory_usage())}")
+        supervisor = ForkingWorkerSupervisor("WebSocket LLM Adapter", _serve_forked(server, threads), workers, **options)
+    supervisor.metrics.gauge("memory_pss_megabytes", "监督进程的PSS内存(MB)",
+                             lambda: memory_usage().get("pss_mb", 0.0))
+    run_supervisor(supervisor)
 
 def main():
     """主函数"""
@@ -272,15 +589,43 @@ def main():
     parser.add_argument("--host", default="localhost", help="Server host")
     parser.add_argument("--port", type=int, default=8000, help="Server port")
     parser.add_argument("--model", help="Model path or name")
+    parser.add_argument("--max-inflight", type=int, default=4, help="Max concurrent requests per connection")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Max prompts per batched generation")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port via SO_REUSEPORT")
+    parser.add_argument("--no-share-weights", action="store_true",
+                        help="Let each worker load its own model copy instead of sharing weights loaded before fork")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Torch threads per worker (default: CPU count / workers)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Prometheus metrics port, aggregated across workers (disabled by default)")
+    parser.add_argument("--drain-timeout", type=float, default=30.0,
+                        help="Seconds to wait for in-flight generations on stop or rolling restart (SIGHUP)")
+    # 以下由监督进程传给工作进程
+    parser.add_argument("--worker-index", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-metrics-port", type=int, default=None, help=argparse.SUPPRESS)
     
     args = parser.parse_args()
+    worker = args.worker_index is not None
     
-    # 创建服务器实例
-    server = WebSocketLLMServer(args.host, args.port)
+    # 创建服务器实例，工作进程的指标只在本机内部端口提供，由监督进程汇总
+    server = WebSocketLLMServer(args.host, args.port, args.max_inflight,
+                                reuse_port=args.workers > 1,
+                                metrics_port=args.worker_metrics_port if worker else args.metrics_port,
+                                metrics_host="127.0.0.1" if worker else None,
+                                drain_timeout=args.drain_timeout)
+    server.llm_processor.max_batch_size = args.max_batch_size
     if args.model:
         server.llm_processor.model_path = args.model
+    if worker:
+        torch.set_num_threads(args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers))
     
     # 运行服务器
+    if args.workers > 1 and not worker:
+        run_workers(server, args.workers, not args.no_share_weights, args.threads_per_worker, args.metrics_port,
+                    lambda index, metrics_port: [sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                                                 "--worker-index", str(index),
+                                                 "--worker-metrics-port", str(metrics_port)])
+        return
     try:
         asyncio.run(server.start_server())
     except KeyboardInterrupt:
@@ -8,27 +8,38 @@ SenceVoice WebSocket 服务器
 
 import asyncio
 import websockets
-import json
 import time
 import logging
 import base64
 import os
 import uuid
-from typing import Dict, Any, Optional, Set
+import wave
+from typing import Dict, Any, Optional, Set, Tuple
 from dataclasses import dataclass
 import argparse
+import sys
 from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+import numpy as np
 import yaml
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('sencevoice_server.log', encoding='utf-8')
-    ]
-)
+from audio_codec import (CODEC_PCM16, SUPPORTED_CODECS, AudioCodecError, CodecStats,
+                         decode_audio as decode_codec_audio, encode_audio, negotiate_codec)
+from audio_ingest import AudioFormatError, CompressedAudioError, IngestResult, ingest_audio
+from audio_vad import VADConfig, VADResult, detect_speech, trim_silence
+from audio_features import FbankConfig, UtteranceFeatures
+from asr_engine import ASREngineConfig, OnnxASREngine
+from message_dispatch import ConnectionDispatcher
+from llm_pool import LLMClientPool, LLMPoolConfig
+from server_metrics import ServerMetrics, metered_protocol, start_metrics_server
+from request_tracing import Trace, TraceSink
+from message_codec import MessageDecodeError, StaticFrame, codec_for, supported_subprotocols
+from profiling import ProfileError, Profiler
+from session_store import SessionStore, create_backend
+from log_pipeline import CATEGORY_MESSAGE, CATEGORY_PING, sampled, setup_logging
+from worker_supervisor import WorkerSupervisor, per_worker_path, run_supervisor, serve_until_stopped
+
+# 日志在main()中通过log_pipeline配置为队列+后台线程写入
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -36,6 +47,14 @@ class ServerConfig:
     """服务器配置"""
     host: str = "0.0.0.0"
     port: int = 8000
+    # 单个连接同时处理的耗时请求数
+    max_inflight_requests: int = 4
+    # 消息编码：auto在客户端声明支持时使用MessagePack，json只使用JSON
+    codec: str = "auto"
+    # 工作进程数，大于1时由监督进程启动多个进程通过SO_REUSEPORT共用端口
+    workers: int = 1
+    # 停止或滚动重启时等待在途请求完成的最长时间(秒)
+    drain_timeout: float = 30.0
     
     # 模型路径配置
     sencevoice_model_path: str = "/path/to/SenseVoice"
@@ -47,6 +66,9 @@ class ServerConfig:
     enable_sv: bool = True
     kws_keyword: str = "ni hao xiao qian"
     sv_threshold: float = 0.35
+    sv_min_enroll_seconds: float = 3.0
+    # 同一会话的新语音打断仍在处理中的上一条语音
+    enable_barge_in: bool = True
     
     # 路径配置
     sv_enroll_dir: str = "./SpeakerVerification_DIR/enroll_wav/"
@@ -56,25 +78,207 @@ class ServerConfig:
     sample_rate: int = 16000
     channels: int = 1
     bit_depth: int = 16
+    
+    # VAD配置
+    enable_vad: bool = True
+    vad_energy_threshold_db: float = -40.0
+    vad_min_energy_dbfs: float = -55.0
+    vad_min_speech_ms: float = 200.0
+    vad_padding_ms: float = 150.0
+    
+    # ASR推理配置
+    asr_backend: str = "mock"  # mock | onnx
+    asr_intra_op_threads: int = 4
+    asr_pool_size: int = 2
+    asr_max_batch_size: int = 4
+    asr_batch_timeout_ms: float = 10.0
+    asr_warmup: bool = True
+    
+    # LLM后端配置
+    llm_backend: str = "mock"  # mock | websocket
+    llm_config_file: str = "llm_config.yaml"
+    llm_pool_size: int = 2
+    llm_max_inflight_per_connection: int = 8
+    llm_request_timeout: float = 30.0
+    llm_acquire_timeout: float = 5.0
+    llm_system_prompt: str = "你叫小千，是一个友好的语音助手，回答简短一些。"
+    
+    # 指标端点配置
+    enable_metrics: bool = False
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int = 9100
+    
+    # 请求追踪配置
+    enable_tracing: bool = True
+    trace_file: str = "./output/traces.jsonl"
+    trace_sample_rate: float = 0.1
+    trace_slow_ms: float = 2000.0
+    
+    # 日志配置
+    log_file: str = "sencevoice_server.log"
+    log_json: bool = True
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    # 高频日志每N条记录1条
+    log_sample_message: int = 10
+    log_sample_ping: int = 100
+    
+    # 管理消息(profile_request)的令牌，为空时不接受剖析请求
+    admin_token: str = ""
+    profile_max_seconds: float = 60.0
+    
+    # 会话状态(唤醒、声纹注册)存储：memory | sqlite | redis，多工作进程或多机部署时使用sqlite或redis
+    session_backend: str = "memory"
+    # global: 全服务共用一份状态(原行为)；session: 按session_id区分
+    session_scope: str = "global"
+    session_sqlite_path: str = "./output/sessions.db"
+    session_redis_url: str = "redis://127.0.0.1:6379/0"
+    # 共享后端时本地缓存的有效期，也是其他进程的修改最迟多久可见
+    session_cache_ttl: float = 0.5
+    session_flush_interval: float = 0.02
+    session_ttl: float = 86400.0
+
+class StageTimer:
+    """记录请求各阶段的完成时刻，单位为相对请求开始的毫秒数"""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks: Dict[str, float] = {}
+    
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.start) * 1000, 1)
+    
+    def mark(self, stage: str) -> float:
+        self.marks[stage] = self.elapsed_ms()
+        return self.marks[stage]
+    
+    def to_dict(self) -> Dict[str, float]:
+        return dict(self.marks)
+    
+    def durations(self) -> Dict[str, float]:
+        """各阶段自身的耗时(秒)，按完成顺序用相邻时刻相减"""
+        result = {}
+        previous = 0.0
+        for stage, mark in self.marks.items():
+            result[stage] = max(0.0, mark - previous) / 1000
+            previous = mark
+        return result
+
+@dataclass
+class VoicePipeline:
+    """会话中正在处理的语音请求"""
+    request_id: Optional[str]
+    task: asyncio.Task
+    # 发起请求的连接，同一会话可能来自不同连接
+    websocket: Any = None
+    timer: Optional[StageTimer] = None
 
 class SenceVoiceServer:
     """SenceVoice WebSocket服务器"""
     
+    # 在读循环中直接处理的控制消息，不受耗时请求阻塞
+    INLINE_MESSAGE_TYPES = ("ping", "status_request", "reset_kws")
+    # 内容固定的pong预先编码，每次只拼接时间戳
+    PONG_FRAME = StaticFrame({"type": "pong"})
+    # 会读写唤醒/声纹状态的请求，同一连接内按到达顺序执行
+    ORDERED_MESSAGE_TYPES = ("voice_request", "sv_enroll_request")
+    # 语音处理流程中可被打断节省的阶段
+    PIPELINE_STAGES = ("asr", "sv", "llm", "tts")
+    
     def __init__(self, config: ServerConfig):
         self.config = config
         self.connected_clients: Set[websockets.WebSocketServerProtocol] = set()
         self.client_states: Dict[str, Dict] = {}
         self.request_count = 0
         
-        # 服务状态
-        self.kws_activated = False
-        self.sv_enrolled = False
+        # 服务状态：唤醒和声纹注册状态保存在会话存储中，多工作进程时可共享
+        self.sessions = SessionStore(
+            create_backend(config.session_backend, config.session_sqlite_path, config.session_redis_url),
+            cache_ttl=config.session_cache_ttl,
+            flush_interval=config.session_flush_interval,
+            ttl=config.session_ttl
+        )
+        
+        # VAD
+        self.vad_config = VADConfig(
+            energy_threshold_db=config.vad_energy_threshold_db,
+            min_energy_dbfs=config.vad_min_energy_dbfs,
+            min_speech_ms=config.vad_min_speech_ms,
+            padding_ms=config.vad_padding_ms
+        )
+        self.vad_stats = {
+            "utterances": 0,
+            "rejected": 0,
+            "input_seconds": 0.0,
+            "trimmed_seconds": 0.0
+        }
+        
+        # 音频接入统计
+        self.ingest_stats = {
+            "bytes": 0,
+            "seconds": 0.0,
+            "resampled": 0,
+            "rejected": 0,
+            "compressed": 0,
+            "passthrough": 0
+        }
+        
+        # 音频编码统计
+        self.codec_stats = CodecStats()
+        if config.channels != 1 or config.bit_depth != 16:
+            logger.warning(f"模型只支持单声道16bit输入，音频将统一转换为 {config.sample_rate}Hz 单声道16bit")
+        
+        # 打断：每个会话只保留最新一条语音请求的处理流程
+        self.voice_pipelines: Dict[str, VoicePipeline] = {}
+        self.barge_in_stats = {
+            "superseded": 0,
+            "cancelled_queued": 0,
+            "skipped_stages": {stage: 0 for stage in self.PIPELINE_STAGES}
+        }
+        
+        # ASR推理引擎，asr_backend为onnx时在start_server中加载
+        self.asr_engine: Optional[OnnxASREngine] = None
+        
+        # LLM连接池，llm_backend为websocket时在start_server中建立
+        self.llm_pool: Optional[LLMClientPool] = None
+        
+        # 运行指标，enable_metrics时在独立端口提供 /metrics
+        self.metrics = ServerMetrics("sencevoice")
+        self._register_gauges()
+        
+        # 请求追踪：出错和慢请求总是写入，其余按比例采样
+        self.trace_sink = TraceSink(config.trace_file, config.trace_sample_rate,
+                                    config.trace_slow_ms) if config.enable_tracing else None
+        
+        # 按需剖析，结果文件写入output_dir
+        self.profiler = Profiler(config.admin_token, config.output_dir, config.profile_max_seconds)
         
         # 初始化目录
         self._init_directories()
         
         logger.info(f"初始化SenceVoice WebSocket服务器: {config.host}:{config.port}")
     
+    def _register_gauges(self):
+        """连接数、在途请求和模型状态在抓取时计算，不占用请求处理路径"""
+        dispatchers = lambda: [state["dispatcher"] for state in self.client_states.values() if "dispatcher" in state]
+        self.metrics.gauge("connections", "当前连接数", lambda: len(self.connected_clients))
+        self.metrics.gauge("inflight_requests", "正在处理的请求数",
+                           lambda: sum(d.running for d in dispatchers()))
+        self.metrics.gauge("queued_requests", "等待处理名额的请求数",
+                           lambda: sum(d.queued for d in dispatchers()))
+        self.metrics.gauge("voice_pipelines", "未完成的语音处理流程数", lambda: len(self.voice_pipelines))
+        self.metrics.gauge("model_loaded", "模型是否就绪(模拟后端视为就绪)",
+                           lambda: self.config.asr_backend != "onnx" or self.asr_engine is not None,
+                           model="asr", backend=self.config.asr_backend)
+        self.metrics.gauge("model_loaded", "模型是否就绪(模拟后端视为就绪)",
+                           lambda: self.config.llm_backend != "websocket" or self.llm_pool is not None,
+                           model="llm", backend=self.config.llm_backend)
+    
+    def pending_requests(self) -> int:
+        """正在处理和排队的请求数，优雅退出时等待其归零"""
+        return sum(state["dispatcher"].running + state["dispatcher"].queued
+                   for state in self.client_states.values() if "dispatcher" in state)
+    
     def _init_directories(self):
         """初始化必要的目录"""
         os.makedirs(self.config.sv_enroll_dir, exist_ok=True)
@@ -85,8 +289,131 @@ class SenceVoiceServer:
         """获取客户端唯一标识"""
         return f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
     
-    async def register_client(self, websocket):
-        """注册新客户端"""
+    def _session_key(self, websocket, data: Optional[Dict[str, Any]] = None) -> str:
+        """会话键：请求中的session_id，其次为连接地址中的session_id，缺省为当前连接；打断和会话状态共用"""
+        client_id = self._get_client_id(websocket)
+        session_id = ((data or {}).get("data") or {}).get("session_id") or \
+            self.client_states.get(client_id, {}).get("session_id")
+        return f"session:{session_id}" if session_id else f"client:{client_id}"
+    
+    def _state_key(self, websocket, data: Optional[Dict[str, Any]] = None) -> str:
+        """唤醒/声纹状态的键：global时全服务共用，session时为会话键"""
+        if self.config.session_scope == "global":
+            return "global"
+        return self._session_key(websocket, data)
+    
+    def _client_codec(self, websocket) -> str:
+        """获取客户端协商的音频编码"""
+        state = self.client_states.get(self._get_client_id(websocket), {})
+        return state.get("audio_codec", CODEC_PCM16)
+    
+    async def decode_audio(self, audio_bytes: bytes, request_data: Dict[str, Any], codec: str = CODEC_PCM16) -> IngestResult:
+        """
+        解析上传音频并统一转换为配置的采样率(单声道16bit)
+        
+        mulaw/ima_adpcm编码的音频先解码为PCM；格式错误时抛出AudioFormatError，在任何模型运行之前拒绝请求；
+        m4a等压缩格式无法解码(未安装ffmpeg)时抛出CompressedAudioError，由调用方决定拒绝还是把原始文件交给模型
+        """
+        audio_format = request_data.get("audio_format", "wav")
+        try:
+            if codec != CODEC_PCM16:
+                start = time.perf_counter()
+                try:
+                    pcm = await asyncio.to_thread(decode_codec_audio, audio_bytes, codec)
+                except AudioCodecError as e:
+                    raise AudioFormatError(str(e))
+                self.codec_stats.record_decode(codec, time.perf_counter() - start)
+                audio_bytes, audio_format = pcm.tobytes(), "pcm"
+            
+            audio = await asyncio.to_thread(
+                ingest_audio,
+                audio_bytes,
+                self.config.sample_rate,
+                audio_format,
+                request_data.get("sample_rate"),
+                1 if codec != CODEC_PCM16 else request_data.get("channels"),
+                16 if codec != CODEC_PCM16 else request_data.get("bit_depth")
+            )
+        except CompressedAudioError:
+            raise
+        except AudioFormatError:
+            self.ingest_stats["rejected"] += 1
+            raise
+        
+        self.ingest_stats["bytes"] += audio.input_bytes
+        self.ingest_stats["seconds"] += audio.elapsed
+        if audio.resampled:
+            self.ingest_stats["resampled"] += 1
+        if audio.container != "wav":
+            self.ingest_stats["compressed"] += 1
+            logger.info("🎧 音频解码: %s → %sHz 单声道, 时长 %.2fs, 耗时 %.1fms",
+                        audio.container, audio.sample_rate, audio.duration, audio.elapsed * 1000)
+            return audio
+        
+        source = audio.source
+        logger.info("🎧 音频解析: %sHz/%sch/%sbit → %sHz 单声道, 时长 %.2fs, %.1f MB/s",
+                    source.sample_rate, source.channels, source.bits_per_sample,
+                    audio.sample_rate, audio.duration, audio.throughput_mbps)
+        return audio
+    
+    def _write_wav(self, path: str, samples: np.ndarray, sample_rate: int):
+        """保存16bit单声道WAV文件"""
+        with wave.open(path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(samples.astype("<i2", copy=False).tobytes())
+    
+    async def run_vad(self, samples: np.ndarray, sample_rate: int) -> Tuple[np.ndarray, Optional[VADResult]]:
+        """
+        语音活动检测，裁剪首尾静音，检测在后台线程中执行
+        
+        Returns:
+            (裁剪后的样本, VAD结果)，VAD未启用时原样返回样本且结果为None
+        """
+        if not self.config.enable_vad:
+            return samples, None
+        
+        result = await asyncio.to_thread(detect_speech, samples, sample_rate, self.vad_config)
+        
+        self.vad_stats["utterances"] += 1
+        self.vad_stats["input_seconds"] += result.total_duration
+        if not result.has_speech:
+            self.vad_stats["rejected"] += 1
+            self.vad_stats["trimmed_seconds"] += result.total_duration
+            raise ValueError(f"未检测到有效语音 (音频时长 {result.total_duration:.2f} 秒)")
+        
+        self.vad_stats["trimmed_seconds"] += result.total_duration - result.kept_duration
+        logger.info("🔇 VAD: 语音 %.2fs / 总时长 %.2fs, 裁剪 %.1f%%",
+                    result.speech_duration, result.total_duration, result.trimmed_ratio * 100)
+        return trim_silence(samples, result), result
+    
+    def extract_features(self, samples: np.ndarray, sample_rate: int) -> UtteranceFeatures:
+        """
+        整段语音的共享fbank特征
+
+        只创建容器，fbank在真实ASR/声纹模型首次读取时(于后台线程中)计算，模拟后端不读取特征
+        """
+        return UtteranceFeatures(samples, sample_rate, FbankConfig(sample_rate=sample_rate))
+    
+    def _ingest_summary(self) -> Dict[str, Any]:
+        """音频接入统计信息"""
+        seconds = self.ingest_stats["seconds"]
+        return {
+            **self.ingest_stats,
+            "throughput_mbps": round(self.ingest_stats["bytes"] / seconds / 1e6, 2) if seconds else 0.0
+        }
+    
+    def _vad_summary(self) -> Dict[str, Any]:
+        """VAD统计信息"""
+        input_seconds = self.vad_stats["input_seconds"]
+        return {
+            **self.vad_stats,
+            "trimmed_ratio": round(self.vad_stats["trimmed_seconds"] / input_seconds, 4) if input_seconds else 0.0
+        }
+    
+    async def register_client(self, websocket, path: str = "/"):
+        """注册新客户端，连接地址可带 ?session_id=xxx 用于重连后找回会话状态"""
         self.connected_clients.add(websocket)
         client_id = self._get_client_id(websocket)
         
@@ -94,8 +421,12 @@ class SenceVoiceServer:
         self.client_states[client_id] = {
             "connected_at": time.time(),
             "request_count": 0,
-            "last_activity": time.time()
+            "last_activity": time.time(),
+            "audio_codec": CODEC_PCM16,
+            "message_codec": codec_for(websocket).name,
+            "session_id": parse_qs(urlparse(path or "/").query).get("session_id", [None])[0]
         }
+        session = await self.sessions.get(self._state_key(websocket))
         
         logger.info(f"✅ 新客户端连接: {client_id} (总连接数: {len(self.connected_clients)})")
         
@@ -106,19 +437,22 @@ class SenceVoiceServer:
             "timestamp": int(time.time() * 1000),
             "data": {
                 "kws_enabled": self.config.enable_kws,
-                "kws_activated": self.kws_activated,
+                "kws_activated": session.get("kws_activated", False),
                 "sv_enabled": self.config.enable_sv,
-                "sv_enrolled": self.sv_enrolled,
+                "sv_enrolled": session.get("sv_enrolled", False),
                 "kws_keyword": self.config.kws_keyword,
                 "sv_threshold": self.config.sv_threshold,
+                "audio_codec": CODEC_PCM16,
+                "message_codec": codec_for(websocket).name,
                 "server_info": {
                     "name": "SenceVoice WebSocket服务器",
                     "version": "1.0.0",
-                    "capabilities": ["voice_request", "sv_enroll_request", "status_request", "reset_kws", "ping"]
+                    "capabilities": ["voice_request", "voice_event", "superseded", "sv_enroll_request", "status_request", "reset_kws", "ping"],
+                    "audio_codecs": list(SUPPORTED_CODECS)
                 }
             }
         }
-        await websocket.send(json.dumps(welcome_msg, ensure_ascii=False))
+        await self.send_message(websocket, welcome_msg)
     
     async def unregister_client(self, websocket):
         """注销客户端"""
@@ -129,16 +463,29 @@ class SenceVoiceServer:
     
     async def handle_client(self, websocket, path):
         """处理客户端连接"""
-        await self.register_client(websocket)
+        await self.register_client(websocket, path)
+        dispatcher = ConnectionDispatcher(
+            on_error=lambda error, request_id: self.send_error(websocket, error, request_id),
+            max_inflight=self.config.max_inflight_requests,
+            inline_types=self.INLINE_MESSAGE_TYPES,
+            ordered_types=self.ORDERED_MESSAGE_TYPES
+        )
+        self.client_states[self._get_client_id(websocket)]["dispatcher"] = dispatcher
+        codec = codec_for(websocket)
         
         try:
             async for message in websocket:
                 try:
-                    data = json.loads(message)
-                    await self.process_message(websocket, data)
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON解析错误: {e}")
-                    await self.send_error(websocket, "Invalid JSON format", None)
+                    data = codec.decode(message)
+                    self.metrics.inc("messages_total", 1, "收到的消息数", type=str(data.get("type")))
+                    task = await dispatcher.dispatch(data.get("type"), data.get("requestId"),
+                                                     lambda data=data: self.process_message(websocket, data))
+                    # 新语音被接受后才打断上一条，因超出并发上限被拒绝时上一条继续处理
+                    if data.get("type") == "voice_request" and self.config.enable_barge_in and task is not None:
+                        await self.supersede_voice_pipeline(websocket, data, task)
+                except MessageDecodeError as e:
+                    logger.error(f"消息解析错误: {e}")
+                    await self.send_error(websocket, f"Invalid {codec.name.upper()} format", None)
                 except Exception as e:
                     logger.error(f"处理消息错误: {e}")
                     await self.send_error(websocket, str(e), None)
@@ -148,8 +495,62 @@ class SenceVoiceServer:
         except Exception as e:
             logger.error(f"连接异常: {e}")
         finally:
+            await dispatcher.close()
             await self.unregister_client(websocket)
     
+    def _track_voice_pipeline(self, websocket, data: Dict[str, Any], task: asyncio.Task):
+        """登记会话中最新的语音请求，结束后自动移除"""
+        key = self._session_key(websocket, data)
+        pipeline = VoicePipeline(request_id=data.get("requestId"), task=task, websocket=websocket)
+        self.voice_pipelines[key] = pipeline
+        
+        def _done(_):
+            if self.voice_pipelines.get(key) is pipeline:
+                del self.voice_pipelines[key]
+        task.add_done_callback(_done)
+    
+    async def supersede_voice_pipeline(self, websocket, data: Dict[str, Any], task: asyncio.Task):
+        """
+        登记新语音请求的任务，取消同一会话中尚未完成的上一条语音请求并通知客户端
+        
+        上一条请求正在等待LLM时，取消会传到LLM客户端，由其向后端发送cancel停止生成
+        """
+        pipeline = self.voice_pipelines.pop(self._session_key(websocket, data), None)
+        self._track_voice_pipeline(websocket, data, task)
+        if pipeline is None or pipeline.task.done():
+            return
+        
+        pipeline.task.cancel()
+        self.barge_in_stats["superseded"] += 1
+        stages = [stage for stage in self.PIPELINE_STAGES if stage != "sv" or self.config.enable_sv]
+        if pipeline.timer is None:
+            # 仍在排队，整个流程都被省掉
+            self.barge_in_stats["cancelled_queued"] += 1
+            skipped = stages
+            elapsed_ms = 0.0
+        else:
+            skipped = [stage for stage in stages if stage not in pipeline.timer.marks]
+            elapsed_ms = pipeline.timer.elapsed_ms()
+        for stage in skipped:
+            self.barge_in_stats["skipped_stages"][stage] += 1
+        
+        notice = {
+            "type": "superseded",
+            "requestId": pipeline.request_id,
+            "success": False,
+            "timestamp": int(time.time() * 1000),
+            "data": {
+                "superseded_by": data.get("requestId"),
+                "skipped_stages": skipped,
+                "elapsed_ms": elapsed_ms
+            }
+        }
+        try:
+            await self.send_message(pipeline.websocket or websocket, notice)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        logger.info(f"✋ 语音请求被打断: {pipeline.request_id} → {data.get('requestId')}, 跳过阶段 {skipped}")
+    
     async def process_message(self, websocket, data: Dict[str, Any]):
         """处理收到的消息"""
         message_type = data.get("type")
@@ -161,7 +562,8 @@ class SenceVoiceServer:
             self.client_states[client_id]["last_activity"] = time.time()
             self.client_states[client_id]["request_count"] += 1
         
-        logger.info(f"📨 收到消息类型: {message_type}, ID: {request_id}, 客户端: {client_id}")
+        if sampled(CATEGORY_MESSAGE):
+            logger.info("📨 收到消息类型: %s, ID: %s, 客户端: %s", message_type, request_id, client_id)
         
         if message_type == "voice_request":
             await self.handle_voice_request(websocket, data)
@@ -173,18 +575,31 @@ class SenceVoiceServer:
             await self.handle_reset_kws(websocket, data)
         elif message_type == "ping":
             await self.handle_ping(websocket, data)
+        elif message_type == "profile_request":
+            await self.handle_profile_request(websocket, data)
         else:
             logger.warning(f"未知消息类型: {message_type}")
             await self.send_error(websocket, f"Unknown message type: {message_type}", request_id)
     
     async def handle_voice_request(self, websocket, data: Dict[str, Any]):
-        """处理语音识别和对话请求"""
+        """处理语音识别和对话请求，data.progressive为true时各阶段完成后推送voice_event"""
         request_id = data.get("requestId")
         request_data = data.get("data", {})
+        codec = self._client_codec(websocket)
+        progressive = bool(request_data.get("progressive", False))
+        timer = StageTimer()
+        # 追踪与StageTimer共用起点，客户端可通过data.trace_id关联自己的追踪
+        trace = Trace("voice_request", request_data.get("trace_id"), start=timer.start)
+        failed = False
+        temp_audio_file = None
+        
+        pipeline = self.voice_pipelines.get(self._session_key(websocket, data))
+        if pipeline is not None and pipeline.task is asyncio.current_task():
+            pipeline.timer = timer
         
         try:
             self.request_count += 1
-            logger.info(f"🎤 处理语音请求 #{self.request_count}, ID: {request_id}")
+            logger.info("🎤 处理语音请求 #%d, ID: %s", self.request_count, request_id)
             
             # 获取音频数据
             audio_data = request_data.get("audio_data")
@@ -194,20 +609,55 @@ class SenceVoiceServer:
             # 解码音频数据
             try:
                 audio_bytes = base64.b64decode(audio_data)
-                logger.info(f"音频数据大小: {len(audio_bytes)} bytes")
+                logger.debug("音频数据大小: %d bytes", len(audio_bytes))
             except Exception as e:
                 raise ValueError(f"音频数据解码失败: {e}")
             
-            # 保存临时音频文件
-            temp_audio_file = os.path.join(self.config.output_dir, f"temp_audio_{request_id}_{int(time.time())}.wav")
-            with open(temp_audio_file, "wb") as f:
-                f.write(audio_bytes)
+            # 解析音频格式并转换为模型输入格式
+            try:
+                audio = await self.decode_audio(audio_bytes, request_data, request_data.get("audio_codec", codec))
+            except CompressedAudioError as e:
+                # 真实ASR后端只接受解码后的特征，无法解码时拒绝请求，不能返回模拟的识别结果
+                if self.config.asr_backend != "mock":
+                    self.ingest_stats["rejected"] += 1
+                    raise
+                # 模拟后端(如未安装ffmpeg时的m4a录音)：与原流程一样把上传的文件直接交给模型
+                self.ingest_stats["passthrough"] += 1
+                logger.warning(f"⚠️ {e}，跳过VAD，原始文件直接交给模型")
+                audio = None
+                temp_audio_file = os.path.join(self.config.output_dir,
+                                               f"temp_audio_{request_id}_{int(time.time())}.{e.container}")
+                with open(temp_audio_file, "wb") as f:
+                    f.write(audio_bytes)
+            timer.mark("decode")
+            
+            features = None
+            vad_result = None
+            if audio is not None:
+                # 语音活动检测：裁剪首尾静音，无语音时直接拒绝，不再运行模型
+                speech, vad_result = await self.run_vad(audio.samples, audio.sample_rate)
+                timer.mark("vad")
+                
+                # 保存临时音频文件
+                temp_audio_file = os.path.join(self.config.output_dir, f"temp_audio_{request_id}_{int(time.time())}.wav")
+                self._write_wav(temp_audio_file, speech, audio.sample_rate)
+                
+                # 共享声学特征：fbank只计算一次，ASR与声纹验证共用
+                features = self.extract_features(speech, audio.sample_rate)
             
             # 模拟语音处理流程
-            asr_result = await self.perform_asr(temp_audio_file)
+            asr_result = await self.perform_asr(temp_audio_file, features)
+            timer.mark("asr")
+            if progressive:
+                event_data = {"asr_result": asr_result}
+                if vad_result is not None:
+                    event_data["vad"] = vad_result.to_dict()
+                await self.send_voice_event(websocket, request_id, "asr_result", event_data, timer)
             
             # 检查关键词唤醒
-            if self.config.enable_kws and not self.kws_activated:
+            state_key = self._state_key(websocket, data)
+            session = await self.sessions.get(state_key)
+            if self.config.enable_kws and not session.get("kws_activated", False):
                 if not self.check_keyword_activation(asr_result):
                     response = {
                         "type": "voice_response",
@@ -219,18 +669,20 @@ class SenceVoiceServer:
                             "error": "关键词未激活",
                             "error_code": "KWS_NOT_ACTIVATED",
                             "message": "很抱歉，唤醒词错误，请说出正确的唤醒词哦",
-                            "audio_response": await self.generate_tts("很抱歉，唤醒词错误，请说出正确的唤醒词哦"),
-                            "asr_result": asr_result
+                            "audio_response": await self.generate_tts("很抱歉，唤醒词错误，请说出正确的唤醒词哦", codec),
+                            "audio_codec": codec,
+                            "asr_result": asr_result,
+                            "timings": timer.to_dict()
                         }
                     }
-                    await websocket.send(json.dumps(response, ensure_ascii=False))
+                    await self.send_message(websocket, response)
                     return
                 else:
-                    self.kws_activated = True
+                    self.sessions.update(state_key, kws_activated=True)
                     logger.info("✅ 关键词已激活")
             
             # 检查声纹验证
-            if self.config.enable_sv and not self.sv_enrolled:
+            if self.config.enable_sv and not session.get("sv_enrolled", False):
                 response = {
                     "type": "voice_response",
                     "requestId": request_id,
@@ -241,15 +693,18 @@ class SenceVoiceServer:
                         "error": "声纹未注册",
                         "error_code": "SV_NOT_ENROLLED",
                         "message": "请先进行声纹注册",
-                        "audio_response": await self.generate_tts("请先进行声纹注册"),
-                        "asr_result": asr_result
+                        "audio_response": await self.generate_tts("请先进行声纹注册", codec),
+                        "audio_codec": codec,
+                        "asr_result": asr_result,
+                        "timings": timer.to_dict()
                     }
                 }
-                await websocket.send(json.dumps(response, ensure_ascii=False))
+                await self.send_message(websocket, response)
                 return
-            elif self.config.enable_sv and self.sv_enrolled:
+            elif self.config.enable_sv:
                 # 进行声纹验证
-                sv_verified = await self.verify_speaker(temp_audio_file)
+                sv_verified = await self.verify_speaker(temp_audio_file, features)
+                timer.mark("sv")
                 if not sv_verified:
                     response = {
                         "type": "voice_response",
@@ -261,18 +716,28 @@ class SenceVoiceServer:
                             "error": "声纹验证失败",
                             "error_code": "SV_VERIFICATION_FAILED",
                             "message": "声纹验证失败，请重新说话或重新注册声纹",
-                            "audio_response": await self.generate_tts("声纹验证失败，请重新说话或重新注册声纹"),
-                            "asr_result": asr_result
+                            "audio_response": await self.generate_tts("声纹验证失败，请重新说话或重新注册声纹", codec),
+                            "audio_codec": codec,
+                            "asr_result": asr_result,
+                            "timings": timer.to_dict()
                         }
                     }
-                    await websocket.send(json.dumps(response, ensure_ascii=False))
+                    await self.send_message(websocket, response)
                     return
             
             # 调用大语言模型
-            llm_response = await self.call_llm(asr_result)
+            llm_response = await self.call_llm(asr_result, trace)
+            timer.mark("llm")
+            if progressive:
+                await self.send_voice_event(websocket, request_id, "llm_text", {"llm_response": llm_response}, timer)
             
             # 生成TTS音频
-            tts_audio = await self.generate_tts(llm_response)
+            tts_audio = await self.generate_tts(llm_response, codec)
+            timer.mark("tts")
+            if progressive:
+                # 音频只在audio_ready事件中发送一次，最终响应不再重复携带
+                await self.send_voice_event(websocket, request_id, "audio_ready",
+                                            {"audio_response": tts_audio, "audio_codec": codec}, timer)
             
             # 构造成功响应
             response = {
@@ -284,28 +749,74 @@ class SenceVoiceServer:
                     "success": True,
                     "asr_result": asr_result,
                     "llm_response": llm_response,
-                    "audio_response": tts_audio,
-                    "response_type": "voice_chat_success"
+                    "audio_response": None if progressive else tts_audio,
+                    "audio_codec": codec,
+                    "response_type": "voice_chat_success",
+                    "timings": timer.to_dict(),
+                    "trace": self._trace_dict(trace, timer)
                 }
             }
+            if vad_result is not None:
+                response["data"]["vad"] = vad_result.to_dict()
             
-            await websocket.send(json.dumps(response, ensure_ascii=False))
-            logger.info(f"✅ 语音响应已发送, ID: {request_id}")
-            
-            # 清理临时文件
-            try:
-                os.remove(temp_audio_file)
-            except:
-                pass
+            await self.send_message(websocket, response)
+            timer.mark("send")
+            logger.info("✅ 语音响应已发送, ID: %s", request_id)
             
         except Exception as e:
+            failed = True
             logger.error(f"语音请求处理失败: {e}")
-            await self.send_error(websocket, f"语音处理失败: {str(e)}", request_id, "VOICE_CHAT_FAILED")
+            if isinstance(e, CompressedAudioError):
+                error_code = "UNSUPPORTED_AUDIO_FORMAT"
+            elif isinstance(e, AudioFormatError):
+                error_code = "INVALID_AUDIO_FORMAT"
+            elif "未检测到有效语音" in str(e):
+                error_code = "NO_SPEECH_DETECTED"
+            else:
+                error_code = "VOICE_CHAT_FAILED"
+            await self.send_error(websocket, f"语音处理失败: {str(e)}", request_id, error_code)
+        finally:
+            for stage, seconds in timer.durations().items():
+                self.metrics.observe("stage_duration_seconds", seconds, "语音请求各阶段耗时", stage=stage)
+            if self.trace_sink is not None:
+                trace.spans = self._trace_dict(trace, timer)["spans"]
+                trace.attributes["request_id"] = request_id
+                self.trace_sink.submit(trace, error=failed)
+            # 清理临时文件(包括被打断的请求)
+            if temp_audio_file:
+                try:
+                    os.remove(temp_audio_file)
+                except OSError:
+                    pass
+    
+    def _trace_dict(self, trace: Trace, timer: StageTimer) -> Dict[str, Any]:
+        """由StageTimer的阶段时刻生成span，再附上LLM调用返回的下游span"""
+        spans = []
+        previous = 0.0
+        for stage, mark in timer.marks.items():
+            spans.append({"name": stage, "start_ms": previous, "duration_ms": round(mark - previous, 2)})
+            previous = mark
+        return {"trace_id": trace.trace_id, "spans": spans + trace.spans}
+    
+    async def send_voice_event(self, websocket, request_id: Optional[str], stage: str,
+                               event_data: Dict[str, Any], timer: StageTimer):
+        """推送语音请求的阶段性事件，最终仍会发送汇总的voice_response"""
+        event = {
+            "type": "voice_event",
+            "requestId": request_id,
+            "stage": stage,
+            "timestamp": int(time.time() * 1000),
+            "elapsed_ms": timer.elapsed_ms(),
+            "data": event_data
+        }
+        await self.send_message(websocket, event)
+        logger.info("📤 阶段事件 %s 已发送, ID: %s, 耗时 %sms", stage, request_id, event["elapsed_ms"])
     
     async def handle_sv_enroll_request(self, websocket, data: Dict[str, Any]):
         """处理声纹注册请求"""
         request_id = data.get("requestId")
         request_data = data.get("data", {})
+        codec = self._client_codec(websocket)
         
         try:
             logger.info(f"🔐 处理声纹注册请求, ID: {request_id}")
@@ -322,24 +833,37 @@ class SenceVoiceServer:
             except Exception as e:
                 raise ValueError(f"音频数据解码失败: {e}")
             
-            # 检查音频时长（模拟，实际应该解析音频文件）
-            if len(audio_bytes) < 48000:  # 假设16kHz, 16bit, 1channel, 至少3秒
-                raise ValueError("音频时长不足，声纹注册需要至少3秒音频")
-            
-            # 保存声纹注册音频
-            enroll_audio_file = os.path.join(self.config.sv_enroll_dir, f"enroll_{int(time.time())}.wav")
-            with open(enroll_audio_file, "wb") as f:
-                f.write(audio_bytes)
+            # 解析音频并检查有效语音时长
+            try:
+                audio = await self.decode_audio(audio_bytes, request_data, request_data.get("audio_codec", codec))
+            except CompressedAudioError as e:
+                # 无法解码的压缩音频：保存原始文件，由声纹模型自行解码，无法检查时长
+                self.ingest_stats["passthrough"] += 1
+                logger.warning(f"⚠️ {e}，跳过时长检查，保存原始文件")
+                enroll_audio_file = os.path.join(self.config.sv_enroll_dir, f"enroll_{int(time.time())}.{e.container}")
+                with open(enroll_audio_file, "wb") as f:
+                    f.write(audio_bytes)
+            else:
+                speech, vad_result = await self.run_vad(audio.samples, audio.sample_rate)
+                speech_duration = vad_result.speech_duration if vad_result is not None else audio.duration
+                min_seconds = self.config.sv_min_enroll_seconds
+                if speech_duration < min_seconds:
+                    raise ValueError(f"音频时长不足，声纹注册需要至少{min_seconds:g}秒有效语音 "
+                                     f"(检测到 {speech_duration:.2f} 秒)")
+                
+                # 保存声纹注册音频
+                enroll_audio_file = os.path.join(self.config.sv_enroll_dir, f"enroll_{int(time.time())}.wav")
+                self._write_wav(enroll_audio_file, speech, audio.sample_rate)
             
             # 模拟声纹注册过程
             await asyncio.sleep(1.0)  # 模拟处理时间
             
             # 标记声纹已注册
-            self.sv_enrolled = True
+            self.sessions.update(self._state_key(websocket, data), sv_enrolled=True)
             
             # 生成成功响应
             success_message = "声纹注册完成！现在只有你可以命令我啦！"
-            tts_audio = await self.generate_tts(success_message)
+            tts_audio = await self.generate_tts(success_message, codec)
             
             response = {
                 "type": "sv_enroll_response",
@@ -350,22 +874,44 @@ class SenceVoiceServer:
                     "success": True,
                     "message": success_message,
                     "audio_response": tts_audio,
+                    "audio_codec": codec,
                     "response_type": "sv_enrollment_success"
                 }
             }
             
-            await websocket.send(json.dumps(response, ensure_ascii=False))
+            await self.send_message(websocket, response)
             logger.info(f"✅ 声纹注册成功, ID: {request_id}")
             
         except Exception as e:
             logger.error(f"声纹注册失败: {e}")
-            error_code = "AUDIO_TOO_SHORT" if "时长不足" in str(e) else "SV_ENROLLMENT_FAILED"
+            if isinstance(e, AudioFormatError):
+                error_code = "INVALID_AUDIO_FORMAT"
+            elif "时长不足" in str(e):
+                error_code = "AUDIO_TOO_SHORT"
+            elif "未检测到有效语音" in str(e):
+                error_code = "NO_SPEECH_DETECTED"
+            else:
+                error_code = "SV_ENROLLMENT_FAILED"
             await self.send_error(websocket, f"声纹注册失败: {str(e)}", request_id, error_code)
     
+    def _client_inflight(self, websocket) -> int:
+        """当前连接未完成的耗时请求数"""
+        dispatcher = self.client_states.get(self._get_client_id(websocket), {}).get("dispatcher")
+        return dispatcher.pending if dispatcher else 0
+    
     async def handle_status_request(self, websocket, data: Dict[str, Any]):
-        """处理状态查询请求"""
+        """处理状态查询请求，客户端可通过 data.audio_codecs 协商音频编码"""
         request_id = data.get("requestId")
+        client_codecs = data.get("data", {}).get("audio_codecs")
         
+        if client_codecs is not None:
+            codec = negotiate_codec(client_codecs)
+            client_id = self._get_client_id(websocket)
+            if client_id in self.client_states:
+                self.client_states[client_id]["audio_codec"] = codec
+            logger.info(f"🎚️ 音频编码协商: {client_id} → {codec}")
+        
+        session = await self.sessions.get(self._state_key(websocket, data))
         response = {
             "type": "status_response",
             "requestId": request_id,
@@ -373,22 +919,40 @@ class SenceVoiceServer:
             "timestamp": int(time.time() * 1000),
             "data": {
                 "kws_enabled": self.config.enable_kws,
-                "kws_activated": self.kws_activated,
+                "kws_activated": session.get("kws_activated", False),
                 "sv_enabled": self.config.enable_sv,
-                "sv_enrolled": self.sv_enrolled,
+                "sv_enrolled": session.get("sv_enrolled", False),
                 "kws_keyword": self.config.kws_keyword,
-                "sv_threshold": self.config.sv_threshold
+                "sv_threshold": self.config.sv_threshold,
+                "vad_enabled": self.config.enable_vad,
+                "vad_stats": self._vad_summary(),
+                "ingest_stats": self._ingest_summary(),
+                "audio_codec": self._client_codec(websocket),
+                "audio_codecs": list(SUPPORTED_CODECS),
+                "codec_stats": self.codec_stats.summary(),
+                "inflight_requests": self._client_inflight(websocket),
+                "barge_in_enabled": self.config.enable_barge_in,
+                "barge_in_stats": self.barge_in_stats,
+                "asr_backend": self.config.asr_backend,
+                "asr_stats": self.asr_engine.get_stats() if self.asr_engine else None,
+                "llm_backend": self.config.llm_backend,
+                "llm_pool": self.llm_pool.get_stats() if self.llm_pool else None,
+                "stage_latency": self.metrics.histogram_summary("stage_duration_seconds"),
+                "trace_stats": self.trace_sink.stats if self.trace_sink else None,
+                "session_scope": self.config.session_scope,
+                "session_stats": self.sessions.get_stats()
             }
         }
         
-        await websocket.send(json.dumps(response, ensure_ascii=False))
-        logger.info(f"📊 状态查询响应已发送, ID: {request_id}")
+        await self.send_message(websocket, response)
+        if sampled(CATEGORY_MESSAGE):
+            logger.info("📊 状态查询响应已发送, ID: %s", request_id)
     
     async def handle_reset_kws(self, websocket, data: Dict[str, Any]):
         """处理重置关键词状态请求"""
         request_id = data.get("requestId")
         
-        self.kws_activated = False
+        self.sessions.update(self._state_key(websocket, data), kws_activated=False)
         
         response = {
             "type": "reset_kws_response",
@@ -398,17 +962,37 @@ class SenceVoiceServer:
             "message": "关键词状态已重置"
         }
         
-        await websocket.send(json.dumps(response, ensure_ascii=False))
+        await self.send_message(websocket, response)
         logger.info(f"🔄 关键词状态已重置, ID: {request_id}")
     
     async def handle_ping(self, websocket, data: Dict[str, Any]):
         """处理PING消息"""
-        pong_response = {
-            "type": "pong",
-            "timestamp": int(time.time() * 1000)
+        await websocket.send(self.PONG_FRAME.frame(codec_for(websocket)))
+        if sampled(CATEGORY_PING):
+            logger.debug("🏓 PONG响应已发送")
+    
+    async def handle_profile_request(self, websocket, data: Dict[str, Any]):
+        """处理剖析请求(管理消息)，采集期间不阻塞同一连接上的其他请求"""
+        request_id = data.get("requestId")
+        try:
+            result = await self.profiler.handle(data.get("data", {}))
+        except ProfileError as e:
+            await self.send_error(websocket, str(e), request_id, e.code)
+            return
+        
+        response = {
+            "type": "profile_response",
+            "requestId": request_id,
+            "success": True,
+            "timestamp": int(time.time() * 1000),
+            "data": result
         }
-        await websocket.send(json.dumps(pong_response))
-        logger.debug("🏓 PONG响应已发送")
+        await self.send_message(websocket, response)
+        logger.info(f"🔬 剖析结果已发送, ID: {request_id}")
+    
+    async def send_message(self, websocket, message: Dict[str, Any]):
+        """按连接协商的编码发送消息"""
+        await websocket.send(codec_for(websocket).encode(message))
     
     async def send_error(self, websocket, error_message: str, request_id: Optional[str], error_code: str = "UNKNOWN_ERROR"):
         """发送错误响应"""
@@ -420,18 +1004,47 @@ class SenceVoiceServer:
             "error_code": error_code,
             "timestamp": int(time.time() * 1000)
         }
+        self.metrics.inc("errors_total", 1, "发送的错误响应数", code=error_code)
         
         try:
-            await websocket.send(json.dumps(error_response, ensure_ascii=False))
+            await self.send_message(websocket, error_response)
             logger.error(f"❌ 错误响应已发送: {error_message} ({error_code})")
         except Exception as e:
             logger.error(f"发送错误响应失败: {e}")
     
-    async def perform_asr(self, audio_file: str) -> str:
-        """执行语音识别 - 模拟实现"""
+    async def init_asr_engine(self):
+        """按配置加载ONNX Runtime ASR引擎并预热"""
+        if self.config.asr_backend != "onnx":
+            logger.info(f"🧠 ASR后端: {self.config.asr_backend}")
+            return
+        
+        engine = OnnxASREngine(ASREngineConfig(
+            model_path=self.config.sencevoice_model_path,
+            intra_op_threads=self.config.asr_intra_op_threads,
+            pool_size=self.config.asr_pool_size,
+            max_batch_size=self.config.asr_max_batch_size,
+            batch_timeout_ms=self.config.asr_batch_timeout_ms,
+            warmup=self.config.asr_warmup
+        ))
+        await asyncio.to_thread(engine.load)
+        if self.config.asr_warmup:
+            await engine.warmup()
+        self.asr_engine = engine
+        logger.info(f"🧠 ASR后端: onnx, 会话数 {self.config.asr_pool_size}, "
+                    f"线程预算 {self.config.asr_intra_op_threads}, 最大批大小 {self.config.asr_max_batch_size}")
+    
+    async def perform_asr(self, audio_file: str, features: Optional[UtteranceFeatures] = None) -> str:
+        """执行语音识别，只有模拟后端返回模拟结果"""
+        if self.config.asr_backend != "mock":
+            if self.asr_engine is None or features is None:
+                raise RuntimeError(f"ASR后端 {self.config.asr_backend} 不可用或缺少解码后的音频特征")
+            engine_config = self.asr_engine.config
+            asr_input = await asyncio.to_thread(features.for_asr, engine_config.lfr_m, engine_config.lfr_n)
+            return await self.asr_engine.transcribe(asr_input)
+        
         await asyncio.sleep(0.2)  # 模拟ASR处理时间
         
-        # 这里应该调用真实的SenseVoice模型
+        # 这里应该调用真实的SenseVoice模型，输入为共享fbank的LFR拼帧结果 features.for_asr()
         # 目前返回模拟结果
         mock_results = [
             "你好小千",
@@ -461,16 +1074,44 @@ class SenceVoiceServer:
         # 还可以检查相似度等更复杂的匹配
         return False
     
-    async def verify_speaker(self, audio_file: str) -> bool:
+    async def verify_speaker(self, audio_file: str, features: Optional[UtteranceFeatures] = None) -> bool:
         """声纹验证 - 模拟实现"""
         await asyncio.sleep(0.3)  # 模拟声纹验证时间
         
-        # 这里应该调用真实的声纹验证模型
+        # 这里应该调用真实的声纹验证模型(CAM++)，输入为共享fbank的均值归一化结果 features.for_sv()
         # 目前模拟返回成功
         return True
     
-    async def call_llm(self, user_input: str) -> str:
-        """调用大语言模型"""
+    async def init_llm_pool(self):
+        """按配置建立到LLM后端的共享连接池"""
+        if self.config.llm_backend != "websocket":
+            logger.info(f"💬 LLM后端: {self.config.llm_backend}")
+            return
+        
+        pool = LLMClientPool(LLMPoolConfig(
+            config_file=self.config.llm_config_file,
+            pool_size=self.config.llm_pool_size,
+            max_inflight_per_connection=self.config.llm_max_inflight_per_connection,
+            request_timeout=self.config.llm_request_timeout,
+            acquire_timeout=self.config.llm_acquire_timeout
+        ))
+        await pool.start()
+        self.llm_pool = pool
+        logger.info(f"💬 LLM后端: websocket, 连接数 {self.config.llm_pool_size}, "
+                    f"每连接并发 {self.config.llm_max_inflight_per_connection}")
+    
+    async def call_llm(self, user_input: str, trace: Optional[Trace] = None) -> str:
+        """调用大语言模型，未建立连接池时使用模拟实现；传入trace时合并LLM客户端和服务器的span"""
+        if self.llm_pool is not None:
+            llm_start_ms = trace.offset_ms() if trace is not None else 0.0
+            response = await self.llm_pool.request(user_input, system_prompt=self.config.llm_system_prompt,
+                                                   trace=trace.context("llm") if trace is not None else None)
+            if trace is not None and response.trace:
+                trace.add_remote_spans(response.trace.get("spans", []), parent="llm", offset_ms=llm_start_ms)
+            if not response.success:
+                raise RuntimeError(f"LLM请求失败: {response.error}")
+            return response.message
+        
         await asyncio.sleep(0.5)  # 模拟LLM处理时间
         
         # 这里应该调用真实的大语言模型API
@@ -483,19 +1124,33 @@ class SenceVoiceServer:
             "告诉我一个笑话": "为什么程序员喜欢黑色？因为光线太亮会看不清代码！哈哈！"
         }
         
-        return responses.get(user_input, f"我收到了你的消息："{user_input}"。这是一个智能回复，我会尽力帮助你！")
+        return responses.get(user_input, f"我收到了你的消息：“{user_input}”。这是一个智能回复，我会尽力帮助你！")
     
-    async def generate_tts(self, text: str) -> str:
-        """生成TTS音频 - 模拟实现"""
+    async def synthesize_speech(self, text: str) -> np.ndarray:
+        """语音合成 - 模拟实现，返回配置采样率的int16单声道PCM"""
         await asyncio.sleep(0.3)  # 模拟TTS处理时间
         
         # 这里应该调用真实的TTS引擎
-        # 目前返回模拟的base64音频数据
-        mock_audio = b"MOCK_TTS_AUDIO_DATA_" + text.encode('utf-8')
-        return base64.b64encode(mock_audio).decode('utf-8')
+        # 目前按文本长度生成一段带包络的模拟语音
+        duration = min(max(len(text) * 0.15, 0.5), 10.0)
+        t = np.arange(int(self.config.sample_rate * duration)) / self.config.sample_rate
+        envelope = 0.5 - 0.5 * np.cos(2 * np.pi * 4 * t)
+        wave_data = envelope * (0.25 * np.sin(2 * np.pi * 220 * t) + 0.08 * np.sin(2 * np.pi * 660 * t))
+        return (wave_data * 32767).astype(np.int16)
+    
+    async def generate_tts(self, text: str, codec: str = CODEC_PCM16) -> str:
+        """生成TTS音频，按协商的编码格式编码后返回base64字符串"""
+        pcm = await self.synthesize_speech(text)
+        
+        start = time.perf_counter()
+        encoded = await asyncio.to_thread(encode_audio, pcm, codec, self.config.sample_rate)
+        audio_b64 = base64.b64encode(encoded).decode('utf-8')
+        self.codec_stats.record_encode(codec, pcm.nbytes, len(audio_b64), time.perf_counter() - start)
+        return audio_b64
     
     async def start_server(self):
         """启动服务器"""
+        metrics_server = None
         try:
             logger.info("="*60)
             logger.info("🚀 正在启动SenceVoice WebSocket服务器...")
@@ -506,6 +1161,13 @@ class SenceVoiceServer:
             logger.info(f"🔑 唤醒词: {self.config.kws_keyword}")
             logger.info("="*60)
             
+            # 加载ASR引擎，预热完成后再开始接受连接
+            await self.init_asr_engine()
+            await self.init_llm_pool()
+            if self.config.enable_metrics:
+                metrics_server = await start_metrics_server(self.metrics, self.config.metrics_host,
+                                                            self.config.metrics_port)
+            
             # 启动WebSocket服务器
             start_server = websockets.serve(
                 self.handle_client, 
@@ -513,10 +1175,13 @@ class SenceVoiceServer:
                 self.config.port,
                 ping_interval=20,
                 ping_timeout=10,
-                max_size=10*1024*1024  # 10MB for audio data
+                max_size=10*1024*1024,  # 10MB for audio data
+                create_protocol=metered_protocol(self.metrics),
+                subprotocols=supported_subprotocols(self.config.codec),
+                reuse_port=self.config.workers > 1
             )
             
-            await start_server
+            ws_server = await start_server
             logger.info("✅ 服务器启动成功！")
             logger.info("💡 提示：")
             logger.info("   1. 使用 Ctrl+C 停止服务器")
@@ -524,8 +1189,8 @@ class SenceVoiceServer:
             logger.info("   3. 前端现在可以连接并进行声纹识别和语音对话了")
             logger.info("="*60)
             
-            # 保持服务器运行
-            await asyncio.Future()  # 永远等待
+            # 运行到收到停止信号，然后处理完在途请求再退出
+            await serve_until_stopped(ws_server, self.pending_requests, self.config.drain_timeout)
             
         except OSError as e:
             if "Address already in use" in str(e):
@@ -541,6 +1206,16 @@ class SenceVoiceServer:
         except Exception as e:
             logger.error(f"❌ 服务器异常: {e}")
         finally:
+            if metrics_server is not None:
+                metrics_server.close()
+            # 写完尚未提交的会话状态
+            await self.sessions.close()
+            if self.asr_engine:
+                self.asr_engine.close()
+            if self.llm_pool:
+                await self.llm_pool.close()
+            if self.trace_sink:
+                await self.trace_sink.close()
             logger.info("🔚 服务器已停止")
 
 def load_config(config_file: str = "sencevoice_server_config.yaml") -> ServerConfig:
@@ -553,6 +1228,10 @@ def load_config(config_file: str = "sencevoice_server_config.yaml") -> ServerCon
             return ServerConfig(
                 host=config_data.get('server', {}).get('host', '0.0.0.0'),
                 port=config_data.get('server', {}).get('port', 8000),
+                max_inflight_requests=config_data.get('server', {}).get('max_inflight_requests', 4),
+                codec=config_data.get('server', {}).get('codec', 'auto'),
+                workers=config_data.get('server', {}).get('workers', 1),
+                drain_timeout=config_data.get('server', {}).get('drain_timeout', 30.0),
                 sencevoice_model_path=config_data.get('models', {}).get('sencevoice_model_path', '/path/to/SenseVoice'),
                 llm_model_path=config_data.get('models', {}).get('llm_model_path', '/path/to/Qwen2.5'),
                 sv_model_path=config_data.get('models', {}).get('sv_model_path', '/path/to/cam++'),
@@ -560,11 +1239,53 @@ def load_config(config_file: str = "sencevoice_server_config.yaml") -> ServerCon
                 enable_sv=config_data.get('features', {}).get('enable_sv', True),
                 kws_keyword=config_data.get('features', {}).get('kws_keyword', 'ni hao xiao qian'),
                 sv_threshold=config_data.get('features', {}).get('sv_threshold', 0.35),
+                sv_min_enroll_seconds=config_data.get('features', {}).get('sv_min_enroll_seconds', 3.0),
+                enable_barge_in=config_data.get('features', {}).get('enable_barge_in', True),
                 sv_enroll_dir=config_data.get('paths', {}).get('sv_enroll_dir', './SpeakerVerification_DIR/enroll_wav/'),
                 output_dir=config_data.get('paths', {}).get('output_dir', './output'),
                 sample_rate=config_data.get('audio', {}).get('sample_rate', 16000),
                 channels=config_data.get('audio', {}).get('channels', 1),
-                bit_depth=config_data.get('audio', {}).get('bit_depth', 16)
+                bit_depth=config_data.get('audio', {}).get('bit_depth', 16),
+                enable_vad=config_data.get('vad', {}).get('enabled', True),
+                vad_energy_threshold_db=config_data.get('vad', {}).get('energy_threshold_db', -40.0),
+                vad_min_energy_dbfs=config_data.get('vad', {}).get('min_energy_dbfs', -55.0),
+                vad_min_speech_ms=config_data.get('vad', {}).get('min_speech_ms', 200.0),
+                vad_padding_ms=config_data.get('vad', {}).get('padding_ms', 150.0),
+                asr_backend=config_data.get('asr', {}).get('backend', 'mock'),
+                asr_intra_op_threads=config_data.get('asr', {}).get('intra_op_threads', 4),
+                asr_pool_size=config_data.get('asr', {}).get('pool_size', 2),
+                asr_max_batch_size=config_data.get('asr', {}).get('max_batch_size', 4),
+                asr_batch_timeout_ms=config_data.get('asr', {}).get('batch_timeout_ms', 10.0),
+                asr_warmup=config_data.get('asr', {}).get('warmup', True),
+                llm_backend=config_data.get('llm', {}).get('backend', 'mock'),
+                llm_config_file=config_data.get('llm', {}).get('config_file', 'llm_config.yaml'),
+                llm_pool_size=config_data.get('llm', {}).get('pool_size', 2),
+                llm_max_inflight_per_connection=config_data.get('llm', {}).get('max_inflight_per_connection', 8),
+                llm_request_timeout=config_data.get('llm', {}).get('request_timeout', 30.0),
+                llm_acquire_timeout=config_data.get('llm', {}).get('acquire_timeout', 5.0),
+                llm_system_prompt=config_data.get('llm', {}).get('system_prompt', ServerConfig.llm_system_prompt),
+                enable_metrics=config_data.get('metrics', {}).get('enabled', False),
+                metrics_host=config_data.get('metrics', {}).get('host', '0.0.0.0'),
+                metrics_port=config_data.get('metrics', {}).get('port', 9100),
+                enable_tracing=config_data.get('tracing', {}).get('enabled', True),
+                trace_file=config_data.get('tracing', {}).get('file', './output/traces.jsonl'),
+                trace_sample_rate=config_data.get('tracing', {}).get('sample_rate', 0.1),
+                trace_slow_ms=config_data.get('tracing', {}).get('slow_ms', 2000.0),
+                log_file=config_data.get('logging', {}).get('file', 'sencevoice_server.log'),
+                log_json=config_data.get('logging', {}).get('json', True),
+                log_max_bytes=config_data.get('logging', {}).get('max_bytes', 10 * 1024 * 1024),
+                log_backup_count=config_data.get('logging', {}).get('backup_count', 5),
+                log_sample_message=config_data.get('logging', {}).get('sample_message', 10),
+                log_sample_ping=config_data.get('logging', {}).get('sample_ping', 100),
+                admin_token=config_data.get('admin', {}).get('token', ''),
+                profile_max_seconds=config_data.get('admin', {}).get('profile_max_seconds', 60.0),
+                session_backend=config_data.get('session', {}).get('backend', 'memory'),
+                session_scope=config_data.get('session', {}).get('scope', 'global'),
+                session_sqlite_path=config_data.get('session', {}).get('sqlite_path', './output/sessions.db'),
+                session_redis_url=config_data.get('session', {}).get('redis_url', 'redis://127.0.0.1:6379/0'),
+                session_cache_ttl=config_data.get('session', {}).get('cache_ttl', 0.5),
+                session_flush_interval=config_data.get('session', {}).get('flush_interval', 0.02),
+                session_ttl=config_data.get('session', {}).get('ttl', 86400.0)
             )
         except Exception as e:
             logger.warning(f"配置文件加载失败，使用默认配置: {e}")
@@ -576,7 +1297,11 @@ def create_default_config(config_file: str = "sencevoice_server_config.yaml"):
     default_config = {
         'server': {
             'host': '0.0.0.0',
-            'port': 8000
+            'port': 8000,
+            'max_inflight_requests': 4,
+            'codec': 'auto',
+            'workers': 1,
+            'drain_timeout': 30.0
         },
         'models': {
             'sencevoice_model_path': '/path/to/SenseVoice',
@@ -587,7 +1312,9 @@ def create_default_config(config_file: str = "sencevoice_server_config.yaml"):
             'enable_kws': True,
             'enable_sv': True,
             'kws_keyword': 'ni hao xiao qian',
-            'sv_threshold': 0.35
+            'sv_threshold': 0.35,
+            'sv_min_enroll_seconds': 3.0,
+            'enable_barge_in': True
         },
         'paths': {
             'sv_enroll_dir': './SpeakerVerification_DIR/enroll_wav/',
@@ -597,6 +1324,62 @@ def create_default_config(config_file: str = "sencevoice_server_config.yaml"):
             'sample_rate': 16000,
             'channels': 1,
             'bit_depth': 16
+        },
+        'vad': {
+            'enabled': True,
+            'energy_threshold_db': -40.0,
+            'min_energy_dbfs': -55.0,
+            'min_speech_ms': 200.0,
+            'padding_ms': 150.0
+        },
+        'asr': {
+            'backend': 'mock',
+            'intra_op_threads': 4,
+            'pool_size': 2,
+            'max_batch_size': 4,
+            'batch_timeout_ms': 10.0,
+            'warmup': True
+        },
+        'llm': {
+            'backend': 'mock',
+            'config_file': 'llm_config.yaml',
+            'pool_size': 2,
+            'max_inflight_per_connection': 8,
+            'request_timeout': 30.0,
+            'acquire_timeout': 5.0,
+            'system_prompt': ServerConfig.llm_system_prompt
+        },
+        'metrics': {
+            'enabled': False,
+            'host': '0.0.0.0',
+            'port': 9100
+        },
+        'tracing': {
+            'enabled': True,
+            'file': './output/traces.jsonl',
+            'sample_rate': 0.1,
+            'slow_ms': 2000.0
+        },
+        'logging': {
+            'file': 'sencevoice_server.log',
+            'json': True,
+            'max_bytes': 10 * 1024 * 1024,
+            'backup_count': 5,
+            'sample_message': 10,
+            'sample_ping': 100
+        },
+        'admin': {
+            'token': '',
+            'profile_max_seconds': 60.0
+        },
+        'session': {
+            'backend': 'memory',
+            'scope': 'global',
+            'sqlite_path': './output/sessions.db',
+            'redis_url': 'redis://127.0.0.1:6379/0',
+            'cache_ttl': 0.5,
+            'flush_interval': 0.02,
+            'ttl': 86400.0
         }
     }
     
@@ -612,6 +1395,10 @@ def main():
     parser.add_argument('--port', type=int, default=None, help='监听端口')
     parser.add_argument('--config', default='sencevoice_server_config.yaml', help='配置文件路径')
     parser.add_argument('--create-config', action='store_true', help='创建默认配置文件')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数，覆盖配置文件中的server.workers')
+    # 以下由监督进程传给工作进程
+    parser.add_argument('--worker-index', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-metrics-port', type=int, default=None, help=argparse.SUPPRESS)
     
     args = parser.parse_args()
     
@@ -619,7 +1406,8 @@ def main():
         create_default_config(args.config)
         return
     
-    print("""
+    if args.worker_index is None:
+        print("""
 ╔══════════════════════════════════════════════════════════════╗
 ║                  SenceVoice WebSocket 服务器                 ║
 ║                                                              ║
@@ -636,6 +1424,17 @@ def main():
     
     # 加载配置
     config = load_config(args.config)
+    if args.workers:
+        config.workers = args.workers
+    
+    # 日志：事件循环只入队，格式化和写文件在后台线程
+    log_listener = setup_logging(
+        per_worker_path(config.log_file, args.worker_index),
+        json_format=config.log_json,
+        max_bytes=config.log_max_bytes,
+        backup_count=config.log_backup_count,
+        sample_rates={CATEGORY_MESSAGE: config.log_sample_message, CATEGORY_PING: config.log_sample_ping}
+    )
     
     # 命令行参数覆盖配置文件
     if args.host:
@@ -643,12 +1442,41 @@ def main():
     if args.port:
         config.port = args.port
     
+    if config.workers > 1 and args.worker_index is None:
+        if config.session_backend == "memory":
+            logger.warning("⚠️ session.backend为memory，唤醒和声纹状态不在工作进程间共享，建议使用sqlite或redis")
+        # 监督进程不加载模型，只启动和看管工作进程
+        supervisor = WorkerSupervisor(
+            "SenceVoice WebSocket服务器",
+            lambda index, metrics_port: [sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                                         '--worker-index', str(index), '--worker-metrics-port', str(metrics_port)],
+            config.workers,
+            namespace="sencevoice",
+            metrics_host=config.metrics_host,
+            metrics_port=config.metrics_port if config.enable_metrics else None,
+            drain_timeout=config.drain_timeout
+        )
+        try:
+            run_supervisor(supervisor)
+        finally:
+            log_listener.stop()
+        return
+    
+    if args.worker_index is not None:
+        # 工作进程的指标只在本机内部端口提供，由监督进程汇总
+        config.enable_metrics = True
+        config.metrics_host = "127.0.0.1"
+        config.metrics_port = args.worker_metrics_port
+        config.trace_file = per_worker_path(config.trace_file, args.worker_index)
+    
     server = SenceVoiceServer(config)
     
     try:
         asyncio.run(server.start_server())
     except KeyboardInterrupt:
         print("\n👋 再见！")
+    finally:
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Prometheus格式的服务器指标
+热路径上只做计数加一和直方图分桶，连接数、在途请求等状态在抓取时通过回调读取；
+可选的HTTP监听在独立端口上提供 GET /metrics
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+
+import websockets
+
+from latency_histogram import DEFAULT_BOUNDS_MS, LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class ServerMetrics:
+    """单个服务进程的指标集合，所有指标名带namespace前缀"""
+
+    def __init__(self, namespace: str, bounds_ms=DEFAULT_BOUNDS_MS):
+        self.namespace = namespace
+        self.bounds_ms = tuple(bounds_ms)
+        self.started_at = time.time()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, LatencyHistogram]] = {}
+        self._gauges: List[Tuple[str, Labels, Callable[[], float]]] = []
+
+        self.gauge("uptime_seconds", "进程运行时间", lambda: time.time() - self.started_at)
+        # 压测工具按抓取前后的差值计算每个请求消耗的服务器CPU
+        self.gauge("process_cpu_seconds", "进程累计CPU时间(用户态+内核态)", time.process_time)
+
+    def _declare(self, name: str, kind: str, help_text: str):
+        self._help.setdefault(name, (kind, help_text))
+
+    def inc(self, name: str, value: float = 1, help_text: str = "", **labels):
+        """计数器加value"""
+        self._declare(name, "counter", help_text)
+        series = self._counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, help_text: str = "", **labels):
+        """向直方图记录一次以秒为单位的耗时"""
+        self._declare(name, "histogram", help_text)
+        series = self._histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = LatencyHistogram(self.bounds_ms)
+        histogram.record(seconds)
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float], **labels):
+        """登记一个抓取时才计算的瞬时值"""
+        self._declare(name, "gauge", help_text)
+        self._gauges.append((name, tuple(sorted(labels.items())), func))
+
+    def histogram_summary(self, name: str) -> Dict[str, Dict]:
+        """某个直方图各标签组合的百分位摘要，用于状态查询"""
+        return {",".join(f"{k}={v}" for k, v in labels) or "all": histogram.summary()
+                for labels, histogram in self._histograms.get(name, {}).items()}
+
+    def render(self) -> str:
+        """生成Prometheus文本格式(0.0.4)"""
+        lines = []
+        prefix = self.namespace + "_"
+
+        def header(name: str):
+            kind, help_text = self._help[name]
+            lines.append(f"# HELP {prefix}{name} {help_text or name}")
+            lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        for name, series in self._counters.items():
+            header(name)
+            for labels, value in series.items():
+                lines.append(f"{prefix}{name}{_format_labels(labels)} {value:g}")
+
+        gauge_names = []
+        for name, _, _ in self._gauges:
+            if name not in gauge_names:
+                gauge_names.append(name)
+        for name in gauge_names:
+            header(name)
+            for gauge_name, labels, func in self._gauges:
+                if gauge_name != name:
+                    continue
+                try:
+                    value = float(func())
+                except Exception as e:
+                    logger.debug(f"指标 {name} 读取失败: {e}")
+                    continue
+                lines.append(f"{prefix}{name}{_format_labels(labels)} {value:g}")
+
+        for name, series in self._histograms.items():
+            header(name)
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    cumulative += count
+                    le = f'le="{bound / 1000:g}"'
+                    lines.append(f"{prefix}{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                inf = 'le="+Inf"'
+                lines.append(f"{prefix}{name}_bucket{_format_labels(labels, inf)} {histogram.count}")
+                lines.append(f"{prefix}{name}_sum{_format_labels(labels)} {histogram.total_ms / 1000:g}")
+                lines.append(f"{prefix}{name}_count{_format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def metered_protocol(metrics: ServerMetrics, base=websockets.WebSocketServerProtocol):
+    """
+    返回统计收发字节数的WebSocket协议类，作为websockets.serve的create_protocol参数
+    接收按线上原始字节计，发送按帧负载计
+    """
+
+    class MeteredProtocol(base):
+        def data_received(self, data: bytes):
+            metrics.inc("received_bytes_total", len(data), "接收的字节数")
+            super().data_received(data)
+
+        def write_frame_sync(self, fin: bool, opcode: int, data: bytes):
+            metrics.inc("sent_bytes_total", len(data), "发送的帧负载字节数")
+            super().write_frame_sync(fin, opcode, data)
+
+    return MeteredProtocol
+
+
+async def start_metrics_server(metrics: ServerMetrics, host: str, port: int) -> asyncio.AbstractServer:
+    """
+    在独立端口上启动只提供 GET /metrics 的HTTP监听
+    metrics的render()也可以是协程(多进程时监督进程需要先抓取各工作进程)
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # 读完请求头
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                body = metrics.render()
+                if asyncio.iscoroutine(body):
+                    body = await body
+                status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", "not found\n"
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"📈 指标端点已启动: http://{host}:{port}/metrics")
+    return server
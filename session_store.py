@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+会话状态存储
+唤醒状态、声纹注册状态等按会话保存在可替换的后端中，多工作进程或多台机器部署时，
+重连到其他进程的客户端仍能读到原来的状态：
+- memory: 进程内字典(默认)，只适合单进程
+- sqlite: 本机SQLite数据库(WAL模式)，同一台机器上的工作进程共享
+- redis: Redis协议，多台机器共享；没有Redis时可用 python session_store.py --serve 启动本地替代服务
+
+读写都经过本地缓存：缓存命中时不访问后端；同一轮事件循环中的未命中合并为一次批量读取；
+写入立即更新缓存，再按flush_interval合并为一次批量写入
+
+运行 python session_store.py 测试各后端的读取延迟
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+Fields = Dict[str, Any]
+
+
+class SessionStoreError(Exception):
+    """后端读写失败"""
+
+
+class MemoryBackend:
+    """进程内字典，不在进程间共享"""
+
+    name = "memory"
+    shared = False
+
+    def __init__(self):
+        self.data: Dict[str, Tuple[Fields, float]] = {}
+
+    async def load(self, keys: List[str]) -> Dict[str, Fields]:
+        now = time.time()
+        result = {}
+        for key in keys:
+            entry = self.data.get(key)
+            if entry is not None and entry[1] > now:
+                result[key] = dict(entry[0])
+        return result
+
+    async def store(self, updates: Dict[str, Fields], ttl: float):
+        expires_at = time.time() + ttl
+        for key, fields in updates.items():
+            entry = self.data.get(key)
+            merged = dict(entry[0]) if entry is not None and entry[1] > time.time() else {}
+            merged.update(fields)
+            self.data[key] = (merged, expires_at)
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    本机SQLite数据库，每个(会话, 字段)一行；WAL模式下读不阻塞写，
+    读写在线程中执行，批量写入在一个事务内完成
+    """
+
+    name = "sqlite"
+    shared = True
+    PURGE_INTERVAL = 60.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_state ("
+                "key TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (key, field))"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _load(self, keys: List[str]) -> Dict[str, Fields]:
+        result: Dict[str, Fields] = {}
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            # 分批避免超过SQLite的参数个数限制
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, field, value FROM session_state "
+                    f"WHERE key IN ({','.join('?' * len(chunk))}) AND expires_at > ?",
+                    (*chunk, now)
+                ).fetchall()
+                for key, field, value in rows:
+                    result.setdefault(key, {})[field] = json.loads(value)
+        return result
+
+    def _store(self, updates: Dict[str, Fields], ttl: float):
+        now = time.time()
+        expires_at = now + ttl
+        rows = [(key, field, json.dumps(value), expires_at)
+                for key, fields in updates.items() for field, value in fields.items()]
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO session_state (key, field, value, expires_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key, field) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                    rows
+                )
+                # 过期时间按会话整体续期
+                conn.executemany("UPDATE session_state SET expires_at = ? WHERE key = ?",
+                                 [(expires_at, key) for key in updates])
+                if now - self._last_purge > self.PURGE_INTERVAL:
+                    conn.execute("DELETE FROM session_state WHERE expires_at <= ?", (now,))
+                    self._last_purge = now
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    async def load(self, keys: List[str]) -> Dict[str, Fields]:
+        try:
+            return await asyncio.to_thread(self._load, keys)
+        except sqlite3.Error as e:
+            raise SessionStoreError(f"SQLite读取失败: {e}") from e
+
+    async def store(self, updates: Dict[str, Fields], ttl: float):
+        try:
+            await asyncio.to_thread(self._store, updates, ttl)
+        except sqlite3.Error as e:
+            raise SessionStoreError(f"SQLite写入失败: {e}") from e
+
+    async def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def encode_command(args: List[Any]) -> bytes:
+    """编码为RESP数组"""
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+    return b"".join(parts)
+
+
+class RespError(Exception):
+    """服务端返回的错误回复"""
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """读取一个RESP2回复；错误回复返回RespError实例而不抛出，便于流水线中逐个检查"""
+    line = await reader.readuntil(b"\r\n")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode("utf-8")
+    if prefix == b"-":
+        return RespError(body.decode("utf-8"))
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if prefix == b"*":
+        count = int(body)
+        if count < 0:
+            return None
+        return [await read_reply(reader) for _ in range(count)]
+    raise SessionStoreError(f"无法解析的RESP回复: {line[:32]!r}")
+
+
+class RespClient:
+    """最小的Redis协议客户端：单连接，一次往返发送一批命令，断线后自动重连一次"""
+
+    def __init__(self, host: str, port: int, password: Optional[str] = None, db: int = 0, timeout: float = 2.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        setup = []
+        if self.password:
+            setup.append(["AUTH", self.password])
+        if self.db:
+            setup.append(["SELECT", self.db])
+        if setup:
+            await self._roundtrip(setup)
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _roundtrip(self, commands: List[List[Any]]) -> List[Any]:
+        self._writer.write(b"".join(encode_command(command) for command in commands))
+        await self._writer.drain()
+        replies = [await asyncio.wait_for(read_reply(self._reader), self.timeout) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise SessionStoreError(f"Redis错误: {reply}")
+        return replies
+
+    async def execute_many(self, commands: List[List[Any]]) -> List[Any]:
+        """流水线执行一批命令，返回各自的回复"""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._roundtrip(commands)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    self._disconnect()
+                    if attempt:
+                        raise SessionStoreError(f"Redis连接失败 {self.host}:{self.port}: {e}") from e
+
+    async def close(self):
+        async with self._lock:
+            self._disconnect()
+
+
+class RedisBackend:
+    """Redis协议后端，每个会话为一个hash，写入时整体续期"""
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str, key_prefix: str = "lingjing:session:"):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"不支持的Redis地址: {url}")
+        db = int(parsed.path.lstrip("/") or 0)
+        self.client = RespClient(parsed.hostname or "127.0.0.1", parsed.port or 6379, parsed.password, db)
+        self.key_prefix = key_prefix
+
+    async def load(self, keys: List[str]) -> Dict[str, Fields]:
+        replies = await self.client.execute_many([["HGETALL", self.key_prefix + key] for key in keys])
+        result = {}
+        for key, reply in zip(keys, replies):
+            if reply:
+                result[key] = {reply[i].decode("utf-8"): json.loads(reply[i + 1]) for i in range(0, len(reply), 2)}
+        return result
+
+    async def store(self, updates: Dict[str, Fields], ttl: float):
+        commands = []
+        for key, fields in updates.items():
+            command = ["HSET", self.key_prefix + key]
+            for field, value in fields.items():
+                command += [field, json.dumps(value)]
+            commands.append(command)
+            commands.append(["EXPIRE", self.key_prefix + key, max(1, int(ttl))])
+        await self.client.execute_many(commands)
+
+    async def close(self):
+        await self.client.close()
+
+
+def create_backend(kind: str, sqlite_path: str = "./output/sessions.db", redis_url: str = "redis://127.0.0.1:6379/0"):
+    """按名称创建后端: memory | sqlite | redis"""
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return SQLiteBackend(sqlite_path)
+    if kind == "redis":
+        return RedisBackend(redis_url)
+    raise ValueError(f"未知的会话存储后端: {kind}")
+
+
+class SessionStore:
+    """
+    带本地缓存的会话状态
+
+    Args:
+        backend: 存储后端
+        cache_ttl: 共享后端时缓存的有效期(秒)，也是其他进程的修改最迟多久可见；进程内后端的缓存不过期
+        flush_interval: 写入合并的时间窗口(秒)
+        ttl: 会话在后端保留的时间(秒)，每次写入续期
+        max_cache_entries: 本地缓存的最大会话数
+    """
+
+    def __init__(self, backend, cache_ttl: float = 0.5, flush_interval: float = 0.02, ttl: float = 86400.0,
+                 max_cache_entries: int = 10000):
+        self.backend = backend
+        self.cache_ttl = cache_ttl if backend.shared else None
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.max_cache_entries = max_cache_entries
+        # key -> (字段, 读取时间)，读取时间为None表示只有本地写入过的部分字段
+        self._cache: Dict[str, Tuple[Fields, Optional[float]]] = {}
+        # 尚未写入后端的修改，以及正在写入的修改
+        self._dirty: Dict[str, Fields] = {}
+        self._flushing: Dict[str, Fields] = {}
+        self._pending_reads: Dict[str, asyncio.Future] = {}
+        self._read_scheduled = False
+        self._tasks = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.stats = {"hits": 0, "misses": 0, "batch_reads": 0, "batch_writes": 0, "written_keys": 0, "errors": 0}
+
+    async def get(self, key: str) -> Fields:
+        """读取会话的全部字段，不存在时为空字典"""
+        entry = self._cache.get(key)
+        if entry is not None and entry[1] is not None and (
+                self.cache_ttl is None or time.monotonic() - entry[1] < self.cache_ttl):
+            self.stats["hits"] += 1
+            return dict(entry[0])
+
+        self.stats["misses"] += 1
+        future = self._pending_reads.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending_reads[key] = loop.create_future()
+            if not self._read_scheduled:
+                # 本轮事件循环中其他请求的未命中会合并到同一次读取
+                self._read_scheduled = True
+                loop.call_soon(self._start_read)
+        return dict(await asyncio.shield(future))
+
+    def _start_read(self):
+        self._read_scheduled = False
+        pending, self._pending_reads = self._pending_reads, {}
+        task = asyncio.ensure_future(self._read(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _read(self, pending: Dict[str, asyncio.Future]):
+        self.stats["batch_reads"] += 1
+        try:
+            loaded = await self.backend.load(list(pending))
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"⚠️ 会话状态读取失败，使用本地缓存: {e}")
+            loaded = None
+
+        now = time.monotonic()
+        for key, future in pending.items():
+            if loaded is None:
+                entry = self._cache.get(key)
+                fields = dict(entry[0]) if entry is not None else {}
+            else:
+                fields = loaded.get(key, {})
+                # 本进程尚未写入后端的修改优先
+                fields.update(self._flushing.get(key, {}))
+                fields.update(self._dirty.get(key, {}))
+                self._cache_put(key, fields, now)
+            if not future.done():
+                future.set_result(fields)
+
+    def _cache_put(self, key: str, fields: Fields, loaded_at: Optional[float]):
+        if key not in self._cache and len(self._cache) >= self.max_cache_entries:
+            # 淘汰最早放入的一半，尚未写入的会话保留
+            for old_key in list(self._cache)[:len(self._cache) // 2]:
+                if old_key not in self._dirty:
+                    del self._cache[old_key]
+        self._cache[key] = (fields, loaded_at)
+
+    def update(self, key: str, **fields):
+        """修改会话字段：立即更新本地缓存，由后台合并写入后端"""
+        entry = self._cache.get(key)
+        if entry is not None:
+            entry[0].update(fields)
+        else:
+            self._cache_put(key, dict(fields), None)
+        self._dirty.setdefault(key, {}).update(fields)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later(self.flush_interval))
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """把积累的修改一次写入后端，失败时保留修改稍后重试"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            updates, self._dirty = self._dirty, {}
+            self._flushing = updates
+            try:
+                await self.backend.store(updates, self.ttl)
+                self.stats["batch_writes"] += 1
+                self.stats["written_keys"] += len(updates)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"⚠️ 会话状态写入失败，1秒后重试: {e}")
+                for key, fields in updates.items():
+                    fields.update(self._dirty.get(key, {}))
+                    self._dirty[key] = fields
+                if self._flush_task is None:
+                    self._flush_task = asyncio.ensure_future(self._flush_later(1.0))
+            finally:
+                self._flushing = {}
+
+    async def close(self):
+        """写完未提交的修改并关闭后端"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self.backend.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "backend": self.backend.name,
+            "cache_entries": len(self._cache),
+            "pending_writes": len(self._dirty),
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            **self.stats
+        }
+
+
+class RespStandIn:
+    """
+    Redis协议的本地替代服务，只实现会话存储用到的命令
+    (PING, AUTH, SELECT, HSET, HGETALL, DEL, EXPIRE, QUIT)，数据只保存在内存中，用于开发和单机多进程测试
+    """
+
+    def __init__(self):
+        self.data: Dict[bytes, Dict[bytes, bytes]] = {}
+        self.expires: Dict[bytes, float] = {}
+
+    def _hash(self, key: bytes) -> Optional[Dict[bytes, bytes]]:
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def execute(self, args: List[bytes]) -> bytes:
+        command = args[0].upper() if args else b""
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command in (b"AUTH", b"SELECT", b"QUIT"):
+            return b"+OK\r\n"
+        if command == b"HSET" and len(args) >= 4 and len(args) % 2 == 0:
+            current = self._hash(args[1])
+            if current is None:
+                current = self.data[args[1]] = {}
+            added = 0
+            for i in range(2, len(args), 2):
+                added += args[i] not in current
+                current[args[i]] = args[i + 1]
+            return f":{added}\r\n".encode()
+        if command == b"HGETALL" and len(args) == 2:
+            current = self._hash(args[1]) or {}
+            return encode_command([item for pair in current.items() for item in pair])
+        if command == b"DEL" and len(args) >= 2:
+            removed = 0
+            for key in args[1:]:
+                removed += self._hash(key) is not None
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return f":{removed}\r\n".encode()
+        if command == b"EXPIRE" and len(args) == 3:
+            if self._hash(args[1]) is None:
+                return b":0\r\n"
+            self.expires[args[1]] = time.time() + int(args[2])
+            return b":1\r\n"
+        return f"-ERR unknown or malformed command '{command.decode('utf-8', 'replace')}'\r\n".encode()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                args = await read_reply(reader)
+                if not isinstance(args, list):
+                    writer.write(b"-ERR only RESP arrays are supported\r\n")
+                    break
+                writer.write(self.execute(args))
+                if args and args[0].upper() == b"QUIT":
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, SessionStoreError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 6379) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"🗄️ Redis协议替代服务已启动: redis://{host}:{port}/0")
+        return server
+
+
+async def _benchmark(rounds: int = 2000, batch: int = 100):
+    import socket
+    import tempfile
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    stand_in = await RespStandIn().serve("127.0.0.1", port)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "memory": MemoryBackend(),
+            "sqlite": SQLiteBackend(os.path.join(tmp, "sessions.db")),
+            "redis(stand-in)": RedisBackend(f"redis://127.0.0.1:{port}/0")
+        }
+        for label, backend in backends.items():
+            store = SessionStore(backend, cache_ttl=60.0)
+            await backend.store({f"user{i}": {"kws_activated": True, "sv_enrolled": False}
+                                 for i in range(rounds)}, 600)
+
+            # 未命中：逐个读取(每次一个后端往返)
+            start = time.perf_counter()
+            for i in range(200):
+                await store.get(f"user{i}")
+            miss_us = (time.perf_counter() - start) / 200 * 1e6
+
+            # 未命中：同一轮事件循环中的并发读取合并为一次批量读取
+            start = time.perf_counter()
+            await asyncio.gather(*(store.get(f"user{i}") for i in range(1000, 1000 + batch)))
+            batched_us = (time.perf_counter() - start) / batch * 1e6
+
+            # 命中缓存
+            start = time.perf_counter()
+            for _ in range(rounds):
+                await store.get("user0")
+            hit_us = (time.perf_counter() - start) / rounds * 1e6
+
+            # 写入：更新本地缓存后合并写入
+            start = time.perf_counter()
+            for i in range(rounds):
+                store.update(f"user{i % 50}", kws_activated=bool(i % 2))
+            update_us = (time.perf_counter() - start) / rounds * 1e6
+            await store.close()
+            results[label] = {"hit_us": hit_us, "miss_us": miss_us, "batched_miss_us": batched_us,
+                              "update_us": update_us, "batch_writes": store.stats["batch_writes"]}
+    # 让替代服务的连接处理协程读到连接关闭后再退出事件循环
+    await asyncio.sleep(0.05)
+    stand_in.close()
+
+    print(f"{'后端':<18} {'命中(us)':>10} {'未命中(us)':>12} {'批量未命中(us/个)':>18} {'写入(us)':>10} {'批量写次数':>10}")
+    for label, stats in results.items():
+        print(f"{label:<18} {stats['hit_us']:>10.2f} {stats['miss_us']:>12.1f} {stats['batched_miss_us']:>18.1f} "
+              f"{stats['update_us']:>10.2f} {stats['batch_writes']:>10}")
+    return results
+
+
+def benchmark():
+    """各后端缓存命中、未命中、批量未命中和写入的单次耗时"""
+    return asyncio.run(_benchmark())
+
+
+async def _serve_forever(host: str, port: int):
+    await RespStandIn().serve(host, port)
+    await asyncio.Future()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="会话状态存储")
+    parser.add_argument("--serve", action="store_true", help="启动Redis协议的本地替代服务，不指定则运行基准测试")
+    parser.add_argument("--host", default="127.0.0.1", help="替代服务监听地址 (默认: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=6379, help="替代服务端口 (默认: 6379)")
+    args = parser.parse_args()
+
+    if args.serve:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        try:
+            asyncio.run(_serve_forever(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        benchmark()
@@ -285,7 +285,24 @@ class DigitalHumanService {
           } else {
             // 发送语音识别和对话请求
             console.log('发送语音请求到SenceVoice...')
-            const voiceResult = await senceVoiceService.sendVoiceRequest(audioUri)
+            let replyText = ''
+            const voiceResult = await senceVoiceService.sendVoiceRequest(audioUri, {
+              progressive: true,
+              onEvent: (stage, eventData) => {
+                // 识别结果和回复文本先行展示，音频就绪后数字人开始说话
+                if (stage === 'asr_result') {
+                  this.notifyMessage('user', eventData.asr_result)
+                } else if (stage === 'llm_text') {
+                  replyText = eventData.llm_response
+                  this.notifyMessage('assistant', replyText)
+                } else if (stage === 'audio_ready') {
+                  this.notifyStatusChange('speaking')
+                  setTimeout(() => {
+                    this.notifyStatusChange('idle')
+                  }, this.estimateSpeechDuration(replyText))
+                }
+              }
+            })
             console.log('SenceVoice响应:', voiceResult)
             // 语音响应会通过回调处理
           }
@@ -34,6 +34,7 @@ class SenceVoiceService {
       onError: null,
       onStatusUpdate: null,
       onVoiceResponse: null,
+      onVoiceEvent: null,
       onEnrollmentResponse: null
     }
     
@@ -146,6 +147,22 @@ class SenceVoiceService {
     
     const { type, requestId } = data
     
+    // 阶段性事件不结束请求，最终仍会收到voice_response
+    if (type === 'voice_event') {
+      this.handleVoiceEvent(data)
+      return
+    }
+    
+    // 被同一会话的新语音打断，正常结束请求而不是报错，避免触发降级处理
+    if (type === 'superseded') {
+      console.log(`✋ 语音请求 ${requestId} 已被 ${data.data.superseded_by} 打断`)
+      if (this.pendingRequests.has(requestId)) {
+        this.pendingRequests.get(requestId).resolve(data)
+        this.pendingRequests.delete(requestId)
+      }
+      return
+    }
+    
     // 处理有requestId的响应
     if (requestId && this.pendingRequests.has(requestId)) {
       const { resolve, reject } = this.pendingRequests.get(requestId)
@@ -217,6 +234,28 @@ class SenceVoiceService {
     }
   }
   
+  /**
+   * 处理语音请求的阶段性事件 (asr_result / llm_text / audio_ready)
+   */
+  handleVoiceEvent(data) {
+    const { requestId, stage, elapsed_ms: elapsedMs } = data
+    console.log(`⏱️ 语音阶段事件: ${stage} (${elapsedMs}ms)`)
+    
+    const pending = this.pendingRequests.get(requestId)
+    if (pending && pending.onEvent) {
+      pending.onEvent(stage, data.data, data)
+    }
+    
+    if (this.callbacks.onVoiceEvent) {
+      this.callbacks.onVoiceEvent(stage, data.data, data)
+    }
+    
+    // 音频就绪后立即播放，不等待最终响应
+    if (stage === 'audio_ready' && data.data.audio_response) {
+      this.playTTSAudio(data.data.audio_response)
+    }
+  }
+  
   /**
    * 处理声纹注册响应
    */
@@ -273,15 +312,17 @@ class SenceVoiceService {
         timestamp: Date.now(),
         data: {
           audio_data: audioData,
-          audio_format: options.format || 'wav',
+          audio_format: options.format || this.inferAudioFormat(audioUri),
           sample_rate: options.sampleRate || 16000,
           channels: options.channels || 1,
-          bit_depth: options.bitDepth || 16
+          bit_depth: options.bitDepth || 16,
+          // 开启后服务器在ASR/LLM/TTS各阶段完成时推送voice_event
+          progressive: !!options.progressive
         }
       }
       
       return new Promise((resolve, reject) => {
-        this.pendingRequests.set(requestId, { resolve, reject })
+        this.pendingRequests.set(requestId, { resolve, reject, onEvent: options.onEvent })
         
         // 设置超时
         setTimeout(() => {
@@ -314,7 +355,7 @@ class SenceVoiceService {
         timestamp: Date.now(),
         data: {
           audio_data: audioData,
-          audio_format: options.format || 'wav',
+          audio_format: options.format || this.inferAudioFormat(audioUri),
           sample_rate: options.sampleRate || 16000,
           channels: options.channels || 1,
           bit_depth: options.bitDepth || 16
@@ -418,6 +459,14 @@ class SenceVoiceService {
     }
   }
   
+  /**
+   * 根据录音文件扩展名推断音频格式（默认录音预设在iOS/Android上生成m4a）
+   */
+  inferAudioFormat(audioUri) {
+    const match = /\.([a-z0-9]+)(?:\?.*)?$/i.exec(audioUri || '')
+    return match ? match[1].toLowerCase() : 'wav'
+  }
+  
   /**
    * 准备音频数据（转换为base64）
    */
@@ -10,7 +10,7 @@ import yaml
 
 def check_dependencies():
     """检查Python依赖"""
-    required_packages = ['websockets', 'pyyaml']
+    required_packages = ['websockets', 'pyyaml', 'numpy']
     missing_packages = []
     
     for package in required_packages:
@@ -57,17 +57,22 @@ def main():
         print(f"🎤 关键词唤醒: {'启用' if features_config.get('enable_kws', True) else '禁用'}")
         print(f"🔐 声纹识别: {'启用' if features_config.get('enable_sv', True) else '禁用'}")
         print(f"🔑 唤醒词: {features_config.get('kws_keyword', 'ni hao xiao qian')}")
+        print(f"👷 工作进程数: {server_config.get('workers', 1)}")
         print("="*50)
     except Exception as e:
         print(f"⚠️ 读取配置文件失败: {e}")
     
-    # 启动服务器
+    # 启动服务器，其余命令行参数(如 --workers 4)原样传给服务器
+    process = subprocess.Popen([sys.executable, "sencevoice_websocket_server.py", *sys.argv[1:]])
     try:
-        subprocess.run([sys.executable, "sencevoice_websocket_server.py"], check=True)
+        returncode = process.wait()
     except KeyboardInterrupt:
+        # 服务器同样收到了Ctrl+C，等它处理完在途请求后退出
+        process.wait()
         print("\n👋 服务器已停止")
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ 服务器启动失败: {e}")
+        return
+    if returncode != 0:
+        print(f"\n❌ 服务器启动失败: 退出码 {returncode}")
         sys.exit(1)
 
 if __name__ == "__main__":
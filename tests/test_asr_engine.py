@@ -0,0 +1,170 @@
+"""asr_engine测试：使用build_synthetic_model生成的小型ONNX模型，无需真实模型权重"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from asr_engine import ASREngineConfig, OnnxASREngine, build_synthetic_model
+
+FEATURE_DIM = 560
+VOCAB_SIZE = 32
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("synthetic_asr")
+    build_synthetic_model(str(path), feature_dim=FEATURE_DIM, vocab_size=VOCAB_SIZE)
+    return str(path)
+
+
+def make_engine(model_dir, **kwargs):
+    engine = OnnxASREngine(ASREngineConfig(model_path=model_dir, **kwargs))
+    engine.load()
+    return engine
+
+
+def make_features(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((frames, FEATURE_DIM)).astype(np.float32)
+
+
+def test_transcribe_returns_text_decoded_from_model_logits(model_dir):
+    engine = make_engine(model_dir, max_batch_size=1, pool_size=1)
+    features = make_features(50)
+
+    async def run():
+        feeds = {
+            "x": features[None],
+            "x_length": np.array([50], dtype=np.int32),
+            "language": np.zeros(1, dtype=np.int32),
+            "text_norm": np.full(1, 15, dtype=np.int32),
+        }
+        logits = (await engine.pool.run(feeds))[0]
+        return logits, await engine.transcribe(features)
+
+    try:
+        logits, text = asyncio.run(run())
+    finally:
+        engine.close()
+
+    assert logits.shape == (1, 50, VOCAB_SIZE)
+    assert isinstance(text, str) and text
+    assert text == engine.ctc_greedy_decode(logits, np.array([50]))[0]
+    assert set(text) <= set(engine.tokens[1:])
+    assert engine.get_stats()["requests"] == 1
+
+
+def test_batched_matches_unbatched(model_dir):
+    features = [make_features(frames, seed) for seed, frames in enumerate((20, 75, 40, 63))]
+
+    async def unbatched():
+        engine = make_engine(model_dir, max_batch_size=1, pool_size=1)
+        try:
+            return [await engine.transcribe(f) for f in features], engine.get_stats()
+        finally:
+            engine.close()
+
+    async def batched():
+        engine = make_engine(model_dir, max_batch_size=4, batch_timeout_ms=50, pool_size=1)
+        try:
+            texts = await asyncio.gather(*(engine.transcribe(f) for f in features))
+            return list(texts), engine.get_stats()
+        finally:
+            engine.close()
+
+    expected, single_stats = asyncio.run(unbatched())
+    texts, batch_stats = asyncio.run(batched())
+
+    assert texts == expected
+    assert single_stats["batches"] == len(features)
+    assert batch_stats["batches"] < len(features)
+    assert batch_stats["batched_requests"] == len(features)
+
+
+def test_session_pool_checkout_under_concurrency(model_dir):
+    engine = make_engine(model_dir, pool_size=2, intra_op_threads=2)
+    pool = engine.pool
+    lock = threading.Lock()
+    active = {"now": 0, "max": 0}
+    used = set()
+
+    class TrackedSession:
+        """记录同时使用的会话数，并拉长推理时间让请求重叠"""
+
+        def __init__(self, session):
+            self.session = session
+
+        def run(self, outputs, feeds):
+            with lock:
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+                used.add(id(self))
+            try:
+                time.sleep(0.02)
+                return self.session.run(outputs, feeds)
+            finally:
+                with lock:
+                    active["now"] -= 1
+
+    while not pool._idle.empty():
+        pool._idle.get_nowait()
+    for session in pool.sessions:
+        pool._idle.put_nowait(TrackedSession(session))
+
+    feeds = {
+        "x": make_features(10)[None],
+        "x_length": np.array([10], dtype=np.int32),
+        "language": np.zeros(1, dtype=np.int32),
+        "text_norm": np.full(1, 15, dtype=np.int32),
+    }
+
+    async def run():
+        busy = []
+
+        async def one():
+            task = asyncio.ensure_future(pool.run(feeds))
+            await asyncio.sleep(0)
+            busy.append(pool.busy)
+            return await task
+
+        outputs = await asyncio.gather(*(one() for _ in range(8)))
+        return outputs, busy
+
+    try:
+        outputs, busy = asyncio.run(run())
+    finally:
+        engine.close()
+
+    assert len(outputs) == 8
+    assert all(out[0].shape == (1, 10, VOCAB_SIZE) for out in outputs)
+    assert active["max"] == 2
+    assert len(used) == 2
+    assert max(busy) <= pool.pool_size
+    assert pool.busy == 0
+    assert pool.stats["runs"] == 8
+    assert pool.stats["max_wait_seconds"] > 0
+
+
+def test_ctc_greedy_decode_collapses_repeats_and_drops_blanks():
+    engine = OnnxASREngine(ASREngineConfig(model_path="unused"))
+    engine.tokens = ["<blk>", "a", "b", "<|zh|>", "▁c"]
+
+    def one_hot(ids):
+        logits = np.zeros((len(ids), len(engine.tokens)), dtype=np.float32)
+        logits[np.arange(len(ids)), ids] = 1.0
+        return logits
+
+    logits = np.stack([
+        one_hot([1, 1, 0, 1, 2, 2, 3, 4]),
+        one_hot([0, 2, 0, 0, 2, 1, 1, 1]),
+    ])
+    texts = engine.ctc_greedy_decode(logits, np.array([8, 5]))
+
+    # 相邻重复合并，blank分隔的重复保留；特殊标记去掉，▁转为空格；超出长度的帧忽略
+    assert texts == ["aab c", "bb"]
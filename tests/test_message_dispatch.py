@@ -0,0 +1,39 @@
+"""message_dispatch测试：有序消息在排队任务被取消后仍按到达顺序执行"""
+
+import asyncio
+
+from message_dispatch import ConnectionDispatcher
+
+ORDERED = ("voice_request", "sv_enroll_request")
+
+
+def test_cancelled_queued_task_keeps_order_chain():
+    events = []
+
+    async def on_error(error, request_id):
+        events.append(("error", request_id, error))
+
+    def handler(name, seconds):
+        async def run():
+            events.append(("start", name))
+            await asyncio.sleep(seconds)
+            events.append(("end", name))
+        return run
+
+    async def run():
+        dispatcher = ConnectionDispatcher(on_error, max_inflight=4, ordered_types=ORDERED)
+        enroll = await dispatcher.dispatch("sv_enroll_request", "enroll", handler("enroll", 0.1))
+        first = await dispatcher.dispatch("voice_request", "voice1", handler("voice1", 0.01))
+        await asyncio.sleep(0.01)
+        # 新语音打断排队中的上一条语音
+        second = await dispatcher.dispatch("voice_request", "voice2", handler("voice2", 0.01))
+        assert dispatcher.cancel("voice1")
+        await asyncio.gather(enroll, first, second, return_exceptions=True)
+        return first
+
+    first = asyncio.run(run())
+
+    assert first.cancelled()
+    assert ("start", "voice1") not in events
+    assert events == [("start", "enroll"), ("end", "enroll"), ("start", "voice2"), ("end", "voice2")]
+
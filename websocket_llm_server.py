@@ -17,22 +17,23 @@ WebSocket LLM 服务器端
 
 import asyncio
 import websockets
-import json
 import time
 import logging
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
 import argparse
+import os
+import sys
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('websocket_llm_server.log', encoding='utf-8')
-    ]
-)
+from message_dispatch import ConnectionDispatcher
+from server_metrics import ServerMetrics, metered_protocol, start_metrics_server
+from request_tracing import Trace
+from message_codec import MessageDecodeError, StaticFrame, codec_for, supported_subprotocols
+from profiling import ProfileError, Profiler
+from log_pipeline import CATEGORY_MESSAGE, CATEGORY_PING, sampled, setup_logging
+from worker_supervisor import WorkerSupervisor, per_worker_path, run_supervisor, serve_until_stopped
+
+# 日志在main()中通过log_pipeline配置为队列+后台线程写入
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -59,11 +60,48 @@ class LLMWebSocketServer:
     - 支持连接管理和错误处理
     """
     
-    def __init__(self, host="0.0.0.0", port=8000):
+    # 内容固定的帧预先编码，每次只拼接时间戳
+    PONG_FRAME = StaticFrame({"type": "pong"})
+    WELCOME_FRAME = StaticFrame({
+        "type": "status",
+        "message": "WebSocket连接已建立",
+        "server_info": {
+            "name": "LLM WebSocket服务器",
+            "version": "1.0.0",
+            "capabilities": ["llm_request", "llm_batch_request", "ping", "status", "cancel"]
+        }
+    })
+    
+    def __init__(self, host="0.0.0.0", port=8000, max_inflight=4, max_batch_size=8, metrics_port=None,
+                 codec="auto", admin_token="", profile_dir="./output", metrics_host=None,
+                 reuse_port=False, drain_timeout=30.0):
         self.host = host
         self.port = port
+        # 多工作进程时通过SO_REUSEPORT共用端口
+        self.reuse_port = reuse_port
+        # 停止时等待在途请求完成的最长时间(秒)
+        self.drain_timeout = drain_timeout
+        # 单个连接同时处理的llm_request数，ping不受限制
+        self.max_inflight = max_inflight
+        # llm_batch_request中一次批量生成的提示数
+        self.max_batch_size = max_batch_size
+        # auto: 客户端声明支持时使用MessagePack；json: 只使用JSON
+        self.codec = codec
+        # profile_request管理消息，admin_token为空时不接受
+        self.profiler = Profiler(admin_token, profile_dir)
         self.connected_clients = set()
         self.request_count = 0
+        self.started_at = time.time()
+        
+        # 运行指标，指定metrics_port时在该端口提供 /metrics
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host or host
+        self.dispatchers = set()
+        self.metrics = ServerMetrics("llm_server")
+        self.metrics.gauge("connections", "当前连接数", lambda: len(self.connected_clients))
+        self.metrics.gauge("inflight_requests", "正在处理的请求数", lambda: sum(d.running for d in self.dispatchers))
+        self.metrics.gauge("queued_requests", "等待处理名额的请求数", lambda: sum(d.queued for d in self.dispatchers))
+        self.metrics.gauge("model_loaded", "模型是否就绪(模拟LLM始终就绪)", lambda: 1, model="mock")
         
         logger.info(f"初始化LLM WebSocket服务器: {host}:{port}")
     
@@ -74,17 +112,7 @@ class LLMWebSocketServer:
         logger.info(f"✅ 新客户端连接: {client_info} (总连接数: {len(self.connected_clients)})")
         
         # 发送欢迎消息
-        welcome_msg = {
-            "type": "status",
-            "message": "WebSocket连接已建立",
-            "server_info": {
-                "name": "LLM WebSocket服务器",
-                "version": "1.0.0",
-                "capabilities": ["llm_request", "ping", "status"]
-            },
-            "timestamp": int(time.time() * 1000)
-        }
-        await websocket.send(json.dumps(welcome_msg, ensure_ascii=False))
+        await websocket.send(self.WELCOME_FRAME.frame(codec_for(websocket)))
     
     async def unregister_client(self, websocket):
         """注销客户端"""
@@ -95,15 +123,28 @@ class LLMWebSocketServer:
     async def handle_client(self, websocket, path):
         """处理客户端连接"""
         await self.register_client(websocket)
+        dispatcher = ConnectionDispatcher(
+            on_error=lambda error, request_id: self.send_error(websocket, error, request_id),
+            max_inflight=self.max_inflight
+        )
+        self.dispatchers.add(dispatcher)
+        codec = codec_for(websocket)
         
         try:
             async for message in websocket:
                 try:
-                    data = json.loads(message)
-                    await self.process_message(websocket, data)
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON解析错误: {e}")
-                    await self.send_error(websocket, "Invalid JSON format", None)
+                    data = codec.decode(message)
+                    self.metrics.inc("messages_total", 1, "收到的消息数", type=str(data.get("type")))
+                    if data.get("type") == "cancel":
+                        # 客户端放弃的请求(如对冲请求落败)，排队或处理中的任务直接取消
+                        if dispatcher.cancel(data.get("requestId")):
+                            logger.info(f"🛑 已取消请求, ID: {data.get('requestId')}")
+                        continue
+                    await dispatcher.dispatch(data.get("type"), data.get("requestId"),
+                                              lambda data=data: self.process_message(websocket, data))
+                except MessageDecodeError as e:
+                    logger.error(f"消息解析错误: {e}")
+                    await self.send_error(websocket, f"Invalid {codec.name.upper()} format", None)
                 except Exception as e:
                     logger.error(f"处理消息错误: {e}")
                     await self.send_error(websocket, str(e), None)
@@ -113,6 +154,8 @@ class LLMWebSocketServer:
         except Exception as e:
             logger.error(f"连接异常: {e}")
         finally:
+            self.dispatchers.discard(dispatcher)
+            await dispatcher.close()
             await self.unregister_client(websocket)
     
     async def process_message(self, websocket, data: Dict[str, Any]):
@@ -120,12 +163,17 @@ class LLMWebSocketServer:
         message_type = data.get("type")
         request_id = data.get("requestId")
         
-        logger.info(f"📨 收到消息类型: {message_type}, ID: {request_id}")
+        if sampled(CATEGORY_MESSAGE):
+            logger.info("📨 收到消息类型: %s, ID: %s", message_type, request_id)
         
         if message_type == "llm_request":
             await self.handle_llm_request(websocket, data)
+        elif message_type == "llm_batch_request":
+            await self.handle_llm_batch_request(websocket, data)
         elif message_type == "ping":
             await self.handle_ping(websocket, data)
+        elif message_type == "profile_request":
+            await self.handle_profile_request(websocket, data)
         else:
             logger.warning(f"未知消息类型: {message_type}")
             await self.send_error(websocket, f"Unknown message type: {message_type}", request_id)
@@ -137,7 +185,7 @@ class LLMWebSocketServer:
         
         try:
             self.request_count += 1
-            logger.info(f"🤖 处理LLM请求 #{self.request_count}, ID: {request_id}")
+            logger.info("🤖 处理LLM请求 #%d, ID: %s", self.request_count, request_id)
             
             # 解析请求数据
             llm_request = LLMRequest(
@@ -148,8 +196,17 @@ class LLMWebSocketServer:
                 temperature=request_data.get("temperature", 0.7)
             )
             
+            # 请求携带追踪上下文时记录本服务器上的阶段耗时
+            trace_context = data.get("trace")
+            trace = Trace("llm_request", trace_context.get("trace_id")) if trace_context else None
+            
             # 调用LLM处理
+            start = time.perf_counter()
             response_text = await self.call_llm_api(llm_request)
+            generated = time.perf_counter()
+            if trace is not None:
+                trace.add_span("llm_server.generate", start, generated)
+            self.metrics.observe("stage_duration_seconds", generated - start, "请求各阶段耗时", stage="llm")
             
             # 构造响应
             response = {
@@ -168,24 +225,85 @@ class LLMWebSocketServer:
                     "total_tokens": len(llm_request.prompt) + len(response_text)
                 }
             }
+            if trace is not None:
+                response["trace"] = {"trace_id": trace.trace_id, "spans": trace.spans}
             
-            await websocket.send(json.dumps(response, ensure_ascii=False))
-            logger.info(f"✅ LLM响应已发送, ID: {request_id}")
+            await websocket.send(codec_for(websocket).encode(response))
+            self.metrics.observe("stage_duration_seconds", time.perf_counter() - generated, "请求各阶段耗时", stage="send")
+            logger.info("✅ LLM响应已发送, ID: %s", request_id)
             
         except Exception as e:
             logger.error(f"LLM请求处理失败: {e}")
             await self.send_error(websocket, f"LLM processing failed: {str(e)}", request_id)
     
+    async def handle_llm_batch_request(self, websocket, data: Dict[str, Any]):
+        """处理批量LLM请求，每生成完一组就发送一帧llm_batch_response"""
+        request_id = data.get("requestId")
+        request_data = data.get("data", {})
+        items = request_data.get("items", [])
+        if not items:
+            await self.send_error(websocket, "Empty batch", request_id)
+            return
+        
+        logger.info("📦 处理批量LLM请求, ID: %s, 共 %d 条", request_id, len(items))
+        completed = 0
+        for start in range(0, len(items), self.max_batch_size):
+            chunk = items[start:start + self.max_batch_size]
+            # 同一组的提示一起生成
+            outputs = await asyncio.gather(*(self.call_llm_api(LLMRequest(
+                prompt=item.get("prompt", ""),
+                system_prompt=item.get("system_prompt") or "你是一个友好的AI助手。",
+                conversation_history=item.get("conversation_history", []),
+                max_tokens=request_data.get("max_tokens", 512),
+                temperature=request_data.get("temperature", 0.7)
+            )) for item in chunk), return_exceptions=True)
+            self.request_count += len(chunk)
+            completed += len(chunk)
+            
+            results = []
+            for offset, output in enumerate(outputs):
+                if isinstance(output, Exception):
+                    results.append({"index": start + offset, "success": False, "error": str(output)})
+                else:
+                    results.append({"index": start + offset, "success": True, "message": output})
+            
+            await websocket.send(codec_for(websocket).encode({
+                "type": "llm_batch_response",
+                "requestId": request_id,
+                "results": results,
+                "completed": completed,
+                "total": len(items),
+                "done": completed >= len(items),
+                "timestamp": int(time.time() * 1000)
+            }))
+        logger.info("✅ 批量LLM响应已发送, ID: %s", request_id)
+    
     async def handle_ping(self, websocket, data: Dict[str, Any]):
         """处理PING消息"""
-        pong_response = {
-            "type": "pong",
-            "timestamp": int(time.time() * 1000)
-        }
-        await websocket.send(json.dumps(pong_response))
-        logger.debug("🏓 PONG响应已发送")
+        await websocket.send(self.PONG_FRAME.frame(codec_for(websocket)))
+        if sampled(CATEGORY_PING):
+            logger.debug("🏓 PONG响应已发送")
+    
+    async def handle_profile_request(self, websocket, data: Dict[str, Any]):
+        """处理剖析请求(管理消息)"""
+        request_id = data.get("requestId")
+        try:
+            result = await self.profiler.handle(data.get("data", {}))
+        except ProfileError as e:
+            await self.send_error(websocket, str(e), request_id, e.code)
+            return
+        
+        await websocket.send(codec_for(websocket).encode({
+            "type": "profile_response",
+            "requestId": request_id,
+            "success": True,
+            "timestamp": int(time.time() * 1000),
+            "data": result
+        }))
+        logger.info(f"🔬 剖析结果已发送, ID: {request_id}")
     
-    async def send_error(self, websocket, error_message: str, request_id: Optional[str]):
+    async def send_error(self, websocket, error_message: str, request_id: Optional[str],
+                         error_code: Optional[str] = None):
         """发送错误响应"""
         error_response = {
             "type": "error",
@@ -194,9 +312,12 @@ class LLMWebSocketServer:
             "error": error_message,
             "timestamp": int(time.time() * 1000)
         }
+        if error_code:
+            error_response["error_code"] = error_code
+        self.metrics.inc("errors_total", 1, "发送的错误响应数")
         
         try:
-            await websocket.send(json.dumps(error_response, ensure_ascii=False))
+            await websocket.send(codec_for(websocket).encode(error_response))
             logger.error(f"❌ 错误响应已发送: {error_message}")
         except Exception as e:
             logger.error(f"发送错误响应失败: {e}")
@@ -261,10 +382,16 @@ class LLMWebSocketServer:
             "port": self.port,
             "connected_clients": len(self.connected_clients),
             "total_requests": self.request_count,
-            "uptime": time.time(),
-            "status": "running"
+            "max_inflight_per_connection": self.max_inflight,
+            "uptime": round(time.time() - self.started_at, 1),
+            "status": "running",
+            "stage_latency": self.metrics.histogram_summary("stage_duration_seconds")
         }
     
+    def pending_requests(self) -> int:
+        """正在处理和排队的请求数，优雅退出时等待其归零"""
+        return sum(d.running + d.queued for d in self.dispatchers)
+    
     async def start_server(self):
         """启动服务器"""
         try:
@@ -280,10 +407,15 @@ class LLMWebSocketServer:
                 self.host, 
                 self.port,
                 ping_interval=20,
-                ping_timeout=10
+                ping_timeout=10,
+                create_protocol=metered_protocol(self.metrics),
+                subprotocols=supported_subprotocols(self.codec),
+                reuse_port=self.reuse_port
             )
             
-            await start_server
+            ws_server = await start_server
+            if self.metrics_port:
+                await start_metrics_server(self.metrics, self.metrics_host, self.metrics_port)
             logger.info("✅ 服务器启动成功！")
             logger.info("💡 提示：")
             logger.info("   1. 使用 Ctrl+C 停止服务器")
@@ -291,8 +423,8 @@ class LLMWebSocketServer:
             logger.info("   3. 前端现在可以连接到这个服务器了")
             logger.info("="*50)
             
-            # 保持服务器运行
-            await asyncio.Future()  # 永远等待
+            # 运行到收到停止信号，然后处理完在途请求再退出
+            await serve_until_stopped(ws_server, self.pending_requests, self.drain_timeout)
             
         except OSError as e:
             if "Address already in use" in str(e):
@@ -315,10 +447,48 @@ def main():
     parser = argparse.ArgumentParser(description='LLM WebSocket服务器')
     parser.add_argument('--host', default='0.0.0.0', help='监听主机地址 (默认: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=8000, help='监听端口 (默认: 8000)')
+    parser.add_argument('--max-inflight', type=int, default=4, help='单个连接并发处理的请求数 (默认: 4)')
+    parser.add_argument('--max-batch-size', type=int, default=8, help='批量请求中一次生成的提示数 (默认: 8)')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Prometheus指标端口，不指定则不启用')
+    parser.add_argument('--codec', choices=['auto', 'json'], default='auto',
+                        help='消息编码：auto在客户端声明支持时使用MessagePack (默认: auto)')
+    parser.add_argument('--admin-token', default=os.environ.get('LLM_ADMIN_TOKEN', ''),
+                        help='profile_request管理消息的令牌，默认读取环境变量LLM_ADMIN_TOKEN，为空时不接受剖析请求')
+    parser.add_argument('--profile-dir', default='./output', help='剖析结果文件目录 (默认: ./output)')
+    parser.add_argument('--log-file', default='websocket_llm_server.log', help='日志文件 (JSON行格式，按大小轮转)')
+    parser.add_argument('--log-sample-message', type=int, default=10, help='消息接收日志每N条记录1条 (默认: 10)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='工作进程数，大于1时由监督进程启动多个进程通过SO_REUSEPORT共用端口 (默认: 1)')
+    parser.add_argument('--drain-timeout', type=float, default=30.0,
+                        help='停止或滚动重启(SIGHUP)时等待在途请求完成的秒数 (默认: 30)')
+    # 以下由监督进程传给工作进程
+    parser.add_argument('--worker-index', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-metrics-port', type=int, default=None, help=argparse.SUPPRESS)
     
     args = parser.parse_args()
     
-    print("""
+    log_listener = setup_logging(per_worker_path(args.log_file, args.worker_index),
+                                 sample_rates={CATEGORY_MESSAGE: args.log_sample_message, CATEGORY_PING: 100})
+    
+    if args.workers > 1 and args.worker_index is None:
+        supervisor = WorkerSupervisor(
+            "LLM WebSocket服务器",
+            lambda index, metrics_port: [sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                                         '--worker-index', str(index), '--worker-metrics-port', str(metrics_port)],
+            args.workers,
+            namespace="llm_server",
+            metrics_host=args.host,
+            metrics_port=args.metrics_port,
+            drain_timeout=args.drain_timeout
+        )
+        try:
+            run_supervisor(supervisor)
+        finally:
+            log_listener.stop()
+        return
+    
+    if args.worker_index is None:
+        print("""
 ╔══════════════════════════════════════════════════════════════╗
 ║                    LLM WebSocket 服务器                      ║
 ║                                                              ║
@@ -330,12 +500,21 @@ def main():
 ╚══════════════════════════════════════════════════════════════╝
     """)
     
-    server = LLMWebSocketServer(host=args.host, port=args.port)
+    # 工作进程的指标只在本机内部端口提供，由监督进程汇总
+    worker = args.worker_index is not None
+    server = LLMWebSocketServer(host=args.host, port=args.port, max_inflight=args.max_inflight,
+                                max_batch_size=args.max_batch_size,
+                                metrics_port=args.worker_metrics_port if worker else args.metrics_port,
+                                codec=args.codec, admin_token=args.admin_token, profile_dir=args.profile_dir,
+                                metrics_host="127.0.0.1" if worker else None,
+                                reuse_port=args.workers > 1, drain_timeout=args.drain_timeout)
     
     try:
         asyncio.run(server.start_server())
     except KeyboardInterrupt:
         print("\n👋 再见！")
+    finally:
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+多进程服务
+监督进程启动N个工作进程，工作进程通过SO_REUSEPORT监听同一端口，由内核分配新连接：
+- 工作进程异常退出时按退避间隔重启
+- 收到SIGHUP时逐个滚动重启：新进程就绪后旧进程停止接受连接，处理完在途请求再退出
+- 监督进程的 /metrics 汇总各工作进程的指标
+
+工作进程的指标只监听在127.0.0.1的内部端口上，同时用作就绪检查。
+ForkingWorkerSupervisor由监督进程直接fork工作进程，fork前加载的只读数据(如CPU上的模型权重)以写时复制方式共享
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from server_metrics import ServerMetrics, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+# 汇总时不求和的指标，其余计数器、直方图和瞬时值按相同标签求和
+_GAUGE_MERGE = {"uptime_seconds": max, "model_loaded": min}
+
+
+def reuse_port_supported() -> bool:
+    """当前平台是否支持SO_REUSEPORT(Windows不支持)"""
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def per_worker_path(path: str, index: Optional[int]) -> str:
+    """日志、追踪等文件每个工作进程各写一份，避免多进程同时追加和轮转同一文件"""
+    if index is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{index}{ext}"
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+async def serve_until_stopped(ws_server, pending: Callable[[], int], drain_timeout: float):
+    """
+    运行到收到SIGTERM/SIGINT后优雅退出：先关闭监听(同端口的其他工作进程继续接受连接)，
+    等待在途请求处理完或超过drain_timeout，再以1001关闭剩余连接让客户端重连
+
+    Args:
+        ws_server: websockets.serve返回的服务器
+        pending: 返回正在处理和排队的请求数
+    """
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    try:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+    except (NotImplementedError, AttributeError):
+        # Windows不支持add_signal_handler，保持原来Ctrl+C直接退出的行为
+        pass
+    await stop
+
+    logger.info(f"⏳ 停止接受新连接，等待在途请求完成 (最多 {drain_timeout:g}s)")
+    ws_server.server.close()
+    deadline = time.monotonic() + drain_timeout
+    while pending() > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    remaining = pending()
+    if remaining:
+        logger.warning(f"⚠️ 等待超时，仍有 {remaining} 个请求未完成")
+    ws_server.close()
+    await ws_server.wait_closed()
+    logger.info("🔚 连接已关闭，进程退出")
+
+
+def merge_metrics(texts: List[str], namespace: str) -> str:
+    """把多个工作进程的Prometheus文本按指标名和标签合并"""
+    families: Dict[str, Dict] = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                _, keyword, name, rest = (line.split(" ", 3) + [""])[:4]
+                family = families.setdefault(name, {"help": "", "kind": "untyped", "series": {}})
+                family["help" if keyword == "HELP" else "kind"] = rest
+            elif line and family is not None:
+                key, _, value = line.rpartition(" ")
+                try:
+                    value = float(value)
+                except ValueError:
+                    continue
+                family["series"].setdefault(key, []).append(value)
+
+    lines = []
+    prefix = namespace + "_"
+    for name, family in families.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        combine = _GAUGE_MERGE.get(name[len(prefix):] if name.startswith(prefix) else name, sum)
+        for key, values in family["series"].items():
+            lines.append(f"{key} {combine(values):g}")
+    return "\n".join(lines) + "\n"
+
+
+async def fetch_metrics(port: int, timeout: float = 2.0) -> Optional[str]:
+    """读取127.0.0.1:port/metrics，失败时返回None"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    try:
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+        response = await asyncio.wait_for(reader.read(), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    if not head.startswith(b"HTTP/1.1 200"):
+        return None
+    return body.decode("utf-8")
+
+
+class ForkedProcess:
+    """os.fork出的工作进程，提供WorkerSupervisor用到的asyncio.subprocess.Process接口"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+
+    def _poll(self) -> Optional[int]:
+        if self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                self.returncode = -1
+                return self.returncode
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    async def wait(self) -> int:
+        while self._poll() is None:
+            await asyncio.sleep(0.2)
+        return self.returncode
+
+    def send_signal(self, sig: int):
+        if self._poll() is None:
+            os.kill(self.pid, sig)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+@dataclass
+class WorkerProcess:
+    """一个工作进程"""
+    index: int
+    metrics_port: int
+    process: asyncio.subprocess.Process
+    started_at: float = field(default_factory=time.monotonic)
+    # 已被滚动重启替换，退出后不再重启
+    retired: bool = False
+    # 内部指标端口可访问后视为就绪
+    ready: bool = False
+    watcher: Optional[asyncio.Task] = None
+    ready_check: Optional[asyncio.Task] = None
+
+
+class WorkerSupervisor:
+    """
+    启动并看管工作进程
+
+    Args:
+        name: 日志中的服务名
+        command: (序号, 内部指标端口) -> 工作进程的命令行
+        workers: 工作进程数
+        namespace: 工作进程指标的前缀，用于汇总
+        metrics_host/metrics_port: 汇总指标的监听地址，metrics_port为None时不启用
+        drain_timeout: 工作进程优雅退出的等待时间
+        ready_timeout: 新工作进程加载模型并就绪的最长时间
+        on_all_ready: 全部工作进程就绪后调用(启动、重启和滚动重启完成后各一次)
+    """
+
+    def __init__(self, name: str, command: Optional[Callable[[int, int], List[str]]], workers: int, namespace: str,
+                 metrics_host: str = "0.0.0.0", metrics_port: Optional[int] = None,
+                 drain_timeout: float = 30.0, ready_timeout: float = 300.0,
+                 restart_delay: float = 1.0, max_restart_delay: float = 30.0,
+                 on_all_ready: Optional[Callable[["WorkerSupervisor"], Awaitable[None]]] = None):
+        self.name = name
+        self.command = command
+        self.on_all_ready = on_all_ready
+        self.worker_count = workers
+        self.namespace = namespace
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.drain_timeout = drain_timeout
+        self.ready_timeout = ready_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+
+        self.workers: Dict[int, WorkerProcess] = {}
+        self.all_processes: List[WorkerProcess] = []
+        self.restart_delays: Dict[int, float] = {}
+        self.stopping = False
+        self.reloading = False
+        self.metrics_server: Optional[asyncio.AbstractServer] = None
+
+        self.metrics = ServerMetrics(namespace + "_supervisor")
+        self.metrics.gauge("workers", "运行中的工作进程数",
+                           lambda: sum(1 for w in self.workers.values() if w.process.returncode is None))
+        self.metrics.gauge("workers_ready", "已就绪的工作进程数",
+                           lambda: sum(1 for w in self.workers.values() if w.ready and w.process.returncode is None))
+        self.metrics.gauge("workers_configured", "配置的工作进程数", lambda: self.worker_count)
+
+    async def start_process(self, index: int, metrics_port: int):
+        """启动一个工作进程的进程本身"""
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        return await asyncio.create_subprocess_exec(*self.command(index, metrics_port), env=env)
+
+    async def spawn(self, index: int) -> WorkerProcess:
+        metrics_port = free_port()
+        process = await self.start_process(index, metrics_port)
+        worker = WorkerProcess(index, metrics_port, process)
+        self.workers[index] = worker
+        self.all_processes.append(worker)
+        logger.info(f"👷 工作进程 #{index} 已启动 (pid {process.pid})")
+        worker.watcher = asyncio.create_task(self._watch(worker))
+        worker.ready_check = asyncio.create_task(self.wait_ready(worker, self.ready_timeout))
+        return worker
+
+    async def _watch(self, worker: WorkerProcess):
+        code = await worker.process.wait()
+        self.all_processes.remove(worker)
+        if self.stopping or worker.retired:
+            logger.info(f"👋 工作进程 #{worker.index} (pid {worker.process.pid}) 已退出: {code}")
+            return
+        if self.workers.get(worker.index) is not worker:
+            return
+
+        # 启动后很快退出说明在反复崩溃，退避间隔加倍；运行较久后崩溃则从头计算
+        uptime = time.monotonic() - worker.started_at
+        previous = self.restart_delays.get(worker.index)
+        delay = min(previous * 2, self.max_restart_delay) if previous and uptime < 10 else self.restart_delay
+        self.restart_delays[worker.index] = delay
+        self.metrics.inc("worker_restarts_total", 1, "工作进程异常退出后的重启次数")
+        logger.error(f"💥 工作进程 #{worker.index} (pid {worker.process.pid}) 异常退出: {code}，"
+                     f"{delay:g}s 后重启")
+        await asyncio.sleep(delay)
+        if not self.stopping and self.workers.get(worker.index) is worker:
+            await self.spawn(worker.index)
+
+    async def wait_ready(self, worker: WorkerProcess, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and worker.process.returncode is None:
+            if await fetch_metrics(worker.metrics_port) is not None:
+                worker.ready = True
+                logger.info(f"✅ 工作进程 #{worker.index} (pid {worker.process.pid}) 已就绪")
+                # 滚动重启中由reload在全部替换后调用
+                if not self.reloading:
+                    await self._notify_all_ready()
+                return True
+            await asyncio.sleep(0.5)
+        return False
+
+    async def _notify_all_ready(self):
+        if self.on_all_ready is None or self.stopping:
+            return
+        if len(self.workers) == self.worker_count and all(w.ready for w in self.workers.values()):
+            try:
+                await self.on_all_ready(self)
+            except Exception as e:
+                logger.warning(f"⚠️ 就绪回调失败: {e}")
+
+    def _terminate(self, worker: WorkerProcess):
+        if worker.process.returncode is None:
+            worker.process.send_signal(signal.SIGTERM)
+
+    async def reload(self):
+        """滚动重启：每个序号先启动新进程并等它就绪，再让旧进程优雅退出"""
+        if self.reloading or self.stopping:
+            return
+        self.reloading = True
+        logger.info(f"🔄 开始滚动重启 {self.worker_count} 个工作进程")
+        try:
+            for index in range(self.worker_count):
+                old = self.workers.get(index)
+                new = await self.spawn(index)
+                if not await new.ready_check:
+                    logger.error(f"❌ 新工作进程 #{index} 未能就绪，保留旧进程并停止滚动重启")
+                    new.retired = True
+                    self._terminate(new)
+                    if old is not None:
+                        self.workers[index] = old
+                    return
+                if old is not None:
+                    old.retired = True
+                    self._terminate(old)
+            logger.info("✅ 滚动重启完成")
+        finally:
+            self.reloading = False
+        await self._notify_all_ready()
+
+    async def render(self) -> str:
+        """汇总各工作进程的指标，附加监督进程自身的指标"""
+        texts = await asyncio.gather(*(fetch_metrics(w.metrics_port) for w in list(self.workers.values())))
+        return merge_metrics([text for text in texts if text], self.namespace) + self.metrics.render()
+
+    async def stop(self):
+        self.stopping = True
+        logger.info("⏹️ 正在停止所有工作进程...")
+        for worker in list(self.all_processes):
+            self._terminate(worker)
+        waits = [asyncio.create_task(w.process.wait()) for w in list(self.all_processes)]
+        if waits:
+            _, pending = await asyncio.wait(waits, timeout=self.drain_timeout + 10)
+            if pending:
+                logger.warning(f"⚠️ {len(pending)} 个工作进程未按时退出，强制结束")
+                for worker in list(self.all_processes):
+                    if worker.process.returncode is None:
+                        worker.process.kill()
+                await asyncio.wait(pending)
+
+    async def run(self):
+        """启动全部工作进程，运行到收到SIGTERM/SIGINT"""
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        loop.add_signal_handler(signal.SIGTERM, lambda: stop.done() or stop.set_result(None))
+        loop.add_signal_handler(signal.SIGINT, lambda: stop.done() or stop.set_result(None))
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.reload()))
+
+        logger.info(f"🚀 {self.name}: 启动 {self.worker_count} 个工作进程 (SO_REUSEPORT)，"
+                    f"监督进程 pid {os.getpid()}，发送SIGHUP滚动重启")
+        for index in range(self.worker_count):
+            await self.spawn(index)
+
+        if self.metrics_port:
+            self.metrics_server = await start_metrics_server(self, self.metrics_host, self.metrics_port)
+        try:
+            await stop
+        finally:
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+            await self.stop()
+
+
+class ForkingWorkerSupervisor(WorkerSupervisor):
+    """
+    由监督进程直接fork工作进程，重启和滚动重启同样重新fork，
+    工作进程始终与监督进程共享fork前加载的内存页；滚动重启不会重新加载这些数据
+
+    Args:
+        target: (序号, 内部指标端口) -> None，在fork出的子进程中运行工作进程直到退出，
+            通常以serve_until_stopped结束；其余参数同WorkerSupervisor
+    """
+
+    def __init__(self, name: str, target: Callable[[int, int], None], workers: int, namespace: str, **kwargs):
+        super().__init__(name, None, workers, namespace, **kwargs)
+        self.target = target
+
+    async def start_process(self, index: int, metrics_port: int):
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(index, metrics_port)
+        return ForkedProcess(pid)
+
+    def _run_child(self, index: int, metrics_port: int):
+        """子进程：丢弃继承的事件循环和信号处理，运行target后直接退出，不回到监督进程的调用栈"""
+        code = 0
+        try:
+            asyncio.events._set_running_loop(None)
+            signal.set_wakeup_fd(-1)
+            # SIGTERM/SIGINT不恢复为默认的直接终止：开始服务前(尚无在途请求)以KeyboardInterrupt结束启动，
+            # 开始服务后由serve_until_stopped接管，处理完在途请求再退出
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, signal.default_int_handler)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            if self.metrics_server is not None:
+                # 只关闭子进程中继承的副本，监督进程的监听不受影响
+                for sock in self.metrics_server.sockets:
+                    os.close(sock.fileno())
+            self.target(index, metrics_port)
+        except KeyboardInterrupt:
+            logger.info(f"👋 工作进程 #{index} 就绪前收到停止信号")
+        except BaseException:
+            logger.exception(f"❌ 工作进程 #{index} 异常退出")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+
+def run_supervisor(supervisor: WorkerSupervisor):
+    """在当前进程运行监督进程，平台不支持SO_REUSEPORT(或fork)时直接退出"""
+    if not reuse_port_supported():
+        logger.error("❌ 当前平台不支持SO_REUSEPORT，无法使用多工作进程，请把workers设为1")
+        sys.exit(1)
+    if isinstance(supervisor, ForkingWorkerSupervisor) and not hasattr(os, "fork"):
+        logger.error("❌ 当前平台不支持fork，无法共享fork前加载的数据")
+        sys.exit(1)
+    asyncio.run(supervisor.run())